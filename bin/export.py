@@ -10,13 +10,15 @@ def main():
 	parser.add_argument('database', help='Database to use')
 	parser.add_argument('filename', help='Metadata filename to create')
 	parser.add_argument('--config', '-c', help='override default rigor.ini to use')
+	parser.add_argument('--tag', '-t', help='only export percepts with this tag')
+	parser.add_argument('--json-lines', '-l', action='store_true', default=False, help='write one JSON object per line, instead of a single JSON array')
 	args = parser.parse_args()
 	if args.config:
 		config = RigorDefaultConfiguration(args.config)
 	else:
 		config = RigorDefaultConfiguration()
-	exporter = Exporter(config, args.database, args.filename)
-	exporter.run()
+	exporter = Exporter(config, args.database, args.filename, json_lines=args.json_lines)
+	exporter.run(args.tag)
 
 if __name__ == '__main__':
 	main()
@@ -4,30 +4,22 @@ import rigor.interop
 from rigor.config import RigorDefaultConfiguration
 
 import argparse
-import os 
-import glob
-import json
 
 def main():
 	parser = argparse.ArgumentParser(description='Imports percepts and metadata into the database')
 	parser.add_argument('-c', '--config', type=str, default='~/.rigor.ini', help='Path to .rigor.ini config file.  Default: ~/.rigor.ini')
 	parser.add_argument('-n', '--no-copy', action='store_true', default=False, help="Don't copy data into the Rigor repository; just keep it in place (not recommended)")
+	parser.add_argument('-b', '--batch-size', type=int, default=1, help='Number of percepts to commit at a time. With more than one, percepts that fail to import are logged and skipped. Default: 1')
+	parser.add_argument('-t', '--threads', type=int, default=1, help='Number of threads used to copy percept data. Default: 1')
+	parser.add_argument('-d', '--dedup', choices=(rigor.interop.kDedupLink, rigor.interop.kDedupReject), help='When data is already in the repository, link to it instead of copying it, or reject the percept')
+	parser.add_argument('-j', '--journal', help='File recording which percepts have been imported. If the import is interrupted, run it again with the same journal to pick up where it left off')
 	parser.add_argument('database', help='Name of database to use')
-	parser.add_argument('metadata', help='Path to metadata file to import containing one or more percepts, or directory with multiple metadata json files where each contains a single percept')
+	parser.add_argument('metadata', help='Path to metadata file to import containing a JSON array of percepts or one percept per line, or directory with multiple metadata json files where each contains a single percept')
 	args = parser.parse_args()
 
-	# If we are given a directory combine all the json files within into one list to use for import
-	metadata = args.metadata
-	if os.path.isdir(metadata):
-		metadata_paths = glob.glob(os.path.join(metadata, '*.json'))
-		metadata = list()
-		for metadata_path in metadata_paths:
-			with open(metadata_path, "rb") as metadata_file:
-				metadata.append(json.load(metadata_file))
-
 	config = RigorDefaultConfiguration(args.config)
 	copy_data = not args.no_copy
-	i = rigor.interop.Importer(config, args.database, metadata, copy_data)
+	i = rigor.interop.Importer(config, args.database, args.metadata, copy_data, batch_size=args.batch_size, threads=args.threads, dedup=args.dedup, journal=args.journal)
 	i.run()
 
 if __name__ == '__main__':
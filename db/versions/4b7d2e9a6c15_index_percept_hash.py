@@ -0,0 +1,22 @@
+"""Index percept hash
+
+Revision ID: 4b7d2e9a6c15
+Revises: 3c0336c4339d
+Create Date: 2026-10-18 06:50:12.418337
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b7d2e9a6c15'
+down_revision = '3c0336c4339d'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+	op.create_index('percept_hash_idx', 'percept', ['hash'])
+
+def downgrade():
+	op.drop_index('percept_hash_idx', 'percept')
@@ -13,7 +13,7 @@ class AllPerceptRunner(rigor.runner.DatabaseRunner):
 		self._session = self._database.get_session()
 
 	def get_percepts(self):
-		return self._session.query(rigor.types.Percept).order_by(rigor.types.Percept.id).all()
+		return self._session.query(rigor.types.Percept).order_by(rigor.types.Percept.id).yield_per(100)
 
 	def evaluate(self, results):
 		print('Percept\tExpected\tActual')
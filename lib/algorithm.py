@@ -83,7 +83,16 @@ class Algorithm(object):
 		:param dict percept: percept metadata
 		:param file percept_data: percept data
 		"""
-		percept_data = self.postfetch(percept, percept_data)
+		return self.apply_postfetched(percept, self.postfetch(percept, percept_data))
+
+	def apply_postfetched(self, percept, percept_data):
+		"""
+		Does the same as :py:meth:`apply`, for data that has already been passed
+		through :py:meth:`postfetch`
+
+		:param dict percept: percept metadata
+		:param percept_data: percept data returned by :py:meth:`postfetch`
+		"""
 		start_time = time.time()
 		result = self.run(percept_data)
 		elapsed = time.time() - start_time
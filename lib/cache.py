@@ -0,0 +1,161 @@
+""" Local on-disk cache for percept data stored in remote repositories """
+
+import rigor.logger
+import rigor.utils
+
+import tempfile
+import hashlib
+import shutil
+import fcntl
+import errno
+import time
+import os
+
+#: Default maximum size of the cache, in bytes
+kDefaultSizeLimit = 10 * 1024 * 1024 * 1024
+
+#: When the cache is over its limit, entries are evicted until it is at this fraction of the limit
+kEvictionTarget = 0.9
+
+#: Temporary files older than this many seconds are assumed to have been abandoned
+kTemporaryFileTimeout = 3600
+
+kTemporaryPrefix = '.tmp-'
+kLockFilename = '.lock'
+
+class DiskCache(object):
+	"""
+	Content-addressed cache of percept data in a local directory. When the total
+	size of the cache grows past its limit, the least-recently used entries are
+	removed. Entries are written atomically, and several processes on the same
+	host can safely share a cache directory.
+
+	:param str path: directory containing the cache
+	:param int size_limit: maximum size of the cache, in bytes
+	"""
+
+	def __init__(self, path, size_limit=kDefaultSizeLimit):
+		self._logger = rigor.logger.get_logger('.'.join((__name__, self.__class__.__name__)))
+		self.path = path
+		self._size_limit = size_limit
+		rigor.utils.ensure_path_exists(path)
+		self._size = self._scan()[0]
+
+	@staticmethod
+	def key_for(percept):
+		"""
+		Returns the cache key for a percept; its hash, if it has one, otherwise a key derived from its locator
+
+		:param percept: percept metadata
+		:return: cache key
+		:rtype: str
+		"""
+		if percept.hash:
+			return str(percept.hash)
+		return 'locator-' + hashlib.sha256(percept.locator.encode('utf-8')).hexdigest()
+
+	def _path_for(self, key):
+		""" Path to the file holding the cache entry for a key """
+		return os.path.join(self.path, key[-2:], key)
+
+	def get(self, key):
+		"""
+		Opens a cache entry for reading, and marks it as recently used
+
+		:param str key: cache key
+		:return: open file, or :py:const:`None` if the key is not in the cache
+		:rtype: file
+		"""
+		path = self._path_for(key)
+		try:
+			cached = open(path, 'rb')
+		except IOError as err:
+			if err.errno == errno.ENOENT:
+				return None
+			raise
+		try:
+			os.utime(path, None)
+		except OSError:
+			pass # Evicted by another process after being opened; the open file is still readable
+		return cached
+
+	def put(self, key, data):
+		"""
+		Stores data in the cache, replacing any existing entry with the same key
+
+		:param str key: cache key
+		:param file data: file-like object containing the data to store
+		:return: the cached data, opened for reading
+		:rtype: file
+		"""
+		path = self._path_for(key)
+		rigor.utils.ensure_path_exists(os.path.dirname(path))
+		temporary = tempfile.NamedTemporaryFile('wb', prefix=kTemporaryPrefix, dir=self.path, delete=False)
+		try:
+			with temporary:
+				shutil.copyfileobj(data, temporary)
+			# Opened before the rename, so that it stays readable even if it is evicted right away
+			cached = open(temporary.name, 'rb')
+			try:
+				replaced = os.stat(path).st_size
+			except OSError:
+				replaced = 0
+			os.rename(temporary.name, path)
+		except:
+			os.unlink(temporary.name)
+			raise
+		self._size += os.fstat(cached.fileno()).st_size - replaced
+		if self._size > self._size_limit:
+			self.evict()
+		return cached
+
+	def _scan(self):
+		"""
+		Finds all cache entries, removing abandoned temporary files
+
+		:return: (total size in bytes, list of (last used, size, path) tuples)
+		"""
+		now = time.time()
+		total = 0
+		entries = list()
+		for directory, _, filenames in os.walk(self.path):
+			for filename in filenames:
+				if filename == kLockFilename:
+					continue
+				path = os.path.join(directory, filename)
+				try:
+					stat = os.stat(path)
+					if filename.startswith(kTemporaryPrefix):
+						if now - stat.st_mtime > kTemporaryFileTimeout:
+							os.unlink(path)
+						continue
+				except OSError:
+					continue # Removed by another process
+				total += stat.st_size
+				entries.append((stat.st_mtime, stat.st_size, path))
+		return (total, entries)
+
+	def evict(self):
+		"""
+		Removes the least-recently used entries until the cache is comfortably under
+		its size limit. Only one process evicts at a time.
+		"""
+		with open(os.path.join(self.path, kLockFilename), 'a') as lock_file:
+			fcntl.flock(lock_file, fcntl.LOCK_EX)
+			try:
+				total, entries = self._scan()
+				target = self._size_limit * kEvictionTarget
+				removed = 0
+				for _, size, path in sorted(entries):
+					if total <= target:
+						break
+					try:
+						os.unlink(path)
+					except OSError:
+						continue
+					total -= size
+					removed += 1
+				self._size = total
+			finally:
+				fcntl.flock(lock_file, fcntl.LOCK_UN)
+		self._logger.debug("Evicted {0} entries from cache at {1}".format(removed, self.path))
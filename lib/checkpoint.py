@@ -1,13 +1,323 @@
 """ Saved progress for Rigor, allowing users to resume long-running runs that fail part way through """
 
 import rigor.logger
+import collections
+import threading
 import tempfile
+import bisect
+import struct
+import errno
+import Queue
 import time
 import cPickle as pickle
 import os
 
 kPickleProtocol = pickle.HIGHEST_PROTOCOL
 
+#: Written after the header of checkpoint files whose entries are stored as length-prefixed records. Older files have a pickled (ID, entry) tuple for each entry instead.
+kRecordMarker = 'rigor-checkpoint-records'
+
+#: Precedes each record: lengths of the pickled percept ID and pickled entry that follow
+kRecordHeader = struct.Struct('<II')
+
+#: Appended to the name of a checkpoint file to get the name of its index, which holds the percept ID and offset of each record
+kIndexSuffix = '.index'
+
+#: Format of each entry in a checkpoint index: percept ID and offset of its record in the checkpoint file
+kIndexEntry = struct.Struct('<qq')
+
+#: Appended to the name of a sharded checkpoint, along with the shard's name, to get the name of the shard's file
+kShardSuffix = '.shard-'
+
+#: By default, logged entries are flushed to the checkpoint file once this many have accumulated
+kFlushEntries = 100
+
+#: By default, logged entries are flushed to the checkpoint file at least this often, in seconds
+kFlushInterval = 1.0
+
+#: Maximum number of entries waiting for the background writer thread before :py:meth:`Checkpointer.log` blocks
+kWriterQueueSize = 10000
+
+def _pack_record(id, entry):
+	""" Serializes a single entry record """
+	id_data = pickle.dumps(id, kPickleProtocol)
+	entry_data = pickle.dumps(entry, kPickleProtocol)
+	return kRecordHeader.pack(len(id_data), len(entry_data)) + id_data + entry_data
+
+def _write_record(checkpoint_file, id, entry):
+	""" Appends a single entry record to a checkpoint file """
+	checkpoint_file.write(_pack_record(id, entry))
+
+def _read_record(checkpoint_file):
+	"""
+	Reads the entry record at the current position in a checkpoint file
+
+	:return: (ID, entry), or :py:const:`None` at the end of the file or if the record is incomplete
+	"""
+	header = checkpoint_file.read(kRecordHeader.size)
+	if len(header) < kRecordHeader.size:
+		return None
+	id_length, entry_length = kRecordHeader.unpack(header)
+	data = checkpoint_file.read(id_length + entry_length)
+	if len(data) < id_length + entry_length:
+		return None
+	return pickle.loads(data[:id_length]), pickle.loads(data[id_length:])
+
+def _scan_records(checkpoint_file, ids, offsets):
+	"""
+	Finds the ID and offset of each complete entry record, from the current position in a checkpoint file to its end, without unpickling the entries
+
+	:param list ids: list to append the IDs to
+	:param list offsets: list to append the offsets to
+	:return: offset of the end of the last complete record
+	"""
+	size = os.fstat(checkpoint_file.fileno()).st_size
+	end = checkpoint_file.tell()
+	while True:
+		header = checkpoint_file.read(kRecordHeader.size)
+		if len(header) < kRecordHeader.size:
+			break
+		id_length, entry_length = kRecordHeader.unpack(header)
+		id_data = checkpoint_file.read(id_length)
+		record_end = end + kRecordHeader.size + id_length + entry_length
+		if len(id_data) < id_length or record_end > size:
+			break
+		ids.append(pickle.loads(id_data))
+		offsets.append(end)
+		checkpoint_file.seek(record_end)
+		end = record_end
+	return end
+
+def index_filename(filename):
+	""" Returns the name of the index file for a checkpoint file """
+	return filename + kIndexSuffix
+
+def shard_filename(filename, shard):
+	"""
+	Returns the name of the file for one shard of a sharded checkpoint
+
+	:param str filename: path to the checkpoint
+	:param shard: name of the shard, such as a worker number or host name
+	"""
+	return '{0}{1}{2}'.format(filename, kShardSuffix, shard)
+
+def find_shards(filename):
+	"""
+	Finds the files for all shards of a sharded checkpoint
+
+	:param str filename: path to the checkpoint
+	:return: sorted list of paths to shard files
+	"""
+	directory, name = os.path.split(filename)
+	prefix = name + kShardSuffix
+	try:
+		names = os.listdir(directory or os.curdir)
+	except OSError as err:
+		if err.errno == errno.ENOENT:
+			return list()
+		raise
+	return sorted(os.path.join(directory, entry) for entry in names if entry.startswith(prefix) and not entry.endswith(kIndexSuffix))
+
+def _pack_index_entry(id, offset):
+	"""
+	Serializes an index entry
+
+	:return: the entry, or :py:const:`None` if the ID cannot be stored in the index
+	"""
+	if not isinstance(id, (int, long)):
+		return None
+	try:
+		return kIndexEntry.pack(id, offset)
+	except struct.error:
+		return None
+
+def _read_index(filename, start, size):
+	"""
+	Reads the entries of a checkpoint index that refer to records within the checkpoint file
+
+	:param str filename: path to the checkpoint file
+	:param int start: offset of the first record
+	:param int size: size of the checkpoint file
+	:return: (list of IDs, list of offsets)
+	"""
+	try:
+		with open(index_filename(filename), 'rb') as index_file:
+			data = index_file.read()
+	except IOError as err:
+		if err.errno == errno.ENOENT:
+			return list(), list()
+		raise
+	count = len(data) // kIndexEntry.size
+	values = struct.unpack('<{0}q'.format(count * 2), data[:count * kIndexEntry.size])
+	ids = list(values[0::2])
+	offsets = list(values[1::2])
+	if not offsets or offsets[0] != start:
+		return list(), list()
+	count = bisect.bisect_left(offsets, size)
+	return ids[:count], offsets[:count]
+
+def _load_records(checkpoint_file, filename):
+	"""
+	Finds the ID and offset of each complete entry record in a checkpoint file,
+	from the current position, using its index where possible. Records after the
+	last one in the index are found by scanning the file.
+
+	:param str filename: path to the checkpoint file
+	:return: (list of IDs, list of offsets, number of records found in the index, offset of the end of the last complete record)
+	"""
+	start = checkpoint_file.tell()
+	ids, offsets = _read_index(filename, start, os.fstat(checkpoint_file.fileno()).st_size)
+	indexed = len(offsets)
+	if indexed:
+		# Scanning from the last indexed record also checks that it is intact, and for the same percept
+		last_id = ids.pop()
+		checkpoint_file.seek(offsets.pop())
+		end = _scan_records(checkpoint_file, ids, offsets)
+		if len(ids) >= indexed and ids[indexed - 1] == last_id:
+			return ids, offsets, indexed, end
+		ids, offsets = list(), list()
+		checkpoint_file.seek(start)
+	return ids, offsets, 0, _scan_records(checkpoint_file, ids, offsets)
+
+def _read_entry(checkpoint_file, offset, is_records):
+	"""
+	Reads the entry at an offset in a checkpoint file
+
+	:param bool is_records: whether the file stores entries as records, rather than in the older format
+	:return: (ID, entry)
+	"""
+	checkpoint_file.seek(offset)
+	if is_records:
+		return _read_record(checkpoint_file)
+	return pickle.load(checkpoint_file)
+
+#: Checkpoint entry holding just the parts of an algorithm's result that are not already stored in the database; see :py:meth:`~rigor.runner.Runner.compact_result`
+CompactResult = collections.namedtuple('CompactResult', ('percept_id', 'result', 'elapsed'))
+
+class CheckpointFile(object):
+	"""
+	Read access to the entries saved in a checkpoint file, in either format,
+	without loading them all into memory. Only the percept ID and offset of each
+	entry are read up front, from the checkpoint's index if it has one; entries
+	are read from the file when they are iterated over or looked up.
+
+	Iterating over a :py:class:`CheckpointFile` yields the saved entries in the
+	order they were logged, and indexing it with a percept ID returns that
+	percept's entry. Entries logged to the file after it has been opened are not
+	included.
+
+	:param str filename: path to the checkpoint file
+
+	In addition to the header's *timestamp* and *parameters*, it has these attributes:
+
+	* *is_records*: whether entries are stored as records, rather than in the older format
+	* *indexed*: number of entries that were found in the checkpoint's index
+	* *end*: offset of the end of the last complete entry in the file
+	"""
+
+	def __init__(self, filename):
+		self.filename = filename
+		with open(filename, 'rb') as checkpoint_file:
+			self.timestamp, self.parameters = Checkpointer.read_header(checkpoint_file)
+			position = checkpoint_file.tell()
+			try:
+				self.is_records = (pickle.load(checkpoint_file) == kRecordMarker)
+			except EOFError:
+				self.is_records = False
+			if self.is_records:
+				self._ids, self._offsets, self.indexed, self.end = _load_records(checkpoint_file, filename)
+			else:
+				checkpoint_file.seek(position)
+				self._ids, self._offsets, self.indexed, self.end = self._scan_entries(checkpoint_file)
+		self._positions = None
+		self._seen = None
+		self._file = None
+
+	@staticmethod
+	def _scan_entries(checkpoint_file):
+		""" Finds the ID and offset of each entry in a checkpoint file in the older format """
+		ids = list()
+		offsets = list()
+		while True:
+			offset = checkpoint_file.tell()
+			try:
+				id, _ = pickle.load(checkpoint_file)
+			except EOFError:
+				break
+			ids.append(id)
+			offsets.append(offset)
+		return ids, offsets, 0, checkpoint_file.tell()
+
+	@property
+	def ids(self):
+		""" Percept IDs of the saved entries, in the order they were logged """
+		return self._ids
+
+	@property
+	def offsets(self):
+		""" Offsets of the saved entries in the checkpoint file """
+		return self._offsets
+
+	@property
+	def seen(self):
+		""" Set of percept IDs with saved entries """
+		if self._seen is None:
+			self._seen = set(self._ids)
+		return self._seen
+
+	def __len__(self):
+		return len(self._offsets)
+
+	def __iter__(self):
+		for _, entry in self.iteritems():
+			yield entry
+
+	def iteritems(self):
+		"""
+		Reads each saved entry, along with its percept ID
+
+		:return: iterator of (ID, entry) tuples
+		"""
+		with open(self.filename, 'rb') as checkpoint_file:
+			for offset in self._offsets:
+				yield _read_entry(checkpoint_file, offset, self.is_records)
+
+	def __contains__(self, id):
+		return id in self.seen
+
+	def __getitem__(self, id):
+		"""
+		Reads the entry saved for a percept. If there is more than one, the last one is returned.
+
+		:param id: percept ID
+		:return: the saved entry
+		"""
+		if self._positions is None:
+			self._positions = dict(zip(self._ids, self._offsets))
+		offset = self._positions[id]
+		if self._file is None:
+			self._file = open(self.filename, 'rb')
+		return _read_entry(self._file, offset, self.is_records)[1]
+
+	def get(self, id, default=None):
+		""" Reads the entry saved for a percept, or returns *default* if there is none """
+		try:
+			return self[id]
+		except KeyError:
+			return default
+
+	def close(self):
+		""" Closes the file used for looking up entries, if it is open """
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, value, traceback):
+		self.close()
+
 class Checkpoint(object):
 	""" Saved checkpoint results, loaded from a file """
 
@@ -16,7 +326,7 @@ class Checkpoint(object):
 		:param timestamp: when the checkpoint file was first created
 		:param dict parameters: parameters used in the original run
 		:param set(int) seen: a set of IDs that have been checkpointed already, to make it easy to skip duplicate evaluations
-		:param results: the saved results
+		:param results: the saved results, as a list or :py:class:`CheckpointFile`
 		"""
 		self.timestamp = timestamp
 		self.parameters = parameters
@@ -27,7 +337,10 @@ class NullCheckpointer(object):
 	"""
 	Does nothing. Used in place of actual checkpointer to make code simpler in :py:class:`~rigor.Runner`.
 	"""
-	def log(self, id, entry, flush=True):
+	def log(self, id, entry, flush=None):
+		pass
+
+	def flush(self):
 		pass
 
 	def __enter__(self):
@@ -40,13 +353,28 @@ class Checkpointer(object):
 	"""
 	Saves progress of algorithm evaluations in a file, to be loaded later
 	if there is an error and the evaluation is interrupted
+
+	Logged entries are committed in groups: they are flushed to the file once
+	*flush_entries* have accumulated, or *flush_interval* seconds after the last
+	flush, whichever comes first. Entries that have not been flushed are lost if
+	the process dies. Flushing only hands data to the operating system; for entries
+	to survive a crash of the host as well, set *fsync_interval*.
+
+	Without a background writer, the time limit is only checked when an entry is
+	logged. With one, entries are serialized by the caller and written by a
+	separate thread, which also flushes on time while no entries are arriving.
 	"""
 
-	def __init__(self, parameters, checkpoint_file=None, delete_on_success=True):
+	def __init__(self, parameters, checkpoint_file=None, delete_on_success=True, flush_entries=kFlushEntries, flush_interval=kFlushInterval, fsync_interval=None, background=False, timestamp=None, _append=False):
 		"""
 		:param parameters: parameters that were used to generate checkpointed results
 		:param file checkpoint_file: open file to use for checkpointing, or :py:class:`None` to create a new one
 		:param delete_on_success: whether to delete the checkpoint file when closed
+		:param int flush_entries: maximum number of entries logged between flushes
+		:param float flush_interval: maximum time between flushes, in seconds
+		:param float fsync_interval: minimum time between syncs of the file to disk, in seconds, checked after each flush. If 0, the file is synced with every flush; if :py:const:`None`, it is never synced.
+		:param bool background: whether to write entries in a background thread
+		:param float timestamp: creation time to record in the checkpoint header; defaults to the current time
 		"""
 		self._logger = rigor.logger.get_logger('.'.join((__name__, self.__class__.__name__)))
 		self._parameters = parameters
@@ -57,35 +385,181 @@ class Checkpointer(object):
 			self._file = checkpoint_file
 			self.filename = checkpoint_file.name
 		self._delete = delete_on_success
-		self._write_header()
+		self._flush_entries = flush_entries
+		self._flush_interval = flush_interval
+		self._fsync_interval = fsync_interval
+		self._unflushed = 0
+		self._last_flush = self._last_fsync = time.time()
+		if not _append:
+			self._write_header(self._file, time.time() if timestamp is None else timestamp, self._parameters)
+		self._offset = self._file.tell()
+		self._index = None
+		if isinstance(self.filename, basestring) and os.path.exists(self.filename): # Anonymous temporary files have no name to put the index beside
+			if not _append:
+				self._index = open(index_filename(self.filename), 'wb')
+			elif os.path.exists(index_filename(self.filename)):
+				self._index = open(index_filename(self.filename), 'ab')
+		self._queue = None
+		self._writer = None
+		self._writer_error = None
+		if background:
+			self._queue = Queue.Queue(kWriterQueueSize)
+			self._writer = threading.Thread(target=self._write_queued, name='rigor-checkpoint-writer')
+			self._writer.daemon = True
+			self._writer.start()
 		self._logger.info("Checkpoint filename is {}".format(self.filename))
 
-	def _write_header(self):
+	@staticmethod
+	def _write_header(checkpoint_file, timestamp, parameters):
 		""" Writes an identifying header to the checkpoint file """
-		pickle.dump(time.time(), self._file, kPickleProtocol)
-		pickle.dump(self._parameters, self._file, kPickleProtocol)
+		pickle.dump(timestamp, checkpoint_file, kPickleProtocol)
+		pickle.dump(parameters, checkpoint_file, kPickleProtocol)
+		pickle.dump(kRecordMarker, checkpoint_file, kPickleProtocol)
 
-	def log(self, id, entry, flush=True):
+	def log(self, id, entry, flush=None):
 		"""
 		Logs a checkpoint entry to the file
 
 		:param id: The percept ID
 		:param entry: structured data returned from Algorithm.apply()
-		:param flush: whether to flush file output with each log entry (safer, but slower if processing each percept is very quick)
+		:param flush: whether to flush file output after this entry. If :py:const:`None`, the checkpointer's flush limits decide; :py:const:`True` flushes now (safer, but slower if processing each percept is very quick) and :py:const:`False` leaves the entry unflushed.
 		"""
-		pickle.dump((id, entry), self._file, kPickleProtocol)
+		record = _pack_record(id, entry)
+		if self._writer is None:
+			self._write(id, record, flush)
+			return
+		self._check_writer()
 		if flush:
-			self._file.flush()
+			self._wait_for_writer(id, record)
+		else:
+			self._queue.put((id, record, flush, None))
+
+	def flush(self):
+		""" Flushes all logged entries to the file, syncing it to disk if *fsync_interval* is set """
+		if self._writer is None:
+			self._flush(self._fsync_interval is not None)
+			return
+		self._wait_for_writer(None, None)
+
+	def _wait_for_writer(self, id, record):
+		""" Has the background writer thread write a record, if any, and flush; and waits until it has """
+		self._check_writer()
+		done = threading.Event()
+		self._queue.put((id, record, True, done))
+		done.wait()
+		self._check_writer()
+
+	def _write(self, id, record, flush):
+		""" Writes an entry record and its index entry, and flushes if requested or if a flush limit has been reached """
+		if record is not None:
+			self._file.write(record)
+			if self._index is not None:
+				self._write_index_entry(id)
+			self._offset += len(record)
+			self._unflushed += 1
+		if flush or (flush is None and self._flush_due()):
+			self._flush()
+
+	def _write_index_entry(self, id):
+		""" Adds a record to the index, or removes the index if the record's ID cannot be stored in it """
+		index_entry = _pack_index_entry(id, self._offset)
+		if index_entry is not None:
+			self._index.write(index_entry)
+			return
+		self._logger.warning("Percept ID {0!r} cannot be indexed; removing checkpoint index".format(id))
+		self._index.close()
+		os.remove(self._index.name)
+		self._index = None
+
+	def _flush_due(self):
+		""" Whether enough entries or time have accumulated to flush """
+		if not self._unflushed:
+			return False
+		return self._unflushed >= self._flush_entries or time.time() - self._last_flush >= self._flush_interval
+
+	def _flush(self, fsync=False):
+		"""
+		Flushes the file, and syncs it to disk if the sync interval has passed
+
+		:param bool fsync: sync regardless of the interval
+		"""
+		self._file.flush()
+		if self._index is not None:
+			self._index.flush() # After the records it refers to
+		self._unflushed = 0
+		self._last_flush = time.time()
+		if fsync or (self._fsync_interval is not None and self._last_flush - self._last_fsync >= self._fsync_interval):
+			os.fsync(self._file.fileno())
+			self._last_fsync = self._last_flush
+
+	def _write_queued(self):
+		"""
+		Runs in the background writer thread, writing (ID, record, flush, event) items
+		from the queue. The event, if any, is set once the item has been handled. A
+		record of :py:const:`None` only flushes, syncing the file if *fsync_interval*
+		is set; a flush setting of :py:const:`None` as well stops the thread.
+		"""
+		try:
+			while True:
+				timeout = None
+				if self._unflushed:
+					timeout = max(0, self._last_flush + self._flush_interval - time.time())
+				try:
+					id, record, flush, done = self._queue.get(timeout=timeout)
+				except Queue.Empty:
+					self._flush()
+					continue
+				if record is None and flush is None:
+					return
+				try:
+					if record is None:
+						self._flush(self._fsync_interval is not None)
+					else:
+						self._write(id, record, flush)
+				except Exception as error: # pylint: disable=W0703
+					self._writer_error = error # Before waking the caller, so it sees the error
+					raise
+				finally:
+					if done is not None:
+						done.set()
+		except Exception as error: # pylint: disable=W0703
+			self._writer_error = error
+			self._logger.exception("Error writing checkpoint file {}".format(self.filename))
+			# Keep draining the queue, so that callers waiting on it are not stuck
+			while True:
+				_, record, flush, done = self._queue.get()
+				if done is not None:
+					done.set()
+				if record is None and flush is None:
+					return
+
+	def _check_writer(self):
+		""" Raises any error encountered by the background writer thread """
+		if self._writer_error is not None:
+			raise IOError("Error writing checkpoint file {0}: {1}".format(self.filename, self._writer_error))
 
 	def close(self, success):
 		"""
-		Closes the checkpoint file.
+		Closes the checkpoint file, after flushing any logged entries and syncing it
+		to disk if *fsync_interval* is set.
 
 		:param success: whether operation finished successfully
 		"""
-		self._file.close()
+		try:
+			if self._writer is not None:
+				self._queue.put((None, None, None, None))
+				self._writer.join()
+				self._writer = None
+				self._check_writer()
+			self._flush(self._fsync_interval is not None)
+		finally:
+			self._file.close()
+			if self._index is not None:
+				self._index.close()
 		if self._delete and success:
 			os.remove(self.filename)
+			if self._index is not None:
+				os.remove(self._index.name)
 
 	def __enter__(self):
 		return self
@@ -105,26 +579,164 @@ class Checkpointer(object):
 		return timestamp, parameters
 
 	@classmethod
-	def resume(cls, old_file, new_file=None, delete_on_success=True):
+	def _read_entries(cls, checkpoint_file):
+		"""
+		Reads each entry from a checkpoint file in either format, starting just after the header
+
+		:return: iterator of (ID, entry) tuples
+		"""
+		position = checkpoint_file.tell()
+		try:
+			is_records = (pickle.load(checkpoint_file) == kRecordMarker)
+		except EOFError:
+			return
+		if is_records:
+			while True:
+				record = _read_record(checkpoint_file)
+				if record is None:
+					return
+				yield record
+		checkpoint_file.seek(position)
+		while True:
+			try:
+				yield pickle.load(checkpoint_file)
+			except EOFError:
+				return
+
+	@classmethod
+	def _convert(cls, filename):
+		""" Rewrites a checkpoint file in the old format with entry records, replacing the original """
+		directory, name = os.path.split(os.path.abspath(filename))
+		with open(filename, 'rb') as old_file:
+			timestamp, parameters = cls.read_header(old_file)
+			new_file = tempfile.NamedTemporaryFile('wb', prefix=name + '.', dir=directory, delete=False)
+			try:
+				with new_file:
+					cls._write_header(new_file, timestamp, parameters)
+					for id, entry in cls._read_entries(old_file):
+						_write_record(new_file, id, entry)
+				os.rename(new_file.name, filename)
+			except:
+				os.unlink(new_file.name)
+				raise
+		try:
+			os.remove(index_filename(filename))
+		except OSError as err:
+			if err.errno != errno.ENOENT:
+				raise
+
+	@classmethod
+	def resume(cls, old_file, new_file=None, delete_on_success=True, **options):
 		"""
 		Resumes from an existing checkpoint file.
 
 		:param file old_file: existing open checkpoint file to resume from
 		:param file new_file: open new checkpoint file (must be different from the old file)
 		:param delete_on_success: whether to delete the new checkpoint file when closed, if successful
+		:param options: other keyword arguments for the :py:class:`Checkpointer`, such as flush limits
 
 		:return: (Checkpointer object, Checkpoint object)
 		"""
 		timestamp, parameters = cls.read_header(old_file)
-		checkpointer = cls(parameters, new_file, delete_on_success)
+		checkpointer = cls(parameters, new_file, delete_on_success, **options)
 		entries = list()
 		seen = set()
-		while True:
-			try:
-				id, entry = pickle.load(old_file)
-				seen.add(id)
-				entries.append(entry)
-				checkpointer.log(id, entry, flush=False)
-			except EOFError:
-				break
+		for id, entry in cls._read_entries(old_file):
+			seen.add(id)
+			entries.append(entry)
+			checkpointer.log(id, entry, flush=False)
 		return checkpointer, Checkpoint(timestamp, parameters, seen, entries)
+
+	@classmethod
+	def resume_in_place(cls, filename, delete_on_success=True, **options):
+		"""
+		Resumes from an existing checkpoint file, appending new entries to the same
+		file. Only the IDs and offsets of saved entries are read, from the
+		checkpoint's index where possible; the results are a :py:class:`CheckpointFile`,
+		which reads them lazily. A partially-written final entry, left behind if the
+		previous run was killed while logging, is discarded, and the index is brought
+		up to date with the file. Checkpoint files in the older format are converted
+		first.
+
+		:param str filename: path to the checkpoint file
+		:param delete_on_success: whether to delete the checkpoint file when closed, if successful
+		:param options: other keyword arguments for the :py:class:`Checkpointer`, such as flush limits
+
+		:return: (Checkpointer object, Checkpoint object)
+		"""
+		saved = CheckpointFile(filename)
+		if not saved.is_records:
+			cls._convert(filename)
+			saved = CheckpointFile(filename)
+		cls._update_index(saved)
+		checkpoint_file = open(filename, 'r+b')
+		checkpoint_file.truncate(saved.end)
+		checkpoint_file.seek(saved.end)
+		checkpointer = cls(saved.parameters, checkpoint_file, delete_on_success, _append=True, **options)
+		return checkpointer, Checkpoint(saved.timestamp, saved.parameters, saved.seen, saved)
+
+	@staticmethod
+	def _update_index(saved):
+		"""
+		Rewrites the end of a checkpoint's index, so that it covers exactly the
+		complete records in the checkpoint file. If any of their IDs cannot be
+		stored in the index, it is removed instead.
+
+		:param saved: :py:class:`CheckpointFile` for the checkpoint
+		"""
+		with open(index_filename(saved.filename), 'ab') as index_file:
+			index_file.truncate(saved.indexed * kIndexEntry.size)
+			for id, offset in zip(saved.ids[saved.indexed:], saved.offsets[saved.indexed:]):
+				index_entry = _pack_index_entry(id, offset)
+				if index_entry is None:
+					break
+				index_file.write(index_entry)
+			else:
+				return
+		os.remove(index_filename(saved.filename))
+
+def merge(filenames, output_filename):
+	"""
+	Combines several checkpoint files, such as the shards of a sharded
+	checkpoint, into a single checkpoint that can be resumed from. Where more than
+	one file has an entry for the same percept, only the first is kept, so this
+	can also be used to compact a single checkpoint. The merged checkpoint has the
+	earliest of the files' timestamps. The output is written to a temporary file
+	and then moved into place, so it can replace one of the input files.
+
+	:param list filenames: paths to the checkpoint files to merge, in order of preference
+	:param str output_filename: path to the merged checkpoint file
+	:return: number of entries in the merged checkpoint
+	:rtype: int
+	"""
+	if not filenames:
+		raise ValueError('No checkpoint files to merge')
+	saved = [CheckpointFile(filename) for filename in filenames]
+	parameters = saved[0].parameters
+	for other in saved[1:]:
+		if other.parameters != parameters:
+			raise ValueError("Checkpoint {0} was created with different parameters from {1}".format(other.filename, saved[0].filename))
+	timestamp = min(checkpoint.timestamp for checkpoint in saved)
+	directory, name = os.path.split(os.path.abspath(output_filename))
+	output_file = tempfile.NamedTemporaryFile('wb', prefix=name + '.', dir=directory, delete=False)
+	checkpointer = Checkpointer(parameters, output_file, delete_on_success=False, timestamp=timestamp)
+	seen = set()
+	try:
+		with checkpointer:
+			for checkpoint in saved:
+				for id, entry in checkpoint.iteritems():
+					if id in seen:
+						continue
+					seen.add(id)
+					checkpointer.log(id, entry)
+		if os.path.exists(index_filename(output_file.name)):
+			os.rename(index_filename(output_file.name), index_filename(output_filename))
+		elif os.path.exists(index_filename(output_filename)):
+			os.remove(index_filename(output_filename))
+		os.rename(output_file.name, output_filename)
+	except:
+		for path in (output_file.name, index_filename(output_file.name)):
+			if os.path.exists(path):
+				os.remove(path)
+		raise
+	return len(seen)
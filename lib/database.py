@@ -73,6 +73,25 @@ class BaseDatabase(object):
 		self._metadata = sa.MetaData(bind=self._engine, naming_convention=kNamingConvention)
 		self._sessionmaker = sessionmaker(bind=self._engine)
 
+	def enable_savepoints(self):
+		"""
+		Makes :py:meth:`~sqlalchemy.orm.session.Session.begin_nested` usable with
+		SQLite, whose driver otherwise manages transactions itself and commits before
+		each SAVEPOINT. Transactions then begin as soon as a session is used, so
+		sessions hold their locks until they are closed. This has no effect on other
+		databases, and must be called before any sessions are created.
+		"""
+		if self._engine.dialect.name != 'sqlite':
+			return
+
+		@sa.event.listens_for(self._engine, 'connect')
+		def connect(dbapi_connection, _connection_record):
+			dbapi_connection.isolation_level = None
+
+		@sa.event.listens_for(self._engine, 'begin')
+		def begin(connection):
+			connection.execute('BEGIN')
+
 	def get_session(self, commit=True):
 		"""
 		Gets a new session from the pool. The session in wrapped in a :py:func:`~contextlib.contextmanager`.
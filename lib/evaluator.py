@@ -1,9 +1,26 @@
 """ Algorithm evaluators for Rigor """
 
 from __future__ import print_function
-from collections import defaultdict
+import collections
+import multiprocessing
+import itertools
 import sys
 
+#: Number of chunks of images queued for each worker process when evaluating a corpus in parallel
+kPendingPerProcess = 2
+
+#: Evaluator used by each worker process when evaluating a corpus in parallel; set by :py:func:`_initialize_worker`
+_worker_evaluator = None
+
+def _initialize_worker(evaluator):
+	""" Called once in each worker process of a parallel corpus evaluation """
+	global _worker_evaluator #pylint: disable=W0603
+	_worker_evaluator = evaluator
+
+def _evaluate_in_worker(images):
+	""" Evaluates a chunk of (ground truths, detections) pairs with the worker process's evaluator """
+	return [_worker_evaluator.evaluate(ground_truths, detections) for ground_truths, detections in images]
+
 class ObjectAreaEvaluator(object):
 	"""
 	Compares ground truth to detections using Wolf and Jolion's algorithm.
@@ -70,24 +87,212 @@ class ObjectAreaEvaluator(object):
 		:param detections: Sequence of detected polygons
 		:return: Tuple of :py:class:`numpy.array` arrays: (ground truth matches, detection matches)
 		"""
+		ground_truth_bounds = cls.rectangle_bounds(ground_truths)
+		if ground_truth_bounds is not None:
+			detection_bounds = cls.rectangle_bounds(detections)
+			if detection_bounds is not None:
+				return cls.build_rectangle_matrices(ground_truth_bounds, detection_bounds)
+
+		# Each polygon is checked (and possibly dilated) once, rather than once per pair
+		ground_truths = [ObjectAreaEvaluator.non_zero_polygon(polygon) for polygon in ground_truths]
+		detections = [ObjectAreaEvaluator.non_zero_polygon(polygon) for polygon in detections]
 		ground_truth_count = len(ground_truths)
 		detection_count = len(detections)
 
-		recall_matrix = cls.np.empty((ground_truth_count, detection_count), dtype=float)
-		precision_matrix = cls.np.empty((ground_truth_count, detection_count), dtype=float)
+		recall_matrix = cls.np.zeros((ground_truth_count, detection_count), dtype=float)
+		precision_matrix = cls.np.zeros((ground_truth_count, detection_count), dtype=float)
+
+		# Pairs whose bounding boxes don't touch can't overlap, so they keep an overlap of zero
+		candidates = cls.overlapping_bounds(
+				cls.np.array([polygon.bounds for polygon in ground_truths], dtype=float).reshape(-1, 4),
+				cls.np.array([polygon.bounds for polygon in detections], dtype=float).reshape(-1, 4))
+		for gt_index, det_index in zip(*candidates):
+			ground_truth = ground_truths[gt_index]
+			detection = detections[det_index]
+			overlap_polygon = ground_truth.intersection(detection)
+
+			precision_area = overlap_polygon.area / detection.area
+			precision_matrix[gt_index, det_index] = precision_area
+			recall_area = overlap_polygon.area / ground_truth.area
+			recall_matrix[gt_index, det_index] = recall_area
+		return (precision_matrix, recall_matrix)
 
-		for gt_index in range(ground_truth_count):
-			ground_truth = ObjectAreaEvaluator.non_zero_polygon(ground_truths[gt_index])
-			for det_index in range(detection_count):
-				detection = ObjectAreaEvaluator.non_zero_polygon(detections[det_index])
-				overlap_polygon = ground_truth.intersection(detection)
+	@classmethod
+	def overlapping_bounds(cls, ground_truth_bounds, detection_bounds):
+		"""
+		Finds the pairs of ground truth and detection polygons whose bounding boxes
+		intersect. The boxes are swept from left to right, keeping the boxes of each
+		kind that are still open at the current left edge; each box is only compared
+		with the open boxes of the other kind, so the work grows with the number of
+		pairs that overlap horizontally, rather than with every pair.
+
+		:param ground_truth_bounds: :py:class:`numpy.array` with a (min x, min y, max x, max y) row for each ground truth
+		:param detection_bounds: :py:class:`numpy.array` with a (min x, min y, max x, max y) row for each detection
+		:return: Tuple of :py:class:`numpy.array` arrays: (ground truth indices, detection indices) for each intersecting pair, ordered by ground truth and then detection, like :py:func:`numpy.nonzero`
+		"""
+		np = cls.np
+		ground_truth_count = len(ground_truth_bounds)
+		bounds = np.vstack((ground_truth_bounds, detection_bounds)).reshape(-1, 4)
+		order = np.argsort(bounds[:, 0], kind='mergesort').tolist()
+		bounds = bounds.tolist()
+		open_ground_truths = list()
+		open_detections = list()
+		pairs = list()
+		for index in order:
+			min_x, min_y, _, max_y = bounds[index]
+			if index < ground_truth_count:
+				own, others = open_ground_truths, open_detections
+			else:
+				own, others = open_detections, open_ground_truths
+			others[:] = [other for other in others if bounds[other][2] >= min_x]
+			for other in others:
+				if bounds[other][1] <= max_y and min_y <= bounds[other][3]:
+					pairs.append((index, other) if index < ground_truth_count else (other, index))
+			own.append(index)
+		if not pairs:
+			return (np.empty(0, dtype=int), np.empty(0, dtype=int))
+		pairs = np.array(pairs, dtype=int)
+		pairs[:, 1] -= ground_truth_count
+		pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+		return (pairs[:, 0], pairs[:, 1])
 
-				precision_area = overlap_polygon.area / detection.area
-				precision_matrix[gt_index, det_index] = precision_area
-				recall_area = overlap_polygon.area / ground_truth.area
-				recall_matrix[gt_index, det_index] = recall_area
+	@classmethod
+	def rectangle_bounds(cls, polygons):
+		"""
+		Checks whether every polygon is an axis-aligned rectangle with nonzero area.
+
+		:param polygons: Sequence of :py:class:`~shapely.Polygon` instances
+		:return: :py:class:`numpy.array` with a (min x, min y, max x, max y) row for each polygon, or :py:const:`None` if any polygon is not such a rectangle
+		"""
+		bounds = cls.np.empty((len(polygons), 4), dtype=float)
+		for index, polygon in enumerate(polygons):
+			if len(polygon.interiors) > 0 or polygon.area <= 0:
+				return None
+			points = cls.np.asarray(polygon.exterior.coords)
+			if points.shape[0] != 5:
+				return None
+			edges = cls.np.diff(points, axis=0)
+			horizontal = edges[:, 1] == 0
+			vertical = edges[:, 0] == 0
+			if not cls.np.all(horizontal != vertical) or not cls.np.all(horizontal[:-1] != horizontal[1:]):
+				return None
+			bounds[index] = polygon.bounds
+		return bounds
+
+	@classmethod
+	def build_rectangle_matrices(cls, ground_truth_bounds, detection_bounds):
+		"""
+		Builds the same matrices as :py:meth:`build_matrices`, for axis-aligned
+		rectangles. The overlaps of all of the pairs found by
+		:py:meth:`overlapping_bounds` are computed at once; other pairs are left at zero.
+
+		:param ground_truth_bounds: ground truth rectangles, as returned by :py:meth:`rectangle_bounds`
+		:param detection_bounds: detected rectangles, as returned by :py:meth:`rectangle_bounds`
+		:return: Tuple of :py:class:`numpy.array` arrays: (ground truth matches, detection matches)
+		"""
+		gt_indices, det_indices = cls.overlapping_bounds(ground_truth_bounds, detection_bounds)
+		ground_truths = ground_truth_bounds[gt_indices]
+		detections = detection_bounds[det_indices]
+		widths = cls.np.minimum(ground_truths[:, 2], detections[:, 2]) - cls.np.maximum(ground_truths[:, 0], detections[:, 0])
+		heights = cls.np.minimum(ground_truths[:, 3], detections[:, 3]) - cls.np.maximum(ground_truths[:, 1], detections[:, 1])
+		overlap_area = cls.np.clip(widths, 0., None) * cls.np.clip(heights, 0., None)
+
+		ground_truth_area = (ground_truth_bounds[:, 2] - ground_truth_bounds[:, 0]) * (ground_truth_bounds[:, 3] - ground_truth_bounds[:, 1])
+		detection_area = (detection_bounds[:, 2] - detection_bounds[:, 0]) * (detection_bounds[:, 3] - detection_bounds[:, 1])
+		shape = (len(ground_truth_bounds), len(detection_bounds))
+		precision_matrix = cls.np.zeros(shape, dtype=float)
+		recall_matrix = cls.np.zeros(shape, dtype=float)
+		precision_matrix[gt_indices, det_indices] = overlap_area / detection_area[det_indices]
+		recall_matrix[gt_indices, det_indices] = overlap_area / ground_truth_area[gt_indices]
 		return (precision_matrix, recall_matrix)
 
+	@staticmethod
+	def _dict_order(keys):
+		"""
+		Returns keys in the order that a :py:class:`dict` filled in the given order
+		iterates over them. Visiting matches in this order gives exactly the same
+		match lists and floating-point sums as collecting them in dicts and sets.
+		"""
+		return list(dict.fromkeys(keys))
+
+	def _match_precision(self, precision_matrix, recall_matrix, precision_threshold):
+		"""
+		Applies the precision threshold, for :py:meth:`classify_matches`
+
+		:return: Tuple of (one-to-one precision matches, candidates), where candidates is a list of (ground truth index, set of detection indices, summed recall) tuples for each ground truth that matches more than one detection
+		"""
+		np = self.np
+		precision_matches = precision_matrix >= precision_threshold
+		precision_per_ground_truth = precision_matches.sum(axis=1) # number of detection items that match a particular ground truth in the precision matrix
+		precision_per_detection = precision_matches.sum(axis=0) # number of ground truth items that match a particular detection in the precision matrix
+		one_to_one_precision = precision_matches & (precision_per_ground_truth == 1)[:, np.newaxis] & (precision_per_detection == 1)[np.newaxis, :]
+
+		candidates = list()
+		for gt_index in self._dict_order(np.flatnonzero(precision_per_ground_truth).tolist()):
+			if precision_per_ground_truth[gt_index] < 2:
+				continue
+			# one-to-many (one ground truth to many detections)
+			matching_detections_precision = set(np.flatnonzero(precision_matches[gt_index]).tolist())
+			gt_sum = 0.
+			for detection_precision in matching_detections_precision:
+				gt_sum += recall_matrix[gt_index, detection_precision]
+			candidates.append((gt_index, matching_detections_precision, gt_sum))
+		return (one_to_one_precision, candidates)
+
+	def _match_recall(self, precision_matrix, recall_matrix, recall_threshold):
+		"""
+		Applies the recall threshold, for :py:meth:`classify_matches`
+
+		:return: Tuple of (one-to-one recall matches, candidates), where candidates is a list of (detection index, set of ground truth indices, summed precision) tuples for each detection that matches more than one ground truth
+		"""
+		np = self.np
+		recall_matches = recall_matrix >= recall_threshold
+		recall_per_ground_truth = recall_matches.sum(axis=1) # number of detection items that match a particular ground truth in the recall matrix
+		recall_per_detection = recall_matches.sum(axis=0) # number of ground truth items that match a particular detection in the recall matrix
+		one_to_one_recall = recall_matches & (recall_per_ground_truth == 1)[:, np.newaxis] & (recall_per_detection == 1)[np.newaxis, :]
+
+		# Detections are added in the order they are first found when scanning the matrix row by row
+		recalled_detections = np.flatnonzero(recall_per_detection)
+		first_recalled = recall_matches.argmax(axis=0)[recalled_detections]
+		candidates = list()
+		for det_index in self._dict_order(recalled_detections[np.lexsort((recalled_detections, first_recalled))].tolist()):
+			if recall_per_detection[det_index] < 2:
+				continue
+			# many-to-one (many ground truths covered by one detection)
+			matching_ground_truths_recall = set(np.flatnonzero(recall_matches[:, det_index]).tolist())
+			det_sum = 0
+			for ground_truth_recall in matching_ground_truths_recall:
+				det_sum += precision_matrix[ground_truth_recall, det_index]
+			candidates.append((det_index, matching_ground_truths_recall, det_sum))
+		return (one_to_one_recall, candidates)
+
+	@staticmethod
+	def _combine_matches(precision_side, recall_side, precision_threshold, recall_threshold):
+		""" Combines the results of :py:meth:`_match_precision` and :py:meth:`_match_recall` into the result of :py:meth:`classify_matches` """
+		one_to_one_precision, ground_truth_candidates = precision_side
+		one_to_one_recall, detection_candidates = recall_side
+		one_to_many = [(gt_index, matching) for gt_index, matching, gt_sum in ground_truth_candidates if gt_sum >= recall_threshold]
+		many_to_one = [(det_index, matching) for det_index, matching, det_sum in detection_candidates if det_sum >= precision_threshold]
+		return (one_to_one_precision, one_to_one_recall, one_to_many, many_to_one)
+
+	def classify_matches(self, precision_matrix, recall_matrix, precision_threshold=None, recall_threshold=None):
+		"""
+		Applies the thresholds to a precision and recall matrix (rows are ground
+		truth, columns are detections), and finds the one-to-one, one-to-many and
+		many-to-one matches between ground truth and detections.
+
+		:param float precision_threshold: :math:`t_{p}`; defaults to the evaluator's threshold
+		:param float recall_threshold: :math:`t_{r}`; defaults to the evaluator's threshold
+		:return: Tuple of (one-to-one precision matches, one-to-one recall matches, one-to-many matches, many-to-one matches). The one-to-one matches are boolean :py:class:`numpy.array` masks shaped like the input matrices. One-to-many matches are a list of (ground truth index, set of detection indices) tuples, and many-to-one matches are a list of (detection index, set of ground truth indices) tuples.
+		"""
+		if precision_threshold is None:
+			precision_threshold = self.precision_threshold
+		if recall_threshold is None:
+			recall_threshold = self.recall_threshold
+		precision_side = self._match_precision(precision_matrix, recall_matrix, precision_threshold)
+		recall_side = self._match_recall(precision_matrix, recall_matrix, recall_threshold)
+		return self._combine_matches(precision_side, recall_side, precision_threshold, recall_threshold)
+
 	def match_detections(self, ground_truths, detections):
 		""" Compares ground_truths to detections """
 		if not ground_truths or not detections:
@@ -102,54 +307,23 @@ class ObjectAreaEvaluator(object):
 		precision_matrix, recall_matrix = self.build_matrices(ground_truths, detections)
 		ground_truth_count = precision_matrix.shape[0]
 		detection_count = precision_matrix.shape[1]
-		ground_truth_sets_precision = defaultdict(set) # number of ground truth items that match a particular detection in the precision matrix
-		detection_sets_precision = defaultdict(set) # number of detection items that match a particular ground truth in the precision matrix
-		ground_truth_sets_recall = defaultdict(set) # number of ground truth items that match a particular detection in the recall matrix
-		detection_sets_recall = defaultdict(set) # number of detection items that match a particular ground truth in the recall matrix
-
-		for gt_index in range(ground_truth_count):
-			for det_index in range(detection_count):
-				if precision_matrix[gt_index, det_index] >= self.precision_threshold:
-					ground_truth_sets_precision[det_index].add(gt_index)
-					detection_sets_precision[gt_index].add(det_index)
-				if recall_matrix[gt_index, det_index] >= self.recall_threshold:
-					ground_truth_sets_recall[det_index].add(gt_index)
-					detection_sets_recall[gt_index].add(det_index)
+		one_to_one_precision, one_to_one_recall, one_to_many, many_to_one = self.classify_matches(precision_matrix, recall_matrix)
 
 		match_ground_truth =  [list() for _ in range(ground_truth_count)]
 		match_detection = [list() for _ in range(detection_count)]
 
-		for gt_index in detection_sets_precision:
-			matching_detections_precision = detection_sets_precision[gt_index]
-			if len(matching_detections_precision) == 1:
-				(detection_precision, ) = matching_detections_precision
-				if len(ground_truth_sets_precision[detection_precision]) == 1:
-					match_ground_truth[gt_index].append(detection_precision)
-			else:
-				# one-to-many (one ground truth to many detections)
-				gt_sum = 0.
-				for detection_precision in matching_detections_precision:
-					gt_sum += recall_matrix[gt_index, detection_precision]
-				if gt_sum >= self.recall_threshold:
-					for detection_precision in matching_detections_precision:
-						match_ground_truth[gt_index].append(detection_precision)
-						match_detection[detection_precision].append(gt_index)
-		for det_index in ground_truth_sets_recall:
-			matching_ground_truths_recall = ground_truth_sets_recall[det_index]
-			if len(matching_ground_truths_recall) == 1:
-				(ground_truth_recall, ) = matching_ground_truths_recall
-				if len(detection_sets_recall[ground_truth_recall]) == 1:
-					match_detection[det_index].append(ground_truth_recall)
-			else:
-				# many-to-one (many ground truths covered by one detection)
-				det_sum = 0
-				for ground_truth_recall in matching_ground_truths_recall:
-					det_sum += precision_matrix[ground_truth_recall, det_index]
-				if det_sum >= self.precision_threshold:
-					for ground_truth_recall in matching_ground_truths_recall:
-						det_sum += precision_matrix[ground_truth_recall, det_index]
-						match_detection[det_index].append(ground_truth_recall)
-						match_ground_truth[ground_truth_recall].append(det_index)
+		for gt_index, det_index in self.np.argwhere(one_to_one_precision).tolist():
+			match_ground_truth[gt_index].append(det_index)
+		for gt_index, matching_detections_precision in one_to_many:
+			for detection_precision in matching_detections_precision:
+				match_ground_truth[gt_index].append(detection_precision)
+				match_detection[detection_precision].append(gt_index)
+		for gt_index, det_index in self.np.argwhere(one_to_one_recall).tolist():
+			match_detection[det_index].append(gt_index)
+		for det_index, matching_ground_truths_recall in many_to_one:
+			for ground_truth_recall in matching_ground_truths_recall:
+				match_detection[det_index].append(ground_truth_recall)
+				match_ground_truth[ground_truth_recall].append(det_index)
 		return match_ground_truth, match_detection
 
 	def evaluate(self, ground_truths, detections):
@@ -174,71 +348,152 @@ class ObjectAreaEvaluator(object):
 		precision_matrix, recall_matrix = self.build_matrices(ground_truths, detections)
 		return self.evaluate_matrices(precision_matrix, recall_matrix)
 
-	def evaluate_matrices(self, precision_matrix, recall_matrix):
+	def evaluate_matrices(self, precision_matrix, recall_matrix, precision_threshold=None, recall_threshold=None):
 		"""
 		Given a precision and recall matrix (2d matrix; rows are ground truth,
 		columns are detections) containing overlap between each pair of ground
 		truth and detection polygons, this will run the match functions over the
 		matrix and return a (precision, recall, (:math:`\sum Match_D`, :math:`|D|`), (:math:`\sum Match_G`,
 		:math:`|G|`)) tuple for the overall image.
+
+		:param float precision_threshold: :math:`t_{p}`; defaults to the evaluator's threshold
+		:param float recall_threshold: :math:`t_{r}`; defaults to the evaluator's threshold
 		"""
-		ground_truth_count = precision_matrix.shape[0]
-		detection_count = precision_matrix.shape[1]
-		ground_truth_sets_precision = defaultdict(set) # number of ground truth items that match a particular detection in the precision matrix
-		detection_sets_precision = defaultdict(set) # number of detection items that match a particular ground truth in the precision matrix
-		ground_truth_sets_recall = defaultdict(set) # number of ground truth items that match a particular detection in the recall matrix
-		detection_sets_recall = defaultdict(set) # number of detection items that match a particular ground truth in the recall matrix
-
-		for gt_index in range(ground_truth_count):
-			for det_index in range(detection_count):
-				if precision_matrix[gt_index, det_index] >= self.precision_threshold:
-					ground_truth_sets_precision[det_index].add(gt_index)
-					detection_sets_precision[gt_index].add(det_index)
-				if recall_matrix[gt_index, det_index] >= self.recall_threshold:
-					ground_truth_sets_recall[det_index].add(gt_index)
-					detection_sets_recall[gt_index].add(det_index)
+		matches = self.classify_matches(precision_matrix, recall_matrix, precision_threshold, recall_threshold)
+		return self._score(precision_matrix.shape, *matches)
+
+	def sweep(self, ground_truths, detections, thresholds):
+		"""
+		Evaluates the same ground truth and detections at many thresholds, such as
+		when building object count/area graphs. Overlap is only measured once.
+
+		:param ground_truths: Sequence of ground truth polygons
+		:param detections: Sequence of detected polygons
+		:param thresholds: Sequence of (:math:`t_{p}`, :math:`t_{r}`) tuples
+		:return: list with a result tuple, as returned by :py:meth:`evaluate`, for each pair of thresholds
+		"""
+		if not ground_truths or not detections:
+			return [(0.,0.,(0.,len(detections)), (0., len(ground_truths))) for _ in thresholds]
+
+		ground_truths, detections = ObjectAreaEvaluator.prune_and_polygon(ground_truths, detections)
+		ground_truth_count = len(ground_truths)
+		detection_count = len(detections)
+		if ground_truth_count == 0 or detection_count == 0:
+			return [(0., 0., (0., float(detection_count)), (0., float(ground_truth_count))) for _ in thresholds]
+
+		precision_matrix, recall_matrix = self.build_matrices(ground_truths, detections)
+		return self.sweep_matrices(precision_matrix, recall_matrix, thresholds)
+
+	def sweep_matrices(self, precision_matrix, recall_matrix, thresholds):
+		"""
+		Same as :py:meth:`evaluate_matrices`, for many thresholds at once. Each
+		distinct precision and recall threshold is applied to the matrices only once,
+		so matrices from :py:meth:`build_matrices` can be kept and swept repeatedly
+		at little cost.
+
+		:param thresholds: Sequence of (:math:`t_{p}`, :math:`t_{r}`) tuples
+		:return: list with a result tuple, as returned by :py:meth:`evaluate_matrices`, for each pair of thresholds
+		"""
+		precision_sides = dict()
+		recall_sides = dict()
+		results = list()
+		for precision_threshold, recall_threshold in thresholds:
+			if precision_threshold not in precision_sides:
+				precision_sides[precision_threshold] = self._match_precision(precision_matrix, recall_matrix, precision_threshold)
+			if recall_threshold not in recall_sides:
+				recall_sides[recall_threshold] = self._match_recall(precision_matrix, recall_matrix, recall_threshold)
+			matches = self._combine_matches(precision_sides[precision_threshold], recall_sides[recall_threshold], precision_threshold, recall_threshold)
+			results.append(self._score(precision_matrix.shape, *matches))
+		return results
+
+	def _score(self, shape, one_to_one_precision, one_to_one_recall, one_to_many, many_to_one):
+		"""
+		Totals up matches from :py:meth:`classify_matches` into a result tuple, as
+		returned by :py:meth:`evaluate_matrices`
+
+		:param tuple shape: shape of the precision and recall matrices
+		"""
+		ground_truth_count, detection_count = shape
 
 		match_ground_truth = 0. # sum of MatchG
 		match_detection = 0. # sum of MatchD
 
-		one_to_one_precision = set()
-		for gt_index in detection_sets_precision:
-			matching_detections_precision = detection_sets_precision[gt_index]
-			if len(matching_detections_precision) == 1:
-				(detection_precision, ) = matching_detections_precision
-				if len(ground_truth_sets_precision[detection_precision]) == 1:
-					one_to_one_precision.add((gt_index, detection_precision))
-			else:
-				# one-to-many (one ground truth to many detections)
-				gt_sum = 0.
-				for detection_precision in matching_detections_precision:
-					gt_sum += recall_matrix[gt_index, detection_precision]
-				if gt_sum >= self.recall_threshold:
-					#print("1:N ~ GT {} : DT {}".format(gt_index,matching_detections_precision))
-					match_ground_truth += self.scatter_punishment(matching_detections_precision)
-					match_detection += len(matching_detections_precision) * self.scatter_punishment(matching_detections_precision)
-
-		one_to_one_recall = set()
-		for det_index in ground_truth_sets_recall:
-			matching_ground_truths_recall = ground_truth_sets_recall[det_index]
-			if len(matching_ground_truths_recall) == 1:
-				(ground_truth_recall, ) = matching_ground_truths_recall
-				if len(detection_sets_recall[ground_truth_recall]) == 1:
-					one_to_one_recall.add((ground_truth_recall, det_index))
-			else:
-				# many-to-one (many ground truths covered by one detection)
-				det_sum = 0
-				for ground_truth_recall in matching_ground_truths_recall:
-					det_sum += precision_matrix[ground_truth_recall, det_index]
-				if det_sum >= self.precision_threshold:
-					#print("N:1 ~ DT {} : GT {}".format(det_index,matching_ground_truths_recall))
-					match_detection += self.scatter_punishment(matching_ground_truths_recall)
-					match_ground_truth += len(matching_ground_truths_recall) * self.scatter_punishment(matching_ground_truths_recall)
-
-		one_to_one_matches = one_to_one_precision & one_to_one_recall
-		match_ground_truth += len(one_to_one_matches)
-		match_detection += len(one_to_one_matches)
+		for gt_index, matching_detections_precision in one_to_many:
+			#print("1:N ~ GT {} : DT {}".format(gt_index,matching_detections_precision))
+			match_ground_truth += self.scatter_punishment(matching_detections_precision)
+			match_detection += len(matching_detections_precision) * self.scatter_punishment(matching_detections_precision)
+
+		for det_index, matching_ground_truths_recall in many_to_one:
+			#print("N:1 ~ DT {} : GT {}".format(det_index,matching_ground_truths_recall))
+			match_detection += self.scatter_punishment(matching_ground_truths_recall)
+			match_ground_truth += len(matching_ground_truths_recall) * self.scatter_punishment(matching_ground_truths_recall)
+
+		one_to_one_matches = self.np.count_nonzero(one_to_one_precision & one_to_one_recall)
+		match_ground_truth += one_to_one_matches
+		match_detection += one_to_one_matches
 
 		recall = match_ground_truth / float(ground_truth_count)
 		precision = match_detection / float(detection_count)
 		return (precision, recall, (match_detection, float(detection_count)), (match_ground_truth, float(ground_truth_count)))
+
+	def evaluate_corpus(self, images, processes=1, chunksize=16, extract=None):
+		r"""
+		Evaluates every image in a corpus, and combines the results. Images are
+		consumed lazily, and only a bounded number are held in memory at once, so
+		results can be streamed from a generator or a checkpoint.
+
+		:param images: iterable of (ground_truths, detections) pairs, one per image, or of any items that *extract* understands
+		:param int processes: number of worker processes used to evaluate images. If 1, images are evaluated in the current process; if :py:const:`None`, one worker is started for each CPU.
+		:param int chunksize: number of images sent to a worker process at a time
+		:param extract: optional callable that takes an item from *images* (for example, a result tuple from :py:meth:`~rigor.algorithm.Algorithm.apply`) and returns a (ground_truths, detections) pair
+		:return: Tuple of (corpus result, per-image results). The corpus result is a (precision, recall, (:math:`\sum Match_D`, :math:`|D|`), (:math:`\sum Match_G`, :math:`|G|`)) tuple, with sums taken over all images. Per-image results are a :py:class:`numpy.array` with a (precision, recall, :math:`\sum Match_D`, :math:`|D|`, :math:`\sum Match_G`, :math:`|G|`) row for each image, in order.
+		"""
+		if extract is not None:
+			images = itertools.imap(extract, images)
+		per_image = list()
+		for precision, recall, (match_detection, detection_count), (match_ground_truth, ground_truth_count) in self._evaluate_images(images, processes, chunksize):
+			per_image.append((precision, recall, match_detection, detection_count, match_ground_truth, ground_truth_count))
+		return self.combine_results(per_image)
+
+	def combine_results(self, per_image):
+		r"""
+		Combines the results for individual images into a result for the corpus
+
+		:param per_image: list of (precision, recall, :math:`\sum Match_D`, :math:`|D|`, :math:`\sum Match_G`, :math:`|G|`) tuples, one per image
+		:return: Tuple of (corpus result, per-image results), as returned by :py:meth:`evaluate_corpus`
+		"""
+		per_image = self.np.array(per_image, dtype=float).reshape(-1, 6)
+		match_detection, detection_count, match_ground_truth, ground_truth_count = per_image[:, 2:].sum(axis=0).tolist()
+		precision = match_detection / detection_count if detection_count else 0.
+		recall = match_ground_truth / ground_truth_count if ground_truth_count else 0.
+		return ((precision, recall, (match_detection, detection_count), (match_ground_truth, ground_truth_count)), per_image)
+
+	def _evaluate_images(self, images, processes, chunksize):
+		"""
+		Evaluates each (ground_truths, detections) pair, either serially or using a
+		pool of worker processes. Results are yielded in the same order as the images.
+		"""
+		if processes == 1:
+			for ground_truths, detections in images:
+				yield self.evaluate(ground_truths, detections)
+			return
+		processes = processes or multiprocessing.cpu_count()
+		pool = multiprocessing.Pool(processes, _initialize_worker, (self, ))
+		pending = collections.deque()
+		images = iter(images)
+		try:
+			while True:
+				chunk = list(itertools.islice(images, chunksize))
+				if chunk:
+					pending.append(pool.apply_async(_evaluate_in_worker, (chunk, )))
+				if pending and (not chunk or len(pending) >= processes * kPendingPerProcess):
+					for result in pending.popleft().get():
+						yield result
+				elif not chunk:
+					break
+			pool.close()
+		except:
+			pool.terminate()
+			raise
+		finally:
+			pool.join()
@@ -1,6 +1,7 @@
 """ Common functions for hashing files """
 
 import hashlib
+import os
 
 def sha256_hash(path):
 	"""
@@ -17,3 +18,72 @@ def sha256_hash(path):
 			break
 		sha256.update(buf)
 	return sha256.hexdigest()
+
+class HashingReader(object):
+	"""
+	Wraps a file-like object, computing a SHA-256 hash of its contents as they are
+	read, so that data can be hashed while it is being copied. Readers that seek
+	backwards and read data again, such as S3 uploads that checksum the data
+	first, do not cause it to be hashed twice.
+
+	:param file_object: file-like object to read from, positioned at its start
+	"""
+	def __init__(self, file_object):
+		self._file = file_object
+		self._sha256 = hashlib.sha256()
+		self._hashed = 0
+
+	@property
+	def byte_count(self):
+		""" Number of bytes hashed so far; after :py:meth:`hexdigest`, this is the size of the data """
+		return self._hashed
+
+	def _update(self, position, data):
+		""" Hashes any part of data that lies past what has already been hashed """
+		end = position + len(data)
+		if end > self._hashed:
+			self._sha256.update(data[self._hashed - position:])
+			self._hashed = end
+
+	def _hash_to(self, position):
+		""" Hashes any data between what has already been hashed and the given position """
+		if position <= self._hashed:
+			return
+		current = self._file.tell()
+		self._file.seek(self._hashed)
+		while self._hashed < position:
+			buf = self._file.read(min(0x100000, position - self._hashed))
+			if not buf:
+				break
+			self._update(self._hashed, buf)
+		self._file.seek(current)
+
+	def read(self, size=-1):
+		position = self._file.tell()
+		self._hash_to(position)
+		data = self._file.read(size)
+		self._update(position, data)
+		return data
+
+	def seek(self, offset, whence=0):
+		self._file.seek(offset, whence)
+
+	def tell(self):
+		return self._file.tell()
+
+	def hexdigest(self):
+		"""
+		Returns the hash of the entire contents of the file, reading any part that
+		has not been read yet
+
+		:return: SHA-256 hash, as a hex string
+		:rtype: str
+		"""
+		current = self._file.tell()
+		self._file.seek(0, os.SEEK_END)
+		self._hash_to(self._file.tell())
+		self._file.seek(current)
+		return self._sha256.hexdigest()
+
+	def __getattr__(self, name):
+		return getattr(self._file, name)
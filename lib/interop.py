@@ -8,15 +8,22 @@ import rigor.types
 import rigor.hash
 import rigor.utils
 import rigor.s3
+import rigor.perceptops
 
 from datetime import datetime
+import sqlalchemy as sa
 from urlparse import urlsplit
+from multiprocessing.pool import ThreadPool
 
 import os
 import stat
 import json
 import shutil
 import errno
+import collections
+import itertools
+import uuid
+import glob
 import mimetypes
 
 #: The MIME type used when none is supplied, and guessing type fails
@@ -25,37 +32,311 @@ kDefaultMIMEType = 'application/octet-stream'
 #: The file extension used when none is supplied, and type is not well-known
 kDefaultExtension = 'dat'
 
+#: Number of percepts loaded from the database at a time during export
+kExportBatchSize = 1000
+
+#: Deduplication mode in which data already in the repository is linked instead of copied
+kDedupLink = 'link'
+
+#: Deduplication mode in which percepts whose data is already in the repository are rejected
+kDedupReject = 'reject'
+
+#: Maximum number of values looked up in a single query
+kLookupSize = 500
+
+#: Added to a destination to name the temporary copy of data being deduplicated
+kStagingSuffix = '.import-'
+
+class DuplicatePerceptError(StandardError):
+	""" Exception raised when a percept's data is already in the repository, and duplicates are rejected """
+	pass
+
+#: Number of bytes read from a metadata file at a time
+kMetadataReadSize = 0x10000
+
+def iterate_metadata(path):
+	"""
+	Lazily reads percept metadata, so that importing can start right away, and
+	only a small part of the metadata is held in memory at a time. The path can
+	be a file containing a JSON array of percepts, a JSON Lines file with one
+	percept per line, or a directory of ``.json`` files, each containing a single
+	percept.
+
+	:param str path: path to the metadata file or directory
+	:return: percept metadata
+	:rtype: iterator of dicts
+	"""
+	if os.path.isdir(path):
+		for metadata_path in sorted(glob.iglob(os.path.join(path, '*.json'))):
+			with open(metadata_path, 'rb') as metadata_file:
+				yield json.load(metadata_file)
+		return
+	with open(path, 'rb') as metadata_file:
+		start = metadata_file.read(kMetadataReadSize).lstrip()
+		metadata_file.seek(0)
+		if start.startswith('['):
+			entries = _iterate_json_array(metadata_file)
+		else:
+			entries = _iterate_json_lines(metadata_file)
+		for entry in entries:
+			yield entry
+
+def _iterate_json_lines(metadata_file):
+	""" Yields each value in a file with one JSON value per line """
+	for line in metadata_file:
+		if line.strip():
+			yield json.loads(line)
+
+def _iterate_json_array(metadata_file):
+	""" Yields each value in a file containing a JSON array, without reading the whole file at once """
+	decoder = json.JSONDecoder()
+	buf = ''
+	position = 0
+	eof = False
+	expected = '['
+	while True:
+		# Skip to the next token, reading more if the buffer runs out
+		while position < len(buf) and buf[position].isspace():
+			position += 1
+		if position == len(buf):
+			if eof:
+				raise ValueError("Unexpected end of metadata array")
+			buf = metadata_file.read(kMetadataReadSize)
+			position = 0
+			eof = not buf
+			continue
+		token = buf[position]
+		if expected == '[':
+			if token != '[':
+				raise ValueError("Expected metadata array, found {0!r}".format(token))
+			position += 1
+			expected = 'first'
+			continue
+		if token == ']' and expected != 'value':
+			return
+		if expected == 'separator':
+			if token != ',':
+				raise ValueError("Expected ',' or ']' in metadata array, found {0!r}".format(token))
+			position += 1
+			expected = 'value'
+			continue
+		# A value is only complete once something follows it, or the file ends
+		try:
+			value, end = decoder.raw_decode(buf, position)
+		except ValueError:
+			end = None
+		if end is None or (end == len(buf) and not eof):
+			more = metadata_file.read(kMetadataReadSize)
+			if not more:
+				if eof or end is None:
+					raise ValueError("Incomplete value in metadata array")
+				eof = True
+				continue
+			buf = buf[position:] + more
+			position = 0
+			continue
+		yield value
+		position = end
+		expected = 'separator'
+
+class NullImportJournal(object):
+	"""
+	Does nothing. Used in place of an actual journal to make code simpler in :py:class:`Importer`.
+	"""
+	uncertain = frozenset()
+
+	def __contains__(self, locator):
+		return False
+
+	def begin(self, locators):
+		pass
+
+	def complete(self, locators):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, value, traceback):
+		pass
+
+class ImportJournal(object):
+	"""
+	Records the progress of an import in a file, so that an interrupted import
+	can be restarted without importing any percept twice. Percepts are identified
+	by their locators. Each is marked as begun before its transaction is committed,
+	and as complete afterwards; if the import stops in between, the percept is
+	left :py:attr:`uncertain` until the database is checked.
+
+	If the file already exists, it is loaded, and new entries are appended to it.
+	A partially-written final entry is discarded.
+
+	:param str path: path to the journal file
+	"""
+	kBegin = '?'
+	kComplete = '+'
+
+	def __init__(self, path):
+		self._logger = rigor.logger.get_logger('.'.join((__name__, self.__class__.__name__)))
+		self.filename = path
+		self._completed = set()
+		begun = set()
+		if os.path.exists(path):
+			with open(path, 'r+b') as journal_file:
+				valid_length = 0
+				for line in journal_file:
+					if not line.endswith('\n'):
+						break
+					valid_length += len(line)
+					locator = line[2:-1].decode('utf-8')
+					if line[0] == self.kComplete:
+						self._completed.add(locator)
+					else:
+						begun.add(locator)
+				journal_file.truncate(valid_length)
+			self._logger.info("Resuming import journal {0} with {1} percepts imported".format(path, len(self._completed)))
+		self.uncertain = begun - self._completed
+		self._file = open(path, 'ab')
+
+	def __contains__(self, locator):
+		return locator in self._completed
+
+	def __len__(self):
+		return len(self._completed)
+
+	def _write(self, mark, locators):
+		""" Appends entries to the journal, and flushes them to the operating system """
+		self._file.write(''.join('{0} {1}\n'.format(mark, locator.encode('utf-8')) for locator in locators))
+		self._file.flush()
+
+	def begin(self, locators):
+		"""
+		Records that percepts are about to be committed
+
+		:param locators: locators of the percepts
+		"""
+		self._write(self.kBegin, locators)
+
+	def complete(self, locators):
+		"""
+		Records that percepts have been committed
+
+		:param locators: locators of the percepts
+		"""
+		locators = list(locators)
+		self._write(self.kComplete, locators)
+		self._completed.update(locators)
+
+	def settle(self, imported):
+		"""
+		Resolves all :py:attr:`uncertain` percepts. Those that were imported are
+		marked complete, and the rest will be imported again.
+
+		:param imported: locators of uncertain percepts that are in the database
+		"""
+		self.complete(imported)
+		self.uncertain = frozenset()
+
+	def close(self):
+		""" Closes the journal file """
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, value, traceback):
+		self.close()
+
+#: Location of percept data that is already in the repository
+_StoredData = collections.namedtuple('_StoredData', ('locator', 'credentials', 'hash'))
+
+#: Copy of data being imported, made while hashing it, before it is known whether the data is a duplicate
+_StagedData = collections.namedtuple('_StagedData', ('locator', 'hash', 'byte_count'))
+
 class Importer(object):
 	"""
 	Imports percept metadata into the database, and copies files into the repository, if needed.
 
+	By default, each percept is imported in its own transaction, and the first
+	error stops the import. If *batch_size* or *threads* is greater than one,
+	percepts are instead imported in batches: data for a batch is copied by a pool
+	of *threads* threads, and each batch is committed once. Each percept in a batch
+	is inserted in its own savepoint, so a failure only discards that percept;
+	failures are logged, and the import continues.
+
 	:param config: Configuration data
 	:type config: :py:class:`~rigor.config.RigorConfiguration` instance
 	:param str database: Name of the database to export
-	:param metadata: Name of the file containing metadata to read, or parsed metadata as a list of dicts
+	:param metadata: Name of the file or directory containing metadata to read (see :py:func:`iterate_metadata`), or parsed metadata as an iterable of dicts
 	:param bool import_data: Whether to import percept data into the repository. This is highly recommended, and will be done by default.
+	:param int batch_size: Number of percepts to commit at a time
+	:param int threads: Number of threads used to copy percept data
+	:param str dedup: How to handle percept data that is already in the repository, as identified by its hash. If :py:const:`None`, data is always copied. If :py:data:`kDedupLink`, the data already in the repository is hard-linked, or copied within S3, instead. If :py:data:`kDedupReject`, the percept is not imported, and :py:class:`DuplicatePerceptError` is raised.
+	:param str journal: path of an :py:class:`ImportJournal` file recording which percepts have been imported. If the import is interrupted, running it again with the same journal skips the percepts that were already imported.
 	"""
-	def __init__(self, config, database, metadata, import_data=True):
+	def __init__(self, config, database, metadata, import_data=True, batch_size=1, threads=1, dedup=None, journal=None):
 		self._config = config
 		self._metadata = metadata
 		self._import_data = import_data
+		self._dedup = dedup
+		self._journal_filename = journal
+		self._batch_size = batch_size
+		self._threads = threads
 		self._database = rigor.database.Database(database, config)
+		if batch_size > 1 or threads > 1:
+			self._database.enable_savepoints()
 		self._logger = rigor.logger.get_logger('.'.join((__name__, self.__class__.__name__)))
-		self._s3 = None
 		mimetypes.init()
 
 	def run(self):
 		"""
 		Imports all percepts from the metadata file
+
+		:return: metadata for percepts that could not be imported, in batch mode
+		:rtype: list
 		"""
-		metadata = None
-		if isinstance(self._metadata, list):
-			metadata = self._metadata
-		else:
-			with open(self._metadata, 'rb') as metadata_file:
-				metadata = json.load(metadata_file)
+		metadata = self._metadata
+		if isinstance(metadata, basestring):
+			metadata = iterate_metadata(metadata)
+		journal = NullImportJournal()
+		if self._journal_filename:
+			journal = ImportJournal(self._journal_filename)
+		with journal:
+			if journal.uncertain:
+				self._settle_journal(journal)
+			metadata = self._skip_imported(metadata, journal)
+			if self._batch_size > 1 or self._threads > 1:
+				return self._run_batched(metadata, journal)
+			for entry in metadata:
+				locators = (entry['locator'], )
+				journal.begin(locators)
+				self.import_percept(entry)
+				journal.complete(locators)
+			return list()
+
+	def _settle_journal(self, journal):
+		"""
+		Checks the database for percepts that were being imported when a previous
+		run stopped, to find out whether they were committed
+		"""
+		uncertain = list(journal.uncertain)
+		imported = list()
+		with self._database.get_session(False) as session:
+			for start in range(0, len(uncertain), kLookupSize):
+				query = session.query(rigor.types.Percept.locator).filter(rigor.types.Percept.locator.in_(uncertain[start:start + kLookupSize]))
+				imported.extend(locator for locator, in query)
+		journal.settle(imported)
+
+	def _skip_imported(self, metadata, journal):
+		""" Yields metadata for percepts that have not already been imported, according to the journal """
+		skipped = 0
 		for entry in metadata:
-			self.import_percept(entry)
+			if entry['locator'] in journal:
+				skipped += 1
+				continue
+			yield entry
+		if skipped:
+			self._logger.info("Skipped {0} percepts that were already imported".format(skipped))
 
 	def import_percept(self, metadata):
 		"""
@@ -71,52 +352,393 @@ class Importer(object):
 			session.flush()
 			with_data = ""
 			if self._import_data:
-				repository = urlsplit(percept.locator)
-				if repository.scheme == 's3':
-					if not self._s3 or self._s3.bucket != repository.netloc:
-						self._s3 = rigor.s3.DefaultS3Client(self._config, repository.netloc, percept.credentials)
-				source = metadata['source']
-				destination = percept.locator
 				with_data = " with data "
-				self._copy_data(source, destination)
-				source = urlsplit(source)
-				if 'hash' not in metadata:
-					percept.hash = rigor.hash.sha256_hash(source.path)
-				if 'byte_count' not in metadata:
-					percept.byte_count = os.path.getsize(source.path)
+				duplicate = None
+				staged = None
+				if self._dedup:
+					data_hash = metadata.get('hash')
+					if not data_hash:
+						staged = self._stage_data(metadata['source'], percept.locator, percept.credentials)
+						data_hash = staged.hash
+					duplicate = self._find_duplicates(session, (data_hash, ), (percept.locator, )).get(data_hash)
+					if duplicate is not None and self._dedup == kDedupReject:
+						self._discard_staged(staged, percept.credentials)
+						raise DuplicatePerceptError("Data for {0} is already in the repository at {1}".format(percept.locator, duplicate.locator))
+				self._update_data_fields(percept, metadata, self._store_data(metadata['source'], percept.locator, percept.credentials, duplicate, staged))
 			self._logger.info("Imported percept ID {0}{1}".format(percept.id, with_data))
 			return percept.id
 
-	def _copy_data(self, source, destination):
-		""" Copies file data from source path to destination """
+	def _run_batched(self, metadata, journal):
+		""" Imports percepts in batches, copying data in a pool of threads """
+		failed = list()
+		entries = iter(metadata)
+		pool = ThreadPool(self._threads)
+		try:
+			while True:
+				batch = list(itertools.islice(entries, self._batch_size))
+				if not batch:
+					break
+				journal.begin([entry['locator'] for entry in batch])
+				batch_failed = self._import_batch(batch, pool)
+				failed_ids = set(id(entry) for entry in batch_failed)
+				journal.complete([entry['locator'] for entry in batch if id(entry) not in failed_ids])
+				failed.extend(batch_failed)
+			pool.close()
+		except:
+			pool.terminate()
+			raise
+		finally:
+			pool.join()
+		return failed
+
+	def _import_batch(self, batch, pool):
+		"""
+		Inserts a batch of percepts, copies their data, and commits them together.
+		If the batch can't be committed, or a percept can't be inserted again after
+		its data was copied, the copied data is removed, so that nothing is left in
+		the repository without a percept pointing to it.
+
+		:return: metadata for percepts that failed to import
+		"""
+		failed = list()
+		copied = list()
+		try:
+			with self._database.get_session() as session:
+				inserted = self._insert_batch(session, batch, failed)
+				if self._import_data and inserted:
+					stored = self._store_batch_data(session, inserted, pool)
+					for (metadata, percept), (data_fields, error) in zip(inserted, stored):
+						if error is None:
+							copied.append((metadata, data_fields))
+						else:
+							self._logger.error("Could not copy data for {0}: {1}".format(percept.locator, error))
+							failed.append(metadata)
+					if len(copied) < len(inserted):
+						# Start the batch over without the percepts whose data could not be copied
+						session.rollback()
+						inserted = self._insert_batch(session, [metadata for metadata, _ in copied], failed)
+						reinserted = set(id(metadata) for metadata, _ in inserted)
+						self._remove_data([metadata for metadata, _ in copied if id(metadata) not in reinserted])
+						copied = [(metadata, fields) for metadata, fields in copied if id(metadata) in reinserted]
+					data_fields = dict((id(metadata), fields) for metadata, fields in copied)
+					for metadata, percept in inserted:
+						self._update_data_fields(percept, metadata, data_fields[id(metadata)])
+		except:
+			self._remove_data([metadata for metadata, _ in copied])
+			raise
+		self._logger.info("Imported {0} percepts{1}".format(len(batch) - len(failed), " with data" if self._import_data else ""))
+		return failed
+
+	def _store_batch_data(self, session, inserted, pool):
+		"""
+		Copies data for a batch of percepts in the thread pool. When deduplicating,
+		data that is already in the repository is linked, and when several percepts
+		in the batch have the same data, it is only copied for the first of them.
+		Data without a hash in its metadata is staged, and hashed, before looking for
+		duplicates, so that each source is only read once.
+
+		:return: (data fields, error) tuples for each percept; see :py:meth:`_try_store_data`
+		"""
+		jobs = [(metadata['source'], percept.locator, percept.credentials, None) for metadata, percept in inserted]
+		if not self._dedup:
+			return pool.map(self._try_store_data, jobs)
+
+		hashes = [metadata.get('hash') for metadata, _ in inserted]
+		unhashed = [index for index, data_hash in enumerate(hashes) if not data_hash]
+		staged = [None] * len(inserted)
+		for index, staged_data in zip(unhashed, pool.map(self._try_stage_data, [jobs[index][:3] for index in unhashed])):
+			if staged_data is not None:
+				staged[index] = staged_data
+				hashes[index] = staged_data.hash
+		duplicates = self._find_duplicates(session, [data_hash for data_hash in hashes if data_hash], [percept.locator for _, percept in inserted])
+
+		stored = [None] * len(inserted)
+		first = dict()
+		later = list()
+		for index, data_hash in enumerate(hashes):
+			duplicate = duplicates.get(data_hash)
+			if data_hash and duplicate is None and data_hash in first:
+				later.append(index)
+				continue
+			if data_hash and duplicate is None:
+				first[data_hash] = index
+			if duplicate is not None and self._dedup == kDedupReject:
+				self._discard_staged(staged[index], jobs[index][2])
+				stored[index] = (None, DuplicatePerceptError("Data is already in the repository at {0}".format(duplicate.locator)))
+			else:
+				jobs[index] = jobs[index][:3] + (duplicate, staged[index])
+		pending = [index for index in range(len(jobs)) if index not in later and stored[index] is None]
+		for index, result in zip(pending, pool.map(self._try_store_data, [jobs[index] for index in pending])):
+			stored[index] = result
+
+		# Percepts whose data was copied earlier in this batch
+		pending = list()
+		for index in later:
+			original = first[hashes[index]]
+			if self._dedup == kDedupReject:
+				self._discard_staged(staged[index], jobs[index][2])
+				stored[index] = (None, DuplicatePerceptError("Data is already being imported to {0}".format(inserted[original][1].locator)))
+				continue
+			duplicate = None
+			if stored[original][1] is None:
+				_, percept = inserted[original]
+				duplicate = _StoredData(percept.locator, percept.credentials, hashes[index])
+			jobs[index] = jobs[index][:3] + (duplicate, staged[index])
+			pending.append(index)
+		for index, result in zip(pending, pool.map(self._try_store_data, [jobs[index] for index in pending])):
+			stored[index] = result
+		return stored
+
+	def _remove_data(self, batch):
+		"""
+		Removes data that was copied for percepts that were not imported. Errors are
+		logged rather than raised, so that they don't hide the reason for the removal.
+
+		:param batch: metadata for the percepts
+		"""
+		if not batch:
+			return
+		locations = [(metadata['locator'], metadata.get('credentials')) for metadata in batch]
+		try:
+			rigor.perceptops.PerceptOps(self._config).remove_all(locations)
+		except Exception as err:
+			self._logger.error("Could not remove data for {0} percepts that were not imported: {1}".format(len(locations), err))
+
+	def _find_duplicates(self, session, hashes, exclude):
+		"""
+		Finds percepts whose data has any of the given hashes
+
+		:param hashes: hashes to look for
+		:param exclude: locators of percepts to ignore
+		:return: dict mapping hashes to :py:class:`_StoredData` for one percept with that hash
+		"""
+		duplicates = dict()
+		exclude = set(exclude)
+		hashes = list(set(hashes))
+		for start in range(0, len(hashes), kLookupSize):
+			query = session.query(rigor.types.Percept.locator, rigor.types.Percept.credentials, rigor.types.Percept.hash)
+			for locator, credentials, data_hash in query.filter(rigor.types.Percept.hash.in_(hashes[start:start + kLookupSize])):
+				if locator not in exclude and data_hash not in duplicates:
+					duplicates[data_hash] = _StoredData(locator, credentials, data_hash)
+		return duplicates
+
+	def _insert_batch(self, session, batch, failed):
+		"""
+		Adds percepts to the session and flushes them. The whole batch is tried in a
+		single savepoint first; if that fails, each percept gets a savepoint of its
+		own, so that only the ones that cannot be inserted are left out.
+
+		:return: (metadata, percept) tuples for the inserted percepts
+		"""
+		try:
+			with session.begin_nested():
+				inserted = [(metadata, rigor.types.Percept.deserialize(metadata)) for metadata in batch]
+				session.add_all([percept for _, percept in inserted])
+			return inserted
+		except Exception:
+			pass
+		inserted = list()
+		for metadata in batch:
+			try:
+				with session.begin_nested():
+					percept = rigor.types.Percept.deserialize(metadata)
+					session.add(percept)
+				inserted.append((metadata, percept))
+			except Exception as err:
+				self._logger.error("Could not import {0}: {1}".format(metadata.get('locator'), err))
+				failed.append(metadata)
+		return inserted
+
+	def _try_store_data(self, args):
+		""" Calls :py:meth:`_store_data` in a worker thread, returning (result, error) instead of raising """
+		try:
+			return (self._store_data(*args), None)
+		except Exception as err:
+			return (None, err)
+
+	def _try_stage_data(self, args):
+		"""
+		Calls :py:meth:`_stage_data` in a worker thread, returning :py:const:`None`
+		instead of raising; the error is raised again when the data is stored
+		"""
+		try:
+			return self._stage_data(*args)
+		except Exception:
+			return None
+
+	def _stage_data(self, source, destination, credentials=None):
+		"""
+		Copies data to a temporary location next to its destination, hashing it in
+		the same pass. Once it is known whether the data is already in the
+		repository, the copy is either moved into place by :py:meth:`_store_data`, or
+		removed by :py:meth:`_discard_staged`. Data for S3 is uploaded straight to its
+		destination, since linking it there would mean copying it within S3 anyway.
+
+		:return: the temporary copy
+		:rtype: :py:class:`_StagedData`
+		"""
 		source = urlsplit(source)
 		if source.netloc:
 			raise NotImplementedError("Importing remote percept data is not implemented")
+		locator = destination
+		if not urlsplit(destination).netloc:
+			locator = destination + kStagingSuffix + uuid.uuid4().hex
+		data_hash, byte_count = self._copy_data(source.path, locator, credentials)
+		return _StagedData(locator, data_hash, byte_count)
+
+	def _discard_staged(self, staged, credentials=None):
+		""" Removes a temporary copy made by :py:meth:`_stage_data`, if there is one """
+		if staged is None:
+			return
+		locator = urlsplit(staged.locator)
+		try:
+			if not locator.netloc:
+				os.unlink(locator.path)
+			else:
+				rigor.s3.get_client(self._config, locator.netloc, credentials).delete(locator.path)
+		except Exception as err:
+			self._logger.warning("Could not remove temporary copy {0}: {1}".format(staged.locator, err))
+
+	def _move_staged(self, staged, destination):
+		""" Moves a temporary local copy made by :py:meth:`_stage_data` to its destination """
+		os.rename(urlsplit(staged.locator).path, urlsplit(destination).path)
+
+	def _link_data(self, duplicate, destination, credentials=None):
+		"""
+		Puts data that is already in the repository at a new destination without
+		copying it from the source: local files are hard-linked, and S3 objects are
+		copied by S3. This is only possible when both are local, or both are in the
+		same S3 bucket.
+
+		:param duplicate: data already in the repository
+		:type duplicate: :py:class:`_StoredData`
+		:return: whether the data was linked
+		:rtype: bool
+		"""
+		existing = urlsplit(duplicate.locator)
 		destination = urlsplit(destination)
-		if not destination.netloc:
-			# Local
+		if not existing.netloc and not destination.netloc:
 			rigor.utils.ensure_path_exists(os.path.dirname(destination.path))
-			shutil.copy2(source.path, destination.path)
-			os.chmod(destination.path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH)
-		elif destination.scheme == 's3':
-			self._s3.put(destination.path, source.path)
-		else:
-			raise NotImplementedError("Can't upload data to remote servers. Try local repository or S3")
+			try:
+				os.link(existing.path, destination.path)
+			except OSError as err:
+				self._logger.debug("Could not link {0} to {1}: {2}".format(existing.path, destination.path, err))
+				return False
+			return True
+		if existing.scheme == 's3' and destination.scheme == 's3' and existing.netloc == destination.netloc and duplicate.credentials == credentials:
+			return rigor.s3.get_client(self._config, destination.netloc, credentials).copy(destination.path, existing.path)
+		return False
+
+	def _store_data(self, source, destination, credentials=None, duplicate=None, staged=None):
+		"""
+		Copies file data from source path to destination, hashing it in the same
+		pass, so that the source is not read again afterwards
+
+		:param duplicate: data already in the repository with the same contents, which will be linked instead of copied if possible
+		:type duplicate: :py:class:`_StoredData`
+		:param staged: temporary copy of the data made by :py:meth:`_stage_data`, which is moved into place instead of copying the source again, or removed if the data is linked
+		:type staged: :py:class:`_StagedData`
+		:return: (hash, byte count) of the data
+		"""
+		source = urlsplit(source)
+		if source.netloc:
+			raise NotImplementedError("Importing remote percept data is not implemented")
+		if staged is not None and staged.locator == destination:
+			return (staged.hash, staged.byte_count)
+		if duplicate is not None and self._link_data(duplicate, destination, credentials):
+			if staged is None:
+				return (duplicate.hash, os.path.getsize(source.path))
+			self._discard_staged(staged, credentials)
+			return (duplicate.hash, staged.byte_count)
+		if staged is not None:
+			try:
+				self._move_staged(staged, destination)
+			except:
+				self._discard_staged(staged, credentials)
+				raise
+			return (staged.hash, staged.byte_count)
+		return self._copy_data(source.path, destination, credentials)
+
+	def _copy_data(self, source_path, destination, credentials=None):
+		"""
+		Copies a local file to a destination in the repository, hashing it in the same pass
+
+		:return: (hash, byte count) of the data
+		"""
+		destination = urlsplit(destination)
+		with open(source_path, 'rb') as source_file:
+			reader = rigor.hash.HashingReader(source_file)
+			if not destination.netloc:
+				# Local
+				rigor.utils.ensure_path_exists(os.path.dirname(destination.path))
+				with open(destination.path, 'wb') as destination_file:
+					shutil.copyfileobj(reader, destination_file, 0x100000)
+				shutil.copystat(source_path, destination.path)
+				os.chmod(destination.path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH)
+			elif destination.scheme == 's3':
+				rigor.s3.get_client(self._config, destination.netloc, credentials).put(destination.path, reader)
+			else:
+				raise NotImplementedError("Can't upload data to remote servers. Try local repository or S3")
+			return (reader.hexdigest(), reader.byte_count)
+
+	@staticmethod
+	def _update_data_fields(percept, metadata, data_fields):
+		""" Fills in the hash and byte count of a percept, unless they were supplied in its metadata """
+		data_hash, byte_count = data_fields
+		if 'hash' not in metadata:
+			percept.hash = data_hash
+		if 'byte_count' not in metadata:
+			percept.byte_count = byte_count
 
 class Exporter(object):
 	"""
-	Exports the data in a rigor database to a metadata file
+	Exports the data in a rigor database to a metadata file. Percepts are read in
+	batches of *batch_size*, ordered by ID, and written out as each batch arrives,
+	so memory use does not depend on the size of the database.
 
 	:param config: Configuration data
 	:type config: :py:class:`~rigor.config.RigorConfiguration` instance
 	:param str database: Name of the database to export
 	:param str filename: Name of the file to write
+	:param bool json_lines: If :py:const:`True`, write one JSON object per line instead of a single JSON array
+	:param int batch_size: Number of percepts to load from the database at a time
 	"""
-	def __init__(self, config, database, filename):
+	def __init__(self, config, database, filename, json_lines=False, batch_size=kExportBatchSize):
 		self._filename = filename
 		self._config = config
+		self._json_lines = json_lines
+		self._batch_size = batch_size
 		self._database = rigor.database.Database(database, config)
 
+	def _iterate_percepts(self, session, tag=None):
+		"""
+		Yields percepts in order of ID, with all of their children loaded. Each batch
+		is fetched with a fixed number of queries, and then released from the
+		session before the next one is loaded.
+		"""
+		query = session.query(rigor.types.Percept).options(
+			sa.orm.subqueryload(rigor.types.Percept.tags),
+			sa.orm.subqueryload(rigor.types.Percept.properties),
+			sa.orm.subqueryload(rigor.types.Percept.annotations).subqueryload(rigor.types.Annotation.tags),
+			sa.orm.subqueryload(rigor.types.Percept.annotations).subqueryload(rigor.types.Annotation.properties),
+			sa.orm.subqueryload(rigor.types.Percept.collections).joinedload(rigor.types.PerceptCollection.collection),
+		)
+		if tag:
+			query = query.join(rigor.types.PerceptTag).filter(rigor.types.PerceptTag.name == tag)
+		query = query.order_by(rigor.types.Percept.id)
+		last_id = None
+		while True:
+			batch_query = query
+			if last_id is not None:
+				batch_query = batch_query.filter(rigor.types.Percept.id > last_id)
+			batch = batch_query.limit(self._batch_size).all()
+			if not batch:
+				return
+			for percept in batch:
+				yield percept
+			last_id = batch[-1].id
+			session.expunge_all()
+
 	def run(self, tag=None):
 		"""
 		Performs the export operation.
@@ -125,16 +747,18 @@ class Exporter(object):
 		"""
 		with open(self._filename, 'wb') as out_file:
 			with self._database.get_session(False) as session:
-				query = session.query(rigor.types.Percept)
-				if tag:
-					query = query.join(rigor.types.PerceptTag).filter(rigor.types.PerceptTag.name == tag)
-				first = True
-				query.order_by(rigor.types.Percept.id)
-				out_file.write('[\n')
-				for percept in query.all():
-					if first:
-						first = False
-					else:
-						out_file.write(',\n')
-					json.dump(percept.serialize(True), out_file, cls=rigor.utils.RigorJSONEncoder)
-			out_file.write('\n]\n')
+				percepts = self._iterate_percepts(session, tag)
+				if self._json_lines:
+					for percept in percepts:
+						json.dump(percept.serialize(True), out_file, cls=rigor.utils.RigorJSONEncoder)
+						out_file.write('\n')
+				else:
+					first = True
+					out_file.write('[\n')
+					for percept in percepts:
+						if first:
+							first = False
+						else:
+							out_file.write(',\n')
+						json.dump(percept.serialize(True), out_file, cls=rigor.utils.RigorJSONEncoder)
+					out_file.write('\n]\n')
@@ -1,7 +1,9 @@
 """ Various utilities for dealing with percept data """
 
-from rigor.s3 import DefaultS3Client
-from rigor.types import Percept
+import rigor.s3
+import rigor.utils
+from rigor.cache import DiskCache, kDefaultSizeLimit
+from rigor.types import Percept, PerceptTag, PerceptProperty, PerceptSensors, PerceptCollection, Annotation, AnnotationTag, AnnotationProperty
 
 try:
 	import cv2
@@ -10,11 +12,29 @@ try:
 except ImportError:
 	pass
 
+from multiprocessing.pool import ThreadPool
 from urlparse import urlsplit
+import sqlalchemy as sa
 import urllib2
 import contextlib
+import collections
+import errno
 import os
 
+#: Number of percepts deleted at a time by :py:meth:`PerceptOps.destroy_all`
+kDeleteChunkSize = 500
+
+#: Number of threads used to remove local files in :py:meth:`PerceptOps.remove_all`
+kRemoveThreads = 8
+
+def _remove_file(path):
+	""" Removes a file, if it exists """
+	try:
+		os.unlink(path)
+	except OSError as err:
+		if err.errno != errno.ENOENT:
+			raise
+
 class PerceptOps(object):
 	"""
 	Various utilities for dealing with percept data
@@ -25,16 +45,36 @@ class PerceptOps(object):
 
 	def __init__(self, config):
 		self._config = config
+		self._cache = None
+		if ('cache', 'path') in config:
+			size_limit = kDefaultSizeLimit
+			if ('cache', 'size_limit') in config:
+				size_limit = int(config.get('cache', 'size_limit'))
+			self._cache = DiskCache(os.path.expanduser(config.get('cache', 'path')), size_limit)
 
 	def fetch(self, percept):
 		"""
 		Given a percept, this will fetch its data from the repository, returning it as an open file-like object with a :py:func:`contextlib.closing` wrapper
 
+		If a cache is configured, data from remote repositories is kept in the local
+		:py:class:`~rigor.cache.DiskCache`, and later fetches of the same content are
+		read from there.
+
 		:param dict percept: percept metadata
 		:return: percept data
 		:rtype: file
 		"""
-		return self.read(percept.locator, percept.credentials)
+		if self._cache is None or not urlsplit(percept.locator).netloc:
+			return self.read(percept.locator, percept.credentials)
+		key = DiskCache.key_for(percept)
+		cached = self._cache.get(key)
+		if cached is None:
+			data = self.read(percept.locator, percept.credentials)
+			if data is None:
+				return None
+			with data as remote_data:
+				cached = self._cache.put(key, remote_data)
+		return cached
 
 	def read(self, url, credentials=None):
 		"""
@@ -47,8 +87,8 @@ class PerceptOps(object):
 		if not parsed.netloc:
 			return open(parsed.path, 'rb')
 		if parsed.scheme == 's3':
-			s3 = DefaultS3Client(self._config, parsed.netloc, credentials)
-			data = s3.get(parsed.path)
+			s3 = rigor.s3.get_client(self._config, parsed.netloc, credentials)
+			data = s3.open(parsed.path)
 		else:
 			data = urllib2.urlopen(url)
 		if data is None:
@@ -71,11 +111,72 @@ class PerceptOps(object):
 			# Local file
 			os.unlink(parsed.path)
 		elif parsed.scheme == 's3':
-			s3 = DefaultS3Client(self._config, parsed.netloc, credentials)
+			s3 = rigor.s3.get_client(self._config, parsed.netloc, credentials)
 			s3.delete(parsed.path)
 		else:
 			raise NotImplementedError("Files not in a local repository or S3 bucket can't be deleted")
 
+	def remove_all(self, locations):
+		"""
+		Removes data for many percepts. Local files are removed in parallel, and S3
+		objects are removed with as few requests as possible. Data that has already
+		been removed is ignored.
+
+		:param locations: (URL, credentials) tuples, where credentials is the optional name of a configuration section with S3 credentials
+		"""
+		local = list()
+		remote = collections.defaultdict(list)
+		for url, credentials in locations:
+			parsed = urlsplit(url)
+			if not parsed.netloc:
+				local.append(parsed.path)
+			elif parsed.scheme == 's3':
+				remote[(parsed.netloc, credentials)].append(parsed.path)
+			else:
+				raise NotImplementedError("Files not in a local repository or S3 bucket can't be deleted")
+		for (bucket, credentials), keys in remote.items():
+			rigor.s3.get_client(self._config, bucket, credentials).delete_many(keys)
+		if local:
+			pool = ThreadPool(kRemoveThreads)
+			try:
+				pool.map(_remove_file, local)
+				pool.close()
+			except:
+				pool.terminate()
+				raise
+			finally:
+				pool.join()
+
+	def destroy_all(self, percept_ids, session, remove_data=True):
+		"""
+		Removes many percepts from the database, and optionally their data from the
+		repository. Rows are deleted from each table with one statement per chunk of
+		percepts, rather than by loading and deleting each percept and its children.
+		Objects already loaded in the session are expired afterwards.
+
+		:param percept_ids: IDs of the percepts to remove, either as integers or as a query selecting a single ID column
+		:param session: database session
+		:param bool remove_data: whether to remove the percepts' data from the repository as well
+		:return: number of percepts removed
+		:rtype: int
+		"""
+		ids = sorted(set(percept_id if isinstance(percept_id, (int, long)) else percept_id[0] for percept_id in percept_ids))
+		locations = list()
+		for start in range(0, len(ids), kDeleteChunkSize):
+			chunk = ids[start:start + kDeleteChunkSize]
+			if remove_data:
+				locations.extend(session.query(Percept.locator, Percept.credentials).filter(Percept.id.in_(chunk)))
+			annotations = sa.select([Annotation.id]).where(Annotation.percept_id.in_(chunk))
+			for child in (AnnotationTag, AnnotationProperty):
+				session.query(child).filter(child.annotation_id.in_(annotations)).delete(synchronize_session=False)
+			for child in (Annotation, PerceptTag, PerceptProperty, PerceptSensors, PerceptCollection):
+				session.query(child).filter(child.percept_id.in_(chunk)).delete(synchronize_session=False)
+			session.query(Percept).filter(Percept.id.in_(chunk)).delete(synchronize_session=False)
+		session.expire_all()
+		if remove_data:
+			self.remove_all(locations)
+		return len(ids)
+
 	def destroy(self, percept, session):
 		"""
 		Removes a percept from the database, and its data from the repository.
@@ -122,6 +223,12 @@ class ImageOps(PerceptOps):
 		:rtype: :py:class:`numpy.ndarray`
 		"""
 		if hasattr(percept_data, 'read'):
-			image_array = np.frombuffer(percept_data.read(), np.uint8)
+			size = getattr(percept_data, 'size', None)
+			if size is not None and hasattr(percept_data, 'readinto'):
+				# Size is known up front, so read straight into the array that gets decoded
+				image_array = np.empty(size, np.uint8)
+				image_array = image_array[:rigor.utils.read_into(percept_data, image_array)]
+			else:
+				image_array = np.frombuffer(percept_data.read(), np.uint8)
 			return cv2.imdecode(image_array, _kImageReadFlags)
 		return cv2.imread(percept_data, _kImageReadFlags)
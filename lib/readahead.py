@@ -0,0 +1,107 @@
+""" Reads percept data ahead of time, so that fetching data overlaps with running the algorithm """
+
+from multiprocessing.pool import ThreadPool
+from io import BytesIO
+import collections
+
+class ReadAhead(object):
+	"""
+	Fetches data for upcoming percepts in a pool of threads while earlier percepts
+	are being processed. Data is read fully into memory, and optionally decoded,
+	in the fetching threads, so the number of percepts buffered and (optionally)
+	the total size of their data are bounded.
+
+	:param fetch_data: callable that takes a percept and returns its data as a file-like object usable as a context manager, such as :py:meth:`~rigor.runner.Runner.fetch_data`
+	:param int depth: maximum number of percepts to fetch ahead
+	:param int max_bytes: approximate limit on the amount of data buffered, or :py:const:`None` for no limit. At least one percept is always fetched, even if it is larger than the limit.
+	:param int threads: number of fetching threads; defaults to *depth*
+	:param postfetch: optional callable that takes a percept and its data as a file-like object, and returns the data to yield, such as :py:meth:`~rigor.algorithm.Algorithm.postfetch`. It is called in the fetching threads.
+	"""
+
+	def __init__(self, fetch_data, depth, max_bytes=None, threads=None, postfetch=None):
+		self._fetch_data = fetch_data
+		self._depth = depth
+		self._max_bytes = max_bytes
+		self._threads = threads or depth
+		self._postfetch = postfetch
+
+	def _read(self, percept):
+		"""
+		Fetches and reads all of the data for a percept, and decodes it if needed
+
+		:return: (percept, data, size in bytes of the data held in memory)
+		"""
+		with self._fetch_data(percept) as percept_data:
+			contents = percept_data.read()
+		data = BytesIO(contents)
+		if self._postfetch is None:
+			return (percept, data, len(contents))
+		data = self._postfetch(percept, data)
+		return (percept, data, getattr(data, 'nbytes', len(contents)))
+
+	@staticmethod
+	def _buffered_bytes(pending):
+		"""
+		Counts the bytes held by fetches that have completed, and reserved for
+		fetches that have not, but not yet been consumed
+		"""
+		total = 0
+		for fetched, reserved in pending:
+			if fetched.ready() and fetched.successful():
+				total += fetched.get()[2]
+			else:
+				total += reserved
+		return total
+
+	def _has_room(self, pending, reserve):
+		""" Whether another fetch reserving the given number of bytes can be started without exceeding the limits """
+		if not pending:
+			return True
+		if len(pending) >= self._depth:
+			return False
+		return self._max_bytes is None or self._buffered_bytes(pending) + reserve <= self._max_bytes
+
+	def iterate(self, percepts):
+		"""
+		Yields each percept along with its data, in the original order. Percepts are
+		consumed from the iterable lazily, in the calling thread.
+
+		Until the size of the data is known, each fetch reserves room for the
+		average size of the data fetched so far, or the whole of *max_bytes* before
+		any has been fetched.
+
+		:param percepts: iterable of percepts
+		:return: (percept, data) tuples, where data is a file-like object, or the return value of *postfetch*
+		"""
+		percepts = iter(percepts)
+		pending = collections.deque()
+		exhausted = False
+		fetched_count = 0
+		fetched_bytes = 0
+		pool = ThreadPool(self._threads)
+		try:
+			while True:
+				while not exhausted:
+					reserve = 0
+					if self._max_bytes is not None:
+						reserve = fetched_bytes // fetched_count if fetched_count else self._max_bytes
+					if not self._has_room(pending, reserve):
+						break
+					try:
+						percept = next(percepts)
+					except StopIteration:
+						exhausted = True
+						break
+					pending.append((pool.apply_async(self._read, (percept, )), reserve))
+				if not pending:
+					break
+				percept, data, size = pending.popleft()[0].get()
+				fetched_count += 1
+				fetched_bytes += size
+				yield (percept, data)
+			pool.close()
+		except:
+			pool.terminate()
+			raise
+		finally:
+			pool.join()
@@ -3,14 +3,65 @@
 import rigor.logger
 from rigor.database import Database
 from rigor.perceptops import PerceptOps
-from rigor.checkpoint import Checkpointer, NullCheckpointer
+from rigor.checkpoint import Checkpointer, NullCheckpointer, CompactResult, CheckpointFile, shard_filename, find_shards
+import rigor.types
+from rigor.readahead import ReadAhead
+from rigor.sinks import ListSink
+
+import sqlalchemy as sa
 
 import abc
 import argparse
+import collections
+import itertools
+import multiprocessing
+import cPickle as pickle
 import os.path
 
 kArgumentsKey = 'arguments'
 
+#: Number of percepts queued for each worker process in a parallel run
+kPendingPerProcess = 2
+
+#: Number of percepts whose metadata is loaded at once before they are sent to worker processes in a parallel run
+kPreloadChunkSize = 100
+
+#: Number of percepts whose metadata is looked up at once when expanding compact checkpoint entries
+kExpandChunkSize = 500
+
+#: Progress is logged each time this many percepts have been processed
+kProgressInterval = 1000
+
+#: Runner used by each worker process in a parallel run; set by :py:func:`_initialize_worker`
+_worker_runner = None
+
+def _initialize_worker(runner):
+	""" Called once in each worker process of a parallel run, before any percepts are processed """
+	global _worker_runner #pylint: disable=W0603
+	runner.initialize_worker()
+	_worker_runner = runner
+
+def _pack_percept(percept):
+	"""
+	Pickles a percept to be sent to a worker process. Database objects are sent as
+	the metadata returned by :py:meth:`~rigor.types.RigorBase.serialize`, without
+	loading anything more from the database.
+	"""
+	if isinstance(percept, rigor.types.RigorBase):
+		return pickle.dumps((percept.__class__, percept.serialize(force_load=False)), pickle.HIGHEST_PROTOCOL)
+	return pickle.dumps((None, percept), pickle.HIGHEST_PROTOCOL)
+
+def _unpack_percept(packed_percept):
+	""" Restores a percept pickled by :py:func:`_pack_percept` """
+	cls, percept = pickle.loads(packed_percept)
+	if cls is not None:
+		percept = cls.deserialize(percept)
+	return percept
+
+def _apply_in_worker(packed_percept):
+	""" Applies the worker process's runner to a single pickled percept """
+	return _worker_runner.apply(_unpack_percept(packed_percept))
+
 class Runner(object):
 	"""
 	The base class for Runner objects, which fetch a set of percepts and apply
@@ -20,21 +71,37 @@ class Runner(object):
 	:type algorithm: :py:class:`~rigor.algorithm.Algorithm`
 	:param dict parameters: settings for the Runner
 	:param str checkpoint: can be path of an existing :py:class:`~rigor.checkpoint.Checkpoint` file to resume from, the path to a new one, or :py:const:`None` to skip checkpointing
+	:param int processes: number of worker processes to apply the algorithm with. If 1, percepts are processed serially in the current process; if :py:const:`None`, one worker is started for each CPU.
+	:param int read_ahead: when processing serially, the number of percepts whose data is fetched and decoded in background threads while the algorithm runs. If 0, data is fetched only when it is needed. Read-ahead can't be combined with worker processes.
+	:param int read_ahead_bytes: approximate limit on the amount of percept data held in memory by read-ahead, or :py:const:`None` for no limit
+	:param dict checkpoint_options: keyword arguments for the :py:class:`~rigor.checkpoint.Checkpointer`, such as how often to flush and sync the checkpoint file and whether to write it in a background thread
+	:param checkpoint_shard: name of this runner's shard of a sharded checkpoint, or :py:const:`None` if the checkpoint is not sharded. Each runner sharing the checkpoint must have its own shard, such as its host name or worker number. Only this runner's shard is written to or resumed from, but percepts saved in any shard, or in the checkpoint file itself, are skipped. Shards can be combined with :py:func:`~rigor.checkpoint.merge`.
 	"""
 	__metaclass__ = abc.ABCMeta
 
-	def __init__(self, algorithm, parameters=None, checkpoint=None):
+	def __init__(self, algorithm, parameters=None, checkpoint=None, processes=1, read_ahead=0, read_ahead_bytes=None, checkpoint_options=None, checkpoint_shard=None):
+		if read_ahead and processes != 1:
+			raise ValueError("Read-ahead is only supported when processing serially (processes=1)")
 		self._logger = rigor.logger.get_logger('.'.join((__name__, self.__class__.__name__)))
 		self._algorithm = algorithm
 		if parameters is None:
 			parameters = dict()
 		self._parameters = parameters
 		self._checkpoint_filename = checkpoint
+		self._processes = processes
+		self._read_ahead = read_ahead
+		self._read_ahead_bytes = read_ahead_bytes
+		if checkpoint_options is None:
+			checkpoint_options = dict()
+		self._checkpoint_options = checkpoint_options
+		self._checkpoint_shard = checkpoint_shard
 
 	@abc.abstractmethod
 	def get_percepts(self):
 		"""
 		Fetches percepts to be run against the :py:class:`~rigor.algorithm.Algorithm`, with annotations included to check against the results. It is called by the :py:meth:`run` method, and must be overridden.
+
+		The percepts can be returned in a list, or in any other iterable, such as a generator or a query using :py:meth:`~sqlalchemy.orm.query.Query.yield_per`. They are consumed one at a time as the run progresses, so they need not all be loaded before the first is processed.
 		"""
 		pass
 
@@ -43,37 +110,179 @@ class Runner(object):
 		""" Fetches percept data and returns it as a contextmanager """
 		pass
 
-	def run(self):
-		""" This is the method called to run the algorithm. """
+	def run(self, sink=None):
+		"""
+		This is the method called to run the algorithm. Each result is given to the
+		sink as soon as it is produced, after any results saved in a checkpoint being
+		resumed from, and the sink's output is passed to :py:meth:`evaluate`. If the
+		run fails, the sink is aborted instead of closed.
+
+		:param sink: where to send results; by default, a :py:class:`~rigor.sinks.ListSink`, which collects them all in a list
+		:type sink: :py:class:`~rigor.sinks.ResultSink`
+		:return: the return value of :py:meth:`evaluate`
+		"""
+		if sink is None:
+			sink = ListSink()
 		percepts = self.get_percepts()
+		count = len(percepts) if hasattr(percepts, '__len__') else None
 		checkpoint_status = ''
-		results = list()
 		checkpointer = NullCheckpointer()
+		checkpoint = None
 		if self._checkpoint_filename:
-			if os.path.exists(self._checkpoint_filename):
-				with open(self._checkpoint_filename, 'rb') as old_checkpoint_file:
-					checkpointer, checkpoint = Checkpointer.resume(old_checkpoint_file)
-				results = checkpoint.results
-				seen = checkpoint.seen
-				percepts = [percept for percept in percepts if percept.id not in seen]
-				checkpoint_status = ' (skipping {0} checkpointed)'.format(len(seen))
+			checkpoint_filename = self._checkpoint_filename
+			seen = set()
+			if self._checkpoint_shard is not None:
+				checkpoint_filename = shard_filename(self._checkpoint_filename, self._checkpoint_shard)
+				seen = self._seen_in_other_shards(checkpoint_filename)
+			if os.path.exists(checkpoint_filename):
+				checkpointer, checkpoint = Checkpointer.resume_in_place(checkpoint_filename, **self._checkpoint_options)
+				seen |= checkpoint.seen
 			else:
-				checkpoint_file = open(self._checkpoint_filename, 'wb')
-				checkpointer = Checkpointer(self._parameters, checkpoint_file)
-		self._logger.debug('Processing {0} percepts{1}'.format(len(percepts), checkpoint_status))
-		with checkpointer:
-			for percept in percepts:
-				percept = self._algorithm.prefetch(percept)
-				with self.fetch_data(percept) as percept_data:
-					result = self._algorithm.apply(percept, percept_data)
-				checkpointer.log(percept.id, result)
-				results.append(result)
-		return self.evaluate(results)
+				checkpoint_file = open(checkpoint_filename, 'wb')
+				checkpointer = Checkpointer(self._parameters, checkpoint_file, **self._checkpoint_options)
+			if seen:
+				if count is None:
+					percepts = (percept for percept in percepts if percept.id not in seen)
+				else:
+					percepts = [percept for percept in percepts if percept.id not in seen]
+					count = len(percepts)
+				checkpoint_status = ' (skipping {0} checkpointed)'.format(len(seen))
+		if count is None:
+			self._logger.debug('Processing percepts{0}'.format(checkpoint_status))
+		else:
+			self._logger.debug('Processing {0} percepts{1}'.format(count, checkpoint_status))
+		processed = 0
+		try:
+			with checkpointer:
+				if checkpoint is not None:
+					for result in self.expand_results(checkpoint.results):
+						sink.add(result)
+				for percept_id, result in self._apply_all(percepts):
+					checkpointer.log(percept_id, self.compact_result(percept_id, result))
+					sink.add(result)
+					processed += 1
+					if processed % kProgressInterval == 0:
+						self._logger.debug('Processed {0} percepts'.format(processed))
+		except:
+			sink.abort()
+			raise
+		self._logger.debug('Finished processing {0} percepts'.format(processed))
+		return self.evaluate(sink.close())
+
+	def _seen_in_other_shards(self, own_filename):
+		"""
+		Finds percepts that have been saved in the checkpoint file, or in shards other than this runner's
+
+		:param str own_filename: path to this runner's shard
+		:return: set of percept IDs
+		"""
+		seen = set()
+		filenames = [path for path in find_shards(self._checkpoint_filename) if path != own_filename]
+		if os.path.exists(self._checkpoint_filename):
+			filenames.append(self._checkpoint_filename)
+		for filename in filenames:
+			seen |= CheckpointFile(filename).seen
+		return seen
+
+	def apply(self, percept):
+		"""
+		Fetches data for a single percept, and applies the
+		:py:class:`~rigor.algorithm.Algorithm` to it. When running in parallel, this
+		is called in the worker processes.
+
+		:param percept: percept to process
+		:return: (percept ID, result of :py:meth:`~rigor.algorithm.Algorithm.apply`)
+		"""
+		percept = self._algorithm.prefetch(percept)
+		with self.fetch_data(percept) as percept_data:
+			result = self._algorithm.apply(percept, percept_data)
+		return (percept.id, result)
+
+	def initialize_worker(self):
+		"""
+		Called once in each worker process when running in parallel, before any
+		percepts are processed. It can be overridden to set up state that can't be
+		shared with the parent process, such as database connections.
+		"""
+		pass
+
+	def _apply_all(self, percepts):
+		"""
+		Applies the algorithm to each percept, either serially or using a pool of
+		worker processes. Results are yielded in the same order as the percepts.
+		"""
+		if self._processes == 1:
+			if not self._read_ahead:
+				for percept in percepts:
+					yield self.apply(percept)
+				return
+			read_ahead = ReadAhead(self.fetch_data, self._read_ahead, self._read_ahead_bytes, postfetch=self._algorithm.postfetch)
+			prefetched = (self._algorithm.prefetch(percept) for percept in percepts)
+			for percept, percept_data in read_ahead.iterate(prefetched):
+				yield (percept.id, self._algorithm.apply_postfetched(percept, percept_data))
+			return
+		processes = self._processes or multiprocessing.cpu_count()
+		pool = multiprocessing.Pool(processes, _initialize_worker, (self, ))
+		pending = collections.deque()
+		percepts = iter(percepts)
+		try:
+			while True:
+				chunk = list(itertools.islice(percepts, kPreloadChunkSize))
+				if not chunk:
+					break
+				self.preload_percepts(chunk)
+				for percept in chunk:
+					# Percepts are pickled here, rather than in the pool's task thread,
+					# because the database session must only be used by the thread that
+					# owns it
+					pending.append(pool.apply_async(_apply_in_worker, (_pack_percept(percept), )))
+					if len(pending) >= processes * kPendingPerProcess:
+						yield pending.popleft().get()
+			while pending:
+				yield pending.popleft().get()
+			pool.close()
+		except:
+			pool.terminate()
+			raise
+		finally:
+			pool.join()
+
+	def preload_percepts(self, percepts):
+		"""
+		Called with each batch of percepts before they are sent to worker processes
+		in a parallel run. Workers only see metadata that has already been loaded,
+		so this can be overridden to load whatever the algorithm needs for the whole
+		batch at once. The default implementation does nothing.
+
+		:param list percepts: percepts about to be processed
+		"""
+		pass
+
+	def compact_result(self, percept_id, result):
+		"""
+		Converts a result into the entry saved in the checkpoint file. By default,
+		results are saved as they are.
+
+		:param percept_id: ID of the percept the result is for
+		:param result: result of :py:meth:`apply`
+		:return: checkpoint entry
+		"""
+		return result
+
+	def expand_results(self, entries):
+		"""
+		Converts checkpoint entries saved by :py:meth:`compact_result` back into results
+
+		:param entries: iterable of checkpoint entries
+		:return: iterable of results
+		"""
+		return entries
 
 	def evaluate(self, results):
 		"""
-		This takes the final output of all applications of the algorithm and
-		formats it into a useful report.  It can optionally return results (that's
+		This takes the final output of all applications of the algorithm, as
+		collected by the result sink given to :py:meth:`run`, and formats it into a
+		useful report.  It can optionally return results (that's
 		up to the implementer), but its main function should be to create reports
 		and format output.  The default implementation simply prints the results to
 		stdout
@@ -122,14 +331,98 @@ class DatabaseRunner(Runner):
 	:param str database_name: name of the database to use
 	:param dict parameters: settings for the Runner
 	:param file checkpoint: open :py:class:`~rigor.checkpoint.Checkpoint` file to resume from
+	:param int processes: number of worker processes; see :py:class:`Runner`
+	:param int read_ahead: number of percepts to fetch ahead; see :py:class:`Runner`
+	:param int read_ahead_bytes: limit on data held by read-ahead; see :py:class:`Runner`
+	:param dict checkpoint_options: checkpointer settings; see :py:class:`Runner`
+	:param checkpoint_shard: name of this runner's checkpoint shard; see :py:class:`Runner`
 	"""
 
-	def __init__(self, algorithm, config, database_name, parameters=None, checkpoint=None):
-		Runner.__init__(self, algorithm, parameters, checkpoint)
+	def __init__(self, algorithm, config, database_name, parameters=None, checkpoint=None, processes=1, read_ahead=0, read_ahead_bytes=None, checkpoint_options=None, checkpoint_shard=None):
+		Runner.__init__(self, algorithm, parameters, checkpoint, processes, read_ahead, read_ahead_bytes, checkpoint_options, checkpoint_shard)
 		self._config = config
+		self._database_name = database_name
 		self._database = Database(database_name, config)
 		self._perceptops = PerceptOps(config)
 
+	def initialize_worker(self):
+		"""
+		Gives each worker process its own database connection pool and percept
+		data access, rather than sharing the parent's
+		"""
+		self._database = Database(self._database_name, self._config)
+		self._perceptops = PerceptOps(self._config)
+
+	def preload_percepts(self, percepts):
+		"""
+		Loads the annotations of a batch of percepts with a single query, so that
+		they are available to :py:meth:`~rigor.algorithm.Algorithm.apply` in the
+		worker processes without being loaded one percept at a time
+		"""
+		unloaded = [percept for percept in percepts if isinstance(percept, rigor.types.Percept) and 'annotations' in sa.inspect(percept).unloaded]
+		if not unloaded:
+			return
+		session = sa.orm.object_session(unloaded[0])
+		if session is None:
+			return
+		annotations = collections.defaultdict(list)
+		query = session.query(rigor.types.Annotation).filter(rigor.types.Annotation.percept_id.in_([percept.id for percept in unloaded])).order_by(rigor.types.Annotation.id)
+		for annotation in query:
+			annotations[annotation.percept_id].append(annotation)
+		for percept in unloaded:
+			sa.orm.attributes.set_committed_value(percept, 'annotations', annotations[percept.id])
+
+	def compact_result(self, percept_id, result):
+		"""
+		Saves results in the format returned by :py:meth:`~rigor.algorithm.Algorithm.apply`
+		as a :py:class:`~rigor.checkpoint.CompactResult`, leaving out the percept and
+		annotation metadata, which can be loaded from the database again when resuming.
+		Other results are saved as they are.
+		"""
+		if isinstance(result, tuple) and len(result) == 4 and isinstance(result[0], dict) and result[0].get('id') == percept_id:
+			return CompactResult(percept_id, result[1], result[3])
+		return result
+
+	def expand_results(self, entries):
+		"""
+		Fills in percept and annotation metadata for compact checkpoint entries,
+		loading the percepts in batches with :py:meth:`load_checkpointed_percepts`
+		"""
+		entries = iter(entries)
+		with self._database.get_session(commit=False) as session:
+			while True:
+				chunk = list(itertools.islice(entries, kExpandChunkSize))
+				if not chunk:
+					break
+				percept_ids = [entry.percept_id for entry in chunk if isinstance(entry, CompactResult)]
+				percepts = dict()
+				if percept_ids:
+					percepts = dict((percept.id, percept) for percept in self.load_checkpointed_percepts(session, percept_ids))
+				for entry in chunk:
+					if not isinstance(entry, CompactResult):
+						yield entry
+						continue
+					percept = percepts.get(entry.percept_id)
+					if percept is None:
+						self._logger.warning("Percept {0} in checkpoint no longer exists; leaving out its result".format(entry.percept_id))
+						continue
+					annotations = self._algorithm.parse_annotations(percept.annotations)
+					yield (percept.serialize(force_load=False), entry.result, [annotation.serialize(force_load=False) for annotation in annotations], entry.elapsed)
+				session.expunge_all()
+
+	def load_checkpointed_percepts(self, session, percept_ids):
+		"""
+		Loads percepts whose results are being restored from a checkpoint. Metadata
+		that has been loaded is included in the restored results; by default, that is
+		each percept's annotations. This can be overridden to load the same metadata
+		as :py:meth:`get_percepts`.
+
+		:param session: database session
+		:param list percept_ids: IDs of the percepts to load
+		:return: iterable of :py:class:`~rigor.types.Percept` objects
+		"""
+		return session.query(rigor.types.Percept).filter(rigor.types.Percept.id.in_(percept_ids)).options(sa.orm.subqueryload(rigor.types.Percept.annotations))
+
 	def fetch_data(self, percept):
 		"""
 		Gets percept data from the repository
@@ -4,6 +4,73 @@ from abc import ABCMeta, abstractmethod
 from io import BytesIO
 from boto.s3.connection import S3Connection
 from boto.s3.key import Key
+from boto.exception import S3ResponseError
+from multiprocessing.pool import ThreadPool
+import rigor.utils
+import collections
+import contextlib
+import functools
+import threading
+import shutil
+import time
+import os
+
+#: Number of seconds a cached client can go unused before it is closed
+kClientIdleTimeout = 300
+
+#: Largest amount of data read from an S3 response at a time when filling a buffer
+kReadSize = 0x100000
+
+#: Objects at least this large, in bytes, are uploaded in parts and downloaded in ranges, in parallel
+kMultipartThreshold = 64 * 1024 * 1024
+
+#: Size of each part of a multipart upload or ranged download, in bytes. S3 requires upload parts (other than the last) to be at least 5 MiB.
+kPartSize = 16 * 1024 * 1024
+
+#: Number of threads used to transfer the parts of a single object
+kTransferThreads = 4
+
+#: Largest number of objects S3 will delete in a single request
+kMaxDeleteKeys = 1000
+
+def _get_setting(config, key, default):
+	""" Reads an integer setting from the ``[s3]`` configuration section, if it is present """
+	if ('s3', key) in config:
+		return int(config.get('s3', key))
+	return default
+
+def _client_key(config, bucket, credentials):
+	"""
+	Key identifying the clients that can be shared by :py:class:`S3ClientCache`:
+	the bucket, the credentials section and the keys in it, and the ``[s3]``
+	settings, so that equivalent configurations share a client
+	"""
+	credential_values = None
+	if credentials:
+		credential_values = (config.get(credentials, 'aws_access_key_id'), config.get(credentials, 'aws_secret_access_key'))
+	settings = tuple(_get_setting(config, name, default) for name, default in (('multipart_threshold', kMultipartThreshold), ('part_size', kPartSize), ('transfer_threads', kTransferThreads)))
+	return (bucket, credentials, credential_values, settings)
+
+def _data_size(data):
+	""" Size of the data remaining in a path or file-like object, or :py:const:`None` if it can't be found without reading it """
+	if not hasattr(data, 'read'):
+		return os.path.getsize(data)
+	try:
+		position = data.tell()
+		data.seek(0, os.SEEK_END)
+		size = data.tell() - position
+		data.seek(position)
+	except (AttributeError, IOError):
+		return None
+	return size
+
+def _in_transfer(method):
+	""" Decorates a :py:class:`BotoS3Client` method that uses its connection, so that the client is busy while it runs """
+	@functools.wraps(method)
+	def in_transfer(self, *args, **kwargs):
+		with self._transfer(): # pylint: disable=W0212
+			return method(self, *args, **kwargs)
+	return in_transfer
 
 class RigorS3Client(object):
 	"""
@@ -33,6 +100,37 @@ class RigorS3Client(object):
 		"""
 		pass
 
+	def open(self, key):
+		"""
+		Opens an object in S3 for reading. Implementations may stream the data from
+		S3 as it is read, instead of downloading all of it first, so the result should
+		be closed when it is no longer needed. The default implementation calls
+		:py:meth:`get`.
+
+		:param str key: S3 key containing the data
+		:return: data, or :py:const:`None` if there is no object at the key
+		:rtype: file
+		"""
+		return self.get(key)
+
+	def readinto(self, key, buffer):
+		"""
+		Reads an object from S3 directly into a preallocated buffer. If the object is
+		larger than the buffer, only the beginning of it is read.
+
+		:param str key: S3 key containing the data
+		:param buffer: writable buffer, such as a :py:class:`bytearray` or :py:class:`numpy.ndarray`
+		:return: number of bytes read, or :py:const:`None` if there is no object at the key
+		:rtype: int
+		"""
+		data = self.open(key)
+		if data is None:
+			return None
+		try:
+			return rigor.utils.read_into(data, buffer)
+		finally:
+			data.close()
+
 	@abstractmethod
 	def put(self, key, data):
 		"""
@@ -53,6 +151,15 @@ class RigorS3Client(object):
 		"""
 		pass
 
+	def delete_many(self, keys):
+		"""
+		Removes data at many keys from S3. The default implementation calls :py:meth:`delete` for each key.
+
+		:param keys: S3 keys for the objects to delete
+		"""
+		for key in keys:
+			self.delete(key)
+
 	@abstractmethod
 	def list(self, prefix=None):
 		"""
@@ -64,9 +171,147 @@ class RigorS3Client(object):
 		"""
 		pass
 
+	def copy(self, key, source_key):
+		"""
+		Copies an object to another key in the same bucket. The default
+		implementation downloads the data and uploads it again.
+
+		:param str key: S3 key where the copy will go
+		:param str source_key: S3 key of the object to copy
+		:return: :py:const:`False` if there is no object at *source_key*, otherwise :py:const:`True`
+		:rtype: bool
+		"""
+		data = self.get(source_key)
+		if data is None:
+			return False
+		self.put(key, data)
+		return True
+
+	def close(self):
+		"""
+		Releases any connections held by the client. The default implementation does nothing.
+		"""
+		pass
+
+	@property
+	def busy(self):
+		"""
+		Whether the client is in the middle of a request, or has objects open for
+		reading, so that it should not be closed. The default implementation always
+		returns :py:const:`False`.
+		"""
+		return False
+
+class BufferReader(object):
+	"""
+	Read-only file-like object over data that has already been downloaded into a
+	buffer. Unlike :py:class:`io.BytesIO`, it does not copy the buffer.
+
+	:param buffer: buffer holding the data, such as a :py:class:`bytearray`
+	:param str name: name of the data
+	"""
+	def __init__(self, buffer, name=None):
+		self._view = memoryview(buffer)
+		self._position = 0
+		self.name = name
+		#: Size of the data, in bytes
+		self.size = len(self._view)
+
+	def read(self, size=-1):
+		start = self._position
+		if size is None or size < 0:
+			end = self.size
+		else:
+			end = min(self.size, start + size)
+		self._position = max(start, end)
+		return self._view[start:self._position].tobytes()
+
+	def readinto(self, buffer):
+		view = memoryview(buffer)
+		count = max(0, min(len(view), self.size - self._position))
+		view[:count] = self._view[self._position:self._position + count]
+		self._position += count
+		return count
+
+	def seek(self, offset, whence=os.SEEK_SET):
+		if whence == os.SEEK_CUR:
+			offset += self._position
+		elif whence == os.SEEK_END:
+			offset += self.size
+		if offset < 0:
+			raise IOError("Invalid seek position {0}".format(offset))
+		self._position = offset
+
+	def tell(self):
+		return self._position
+
+	def close(self):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, value, traceback):
+		self.close()
+
+class BotoKeyReader(object):
+	"""
+	File-like object that reads an S3 object directly from the HTTP response
+
+	:param key: Boto key that has been opened for reading
+	:type key: :py:class:`boto.s3.key.Key`
+	:param on_close: optional function called when the reader is first closed
+	"""
+	def __init__(self, key, on_close=None):
+		self._key = key
+		self._on_close = on_close
+		self._eof = False
+		self.name = key.name
+		#: Size of the object, in bytes
+		self.size = key.size
+
+	def read(self, size=-1):
+		if self._eof:
+			return ''
+		if size is None or size < 0:
+			data = self._key.read()
+			self._eof = True
+			return data
+		data = self._key.read(size)
+		if not data:
+			self._eof = True
+		return data
+
+	def readinto(self, buffer):
+		view = memoryview(buffer)
+		data = self.read(min(len(view), kReadSize))
+		view[:len(data)] = data
+		return len(data)
+
+	def close(self):
+		""" Closes the response. Data that has not been read is not downloaded. """
+		self._key.close(fast=not self._eof)
+		self._eof = True
+		if self._on_close is not None:
+			on_close, self._on_close = self._on_close, None
+			on_close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, value, traceback):
+		self.close()
+
 class BotoS3Client(RigorS3Client):
 	"""
 	Object capable of accessing S3 data using Boto
+
+	Large objects are uploaded with multipart uploads, and downloaded by
+	:py:meth:`get` and :py:meth:`readinto` with byte-range requests, with the
+	parts transferred in parallel. This is controlled by settings in the ``[s3]``
+	configuration section: ``multipart_threshold``, ``part_size``, and
+	``transfer_threads``, which default to :py:data:`kMultipartThreshold`,
+	:py:data:`kPartSize`, and :py:data:`kTransferThreads`.
 	"""
 
 	def __init__(self, config, bucket, credentials=None):
@@ -77,13 +322,53 @@ class BotoS3Client(RigorS3Client):
 			connection_args.append(config.get(credentials, 'aws_secret_access_key'))
 		self._conn = S3Connection(*connection_args)
 		self.bucket = self._conn.get_bucket(bucket)
+		self._multipart_threshold = _get_setting(config, 'multipart_threshold', kMultipartThreshold)
+		self._part_size = _get_setting(config, 'part_size', kPartSize)
+		self._transfer_threads = _get_setting(config, 'transfer_threads', kTransferThreads)
+		self._transfers = 0
+		self._transfers_lock = threading.Lock()
 
+	def close(self):
+		""" See :py:meth:`RigorS3Client.close` """
+		self._conn.close()
+
+	@property
+	def busy(self):
+		""" See :py:attr:`RigorS3Client.busy` """
+		return self._transfers > 0
+
+	def _begin_transfer(self):
+		""" Marks the client busy until a matching call to :py:meth:`_end_transfer` """
+		with self._transfers_lock:
+			self._transfers += 1
+
+	def _end_transfer(self):
+		""" Ends a transfer begun with :py:meth:`_begin_transfer` """
+		with self._transfers_lock:
+			self._transfers -= 1
+
+	@contextlib.contextmanager
+	def _transfer(self):
+		""" Marks the client busy for the duration of a ``with`` block """
+		self._begin_transfer()
+		try:
+			yield
+		finally:
+			self._end_transfer()
+
+	@_in_transfer
 	def get(self, key, local_file=None):
 		""" See :py:meth:`RigorS3Client.get` """
 		fetched_key = self.bucket.get_key(key)
 		if fetched_key is None:
 			return None
-		if local_file is None:
+		if fetched_key.size >= self._multipart_threshold:
+			if local_file is None:
+				return self._get_buffer(key, fetched_key.size)
+			with open(local_file, 'wb') as local:
+				local.truncate(fetched_key.size)
+			self._get_ranges(key, fetched_key.size, self._range_writer(local_file))
+		elif local_file is None:
 			contents = BytesIO()
 			fetched_key.get_file(contents)
 			contents.seek(0)
@@ -91,8 +376,103 @@ class BotoS3Client(RigorS3Client):
 		else:
 			fetched_key.get_contents_to_filename(local_file)
 
+	@_in_transfer
+	def readinto(self, key, buffer):
+		""" See :py:meth:`RigorS3Client.readinto` """
+		fetched_key = self.bucket.get_key(key)
+		if fetched_key is None:
+			return None
+		view = memoryview(buffer)
+		size = min(fetched_key.size, len(view))
+		if size >= self._multipart_threshold:
+			self._get_ranges(key, size, self._range_reader(view))
+			return size
+		fetched_key.open_read()
+		with BotoKeyReader(fetched_key) as data:
+			return rigor.utils.read_into(data, view)
+
+	def _get_buffer(self, key, size):
+		""" Downloads an object into memory with parallel byte-range requests, and returns a reader over it """
+		contents = bytearray(size)
+		self._get_ranges(key, size, self._range_reader(contents))
+		return BufferReader(contents, key)
+
+	@staticmethod
+	def _range_reader(buffer):
+		""" Returns a function that reads the data for a range into the same range of a buffer """
+		view = memoryview(buffer)
+		def read_range(data, start, end):
+			if rigor.utils.read_into(data, view[start:end]) != end - start:
+				raise IOError("Incomplete read of bytes {0}-{1} from S3".format(start, end - 1))
+		return read_range
+
+	@staticmethod
+	def _range_writer(local_file):
+		""" Returns a function that writes the data for a range into the same range of a local file """
+		def write_range(data, start, end):
+			with open(local_file, 'r+b') as local:
+				local.seek(start)
+				shutil.copyfileobj(data, local, kReadSize)
+				if local.tell() != end:
+					raise IOError("Incomplete read of bytes {0}-{1} from S3".format(start, end - 1))
+		return write_range
+
+	def _get_ranges(self, key, size, handle_range):
+		"""
+		Downloads the first *size* bytes of an object with parallel byte-range requests
+
+		:param str key: S3 key containing the data
+		:param int size: number of bytes to download
+		:param handle_range: function called in a worker thread with a file-like object containing each range of the data, along with its start and end offsets
+		"""
+		def get_range(start):
+			end = min(start + self._part_size, size)
+			remote_key = Key(self.bucket, key)
+			remote_key.open_read(headers={'Range': 'bytes={0}-{1}'.format(start, end - 1)})
+			with BotoKeyReader(remote_key) as data:
+				handle_range(data, start, end)
+		pool = ThreadPool(self._transfer_threads)
+		try:
+			pool.map(get_range, range(0, size, self._part_size))
+			pool.close()
+		except:
+			pool.terminate()
+			raise
+		finally:
+			pool.join()
+
+	def open(self, key):
+		"""
+		See :py:meth:`RigorS3Client.open`. Data is read directly from the HTTP
+		response, however large the object is, and the client is busy until the
+		result is closed. Use :py:meth:`get` or :py:meth:`readinto` to download large
+		objects into memory with parallel byte-range requests.
+		"""
+		remote_key = Key(self.bucket, key)
+		self._begin_transfer()
+		try:
+			remote_key.open_read()
+		except S3ResponseError as err:
+			self._end_transfer()
+			if err.status == 404:
+				return None
+			raise
+		except:
+			self._end_transfer()
+			raise
+		return BotoKeyReader(remote_key, self._end_transfer)
+
+	@_in_transfer
 	def put(self, key, data):
 		""" See :py:meth:`RigorS3Client.put` """
+		size = _data_size(data)
+		if size and size >= self._multipart_threshold:
+			if hasattr(data, 'read'):
+				self._put_multipart(key, data)
+			else:
+				with open(data, 'rb') as data_file:
+					self._put_multipart(key, data_file)
+			return
 		remote_key = Key(self.bucket)
 		remote_key.key = key
 		if hasattr(data, 'read'):
@@ -100,16 +480,151 @@ class BotoS3Client(RigorS3Client):
 		else:
 			remote_key.set_contents_from_filename(data)
 
+	def _put_multipart(self, key, data):
+		"""
+		Uploads data with a multipart upload. Parts are read from the data in order,
+		and uploaded in parallel; only a few parts are held in memory at once.
+
+		:param str key: S3 key where the data will go
+		:param file data: file-like object containing the data
+		"""
+		upload = self.bucket.initiate_multipart_upload(key)
+		pool = ThreadPool(self._transfer_threads)
+		pending = collections.deque()
+		try:
+			part_number = 0
+			while True:
+				part = data.read(self._part_size)
+				if not part:
+					break
+				part_number += 1
+				pending.append(pool.apply_async(upload.upload_part_from_file, (BytesIO(part), part_number)))
+				while len(pending) >= self._transfer_threads:
+					pending.popleft().get()
+			while pending:
+				pending.popleft().get()
+			pool.close()
+			upload.complete_upload()
+		except:
+			pool.terminate()
+			upload.cancel_upload()
+			raise
+		finally:
+			pool.join()
+
+	@_in_transfer
+	def copy(self, key, source_key):
+		""" See :py:meth:`RigorS3Client.copy`. The object is copied by S3, without transferring its data. """
+		try:
+			self.bucket.copy_key(key, self.bucket.name, source_key)
+		except S3ResponseError as err:
+			if err.status == 404:
+				return False
+			raise
+		return True
+
+	@_in_transfer
 	def delete(self, key):
 		""" See :py:meth:`RigorS3Client.delete` """
 		remote_key = Key(self.bucket)
 		remote_key.key = key
 		remote_key.delete()
 
+	@_in_transfer
+	def delete_many(self, keys):
+		""" See :py:meth:`RigorS3Client.delete_many`. Objects are deleted with multi-object delete requests. """
+		keys = list(keys)
+		for start in range(0, len(keys), kMaxDeleteKeys):
+			result = self.bucket.delete_keys(keys[start:start + kMaxDeleteKeys], quiet=True)
+			if result.errors:
+				error = result.errors[0]
+				raise IOError("Could not delete {0} objects from S3, including {1}: {2}".format(len(result.errors), error.key, error.message))
+
 	def list(self, prefix=None):
 		""" See :py:meth:`RigorS3Client.list` """
 		if prefix is None:
 			prefix = ""
-		return self.bucket.list(prefix=prefix)
+		return self._list(prefix)
+
+	def _list(self, prefix):
+		""" Lists keys with a prefix, keeping the client busy until the listing is finished or abandoned """
+		with self._transfer():
+			for key in self.bucket.list(prefix=prefix):
+				yield key
 
 DefaultS3Client = BotoS3Client
+
+class S3ClientCache(object):
+	"""
+	A thread-safe cache of S3 clients, keyed by bucket, credentials section, and
+	``[s3]`` settings, so that connections and bucket lookups can be reused
+	across many requests, even with separate but equivalent configurations. Clients that have not been used for a while, and are not
+	:py:attr:`~RigorS3Client.busy` with a transfer, are closed and dropped. If the
+	process forks, the child starts with an empty cache rather than sharing
+	connections with its parent.
+
+	:param float idle_timeout: number of seconds a client can go unused before it is closed
+	"""
+
+	def __init__(self, idle_timeout=kClientIdleTimeout):
+		self._idle_timeout = idle_timeout
+		self._clients = dict()
+		self._lock = threading.Lock()
+		self._pid = os.getpid()
+
+	def get(self, config, bucket, credentials=None):
+		"""
+		Returns a client for the given configuration, bucket, and credentials, creating one if needed
+
+		:param config: configuration data
+		:type config: :py:class:`~rigor.config.RigorConfiguration`
+		:param str bucket: S3 bucket containing data
+		:param str credentials: name of credentials section
+		:return: S3 client
+		:rtype: :py:class:`RigorS3Client`
+		"""
+		key = _client_key(config, bucket, credentials)
+		now = time.time()
+		with self._lock:
+			if self._pid != os.getpid():
+				self._clients = dict()
+				self._pid = os.getpid()
+			self._evict(now)
+			if key in self._clients:
+				client, _ = self._clients[key]
+			else:
+				client = DefaultS3Client(config, bucket, credentials)
+			self._clients[key] = (client, now)
+		return client
+
+	def _evict(self, now):
+		""" Closes and removes clients that have been idle for too long. The lock must be held. """
+		for key, (client, last_used) in self._clients.items():
+			if now - last_used > self._idle_timeout and not client.busy:
+				del self._clients[key]
+				client.close()
+
+	def clear(self):
+		""" Closes and removes all cached clients """
+		with self._lock:
+			clients = self._clients
+			self._clients = dict()
+			if self._pid == os.getpid():
+				for client, _ in clients.values():
+					client.close()
+
+_client_cache = S3ClientCache()
+
+def get_client(config, bucket, credentials=None):
+	"""
+	Returns a shared S3 client for the given configuration, bucket, and
+	credentials from the process-wide :py:class:`S3ClientCache`
+
+	:param config: configuration data
+	:type config: :py:class:`~rigor.config.RigorConfiguration`
+	:param str bucket: S3 bucket containing data
+	:param str credentials: name of credentials section
+	:return: S3 client
+	:rtype: :py:class:`RigorS3Client`
+	"""
+	return _client_cache.get(config, bucket, credentials)
@@ -0,0 +1,149 @@
+""" Destinations for the results of a :py:class:`~rigor.runner.Runner`, which receive each result as soon as it is produced """
+
+import abc
+import cPickle as pickle
+
+kPickleProtocol = pickle.HIGHEST_PROTOCOL
+
+class ResultSink(object):
+	"""
+	Base class for destinations of algorithm results. A sink is given each result
+	in turn by :py:meth:`~rigor.runner.Runner.run`, and is closed once they have
+	all been given; what it returns from :py:meth:`close` is then passed to
+	:py:meth:`~rigor.runner.Runner.evaluate`. Sinks that do not hold on to every
+	result let a run's memory use stay the same however many percepts it has.
+	"""
+	__metaclass__ = abc.ABCMeta
+
+	@abc.abstractmethod
+	def add(self, result):
+		"""
+		Receives a single result
+
+		:param result: result of :py:meth:`~rigor.algorithm.Algorithm.apply`
+		"""
+		pass
+
+	@abc.abstractmethod
+	def close(self):
+		"""
+		Called after all results have been added
+
+		:return: the output of the sink, to be evaluated
+		"""
+		pass
+
+	def abort(self):
+		"""
+		Called instead of :py:meth:`close` when the run fails, to release anything
+		the sink holds. The default implementation does nothing.
+		"""
+		pass
+
+class ListSink(ResultSink):
+	""" Collects results in a list, in memory. This is what runners use by default. """
+
+	def __init__(self):
+		self._results = list()
+
+	def add(self, result):
+		self._results.append(result)
+
+	def close(self):
+		"""
+		:return: all of the results
+		:rtype: list
+		"""
+		return self._results
+
+class FileSink(ResultSink):
+	"""
+	Writes results to a file as they are produced, to be read back later with :py:meth:`read`
+
+	:param str filename: path to the file to write
+	"""
+
+	def __init__(self, filename):
+		self.filename = filename
+		self._file = open(filename, 'wb')
+		self._count = 0
+
+	def add(self, result):
+		pickle.dump(result, self._file, kPickleProtocol)
+		self._count += 1
+
+	def close(self):
+		"""
+		:return: (path to the file, number of results written)
+		"""
+		self._file.close()
+		return (self.filename, self._count)
+
+	def abort(self):
+		""" Closes the file, leaving the results written so far in it """
+		self._file.close()
+
+	@staticmethod
+	def read(filename):
+		"""
+		Reads back results written by a :py:class:`FileSink`, one at a time
+
+		:param str filename: path to the file
+		:return: iterator of results
+		"""
+		with open(filename, 'rb') as result_file:
+			while True:
+				try:
+					yield pickle.load(result_file)
+				except EOFError:
+					return
+
+class AggregateSink(ResultSink):
+	"""
+	Folds results into a single value as they are produced, in the manner of
+	:py:func:`reduce`. For example, ``AggregateSink(lambda total, result: total + result[3], 0.)``
+	totals the time spent applying the algorithm.
+
+	:param function: callable that takes the value so far and a result, and returns the new value
+	:param initial: starting value
+	"""
+
+	def __init__(self, function, initial):
+		self._function = function
+		self.value = initial
+
+	def add(self, result):
+		self.value = self._function(self.value, result)
+
+	def close(self):
+		"""
+		:return: the final value
+		"""
+		return self.value
+
+class EvaluatorSink(ResultSink):
+	r"""
+	Evaluates each result with an :py:class:`~rigor.evaluator.ObjectAreaEvaluator`
+	as it is produced, keeping only a row of figures for each result rather than
+	the results themselves. The output is the same as that of :py:meth:`~rigor.evaluator.ObjectAreaEvaluator.evaluate_corpus`.
+
+	:param evaluator: evaluator to use
+	:type evaluator: :py:class:`~rigor.evaluator.ObjectAreaEvaluator`
+	:param extract: callable that takes a result and returns a (ground_truths, detections) pair for the evaluator
+	"""
+
+	def __init__(self, evaluator, extract):
+		self._evaluator = evaluator
+		self._extract = extract
+		self._per_image = list()
+
+	def add(self, result):
+		ground_truths, detections = self._extract(result)
+		precision, recall, (match_detection, detection_count), (match_ground_truth, ground_truth_count) = self._evaluator.evaluate(ground_truths, detections)
+		self._per_image.append((precision, recall, match_detection, detection_count, match_ground_truth, ground_truth_count))
+
+	def close(self):
+		r"""
+		:return: Tuple of (corpus result, per-image results). The corpus result is a (precision, recall, (:math:`\sum Match_D`, :math:`|D|`), (:math:`\sum Match_G`, :math:`|G|`)) tuple, and the per-image results are a :py:class:`numpy.array` with a row for each result; see :py:meth:`~rigor.evaluator.ObjectAreaEvaluator.evaluate_corpus`.
+		"""
+		return self._evaluator.combine_results(self._per_image)
@@ -194,7 +194,7 @@ class Percept(RigorBase):
 	id = sa.Column(sa.Integer, sa.Sequence('percept_id_seq'), primary_key=True)
 	locator = sa.Column(sa.Text, unique=True, nullable=False)
 	credentials = sa.Column(sa.Text)
-	hash = sa.Column(sa.Text)
+	hash = sa.Column(sa.Text, index=True)
 	byte_count = sa.Column(sa.Integer)
 	stamp = sa.Column(sa.DateTime(timezone=True))
 	x_size = sa.Column(sa.Integer)
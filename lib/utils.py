@@ -39,3 +39,21 @@ def ensure_path_exists(path, mode=0o777):
 	except OSError as err:
 		if err.errno != errno.EEXIST:
 			raise err
+
+def read_into(data, buffer):
+	"""
+	Reads from a file-like object into a preallocated buffer, until either the buffer is full or there is no more data
+
+	:param data: file-like object to read from, which must have a :py:meth:`readinto` method
+	:param buffer: writable buffer, such as a :py:class:`bytearray` or :py:class:`numpy.ndarray`
+	:return: number of bytes read
+	:rtype: int
+	"""
+	view = memoryview(buffer)
+	total = 0
+	while total < len(view):
+		count = data.readinto(view[total:])
+		if not count:
+			break
+		total += count
+	return total
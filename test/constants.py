@@ -10,6 +10,7 @@ kConfigFile2 = os.path.join(kDirName, 'testing2.ini')
 kLockFile = os.path.join(kDirName, 'lockfile')
 kAwsBucket = 'orion.aws.testing'
 kImportFile = os.path.join(kDirName, 'import.json')
+kImportJournalFile = os.path.join(kDirName, 'import.journal')
 kImportDirectory = os.path.join(kDirName, 'to_import')
 kRepoDirectory = os.path.join(kDirName, 'imported')
 kImportDatabase = os.path.join(kDirName, 'imported.db')
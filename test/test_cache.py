@@ -0,0 +1,73 @@
+from rigor.cache import DiskCache
+from io import BytesIO
+import rigor.types
+import tempfile
+import shutil
+import time
+import os
+import pytest
+
+@pytest.fixture
+def cache_path(request):
+	path = tempfile.mkdtemp(prefix='rigor-test-cache-')
+	request.addfinalizer(lambda: shutil.rmtree(path))
+	return path
+
+def test_get_missing(cache_path):
+	cache = DiskCache(cache_path)
+	assert cache.get('abcdef') is None
+
+def test_put_get(cache_path):
+	cache = DiskCache(cache_path)
+	with cache.put('abcdef', BytesIO('some data')) as cached:
+		assert cached.read() == 'some data'
+	with cache.get('abcdef') as cached:
+		assert cached.read() == 'some data'
+
+def test_put_replaces(cache_path):
+	cache = DiskCache(cache_path)
+	cache.put('abcdef', BytesIO('some data')).close()
+	cache.put('abcdef', BytesIO('other data')).close()
+	with cache.get('abcdef') as cached:
+		assert cached.read() == 'other data'
+
+def test_put_replaces_without_evicting(cache_path, monkeypatch):
+	cache = DiskCache(cache_path, size_limit=25)
+	evictions = list()
+	monkeypatch.setattr(cache, 'evict', lambda: evictions.append(True))
+	for _ in range(5):
+		cache.put('abcdef', BytesIO('0123456789')).close()
+	cache.put('ghijkl', BytesIO('0123456789')).close()
+	assert not evictions
+
+def test_shared_directory(cache_path):
+	DiskCache(cache_path).put('abcdef', BytesIO('some data')).close()
+	with DiskCache(cache_path).get('abcdef') as cached:
+		assert cached.read() == 'some data'
+
+def test_no_temporary_files(cache_path):
+	cache = DiskCache(cache_path)
+	cache.put('abcdef', BytesIO('some data')).close()
+	for _, _, filenames in os.walk(cache_path):
+		assert not [filename for filename in filenames if filename.startswith('.tmp-')]
+
+def test_evict_least_recently_used(cache_path):
+	cache = DiskCache(cache_path, size_limit=25)
+	cache.put('key-1', BytesIO('0123456789')).close()
+	cache.put('key-2', BytesIO('0123456789')).close()
+	past = time.time() - 100
+	os.utime(os.path.join(cache_path, '-1', 'key-1'), (past, past))
+	os.utime(os.path.join(cache_path, '-2', 'key-2'), (past + 10, past + 10))
+	cache.get('key-1').close()
+	cache.put('key-3', BytesIO('0123456789')).close()
+	assert cache.get('key-2') is None
+	assert cache.get('key-1') is not None
+	assert cache.get('key-3') is not None
+
+def test_key_for():
+	percept = rigor.types.Percept()
+	percept.locator = 's3://bucket/key'
+	locator_key = DiskCache.key_for(percept)
+	assert locator_key.startswith('locator-')
+	percept.hash = 'abcdef'
+	assert DiskCache.key_for(percept) == 'abcdef'
@@ -3,8 +3,14 @@ import os
 import constants
 import tempfile
 import pytest
+import shutil
 import time
 
+def _remove_checkpoint(filename):
+	os.unlink(filename)
+	if os.path.exists(rigor.checkpoint.index_filename(filename)):
+		os.unlink(rigor.checkpoint.index_filename(filename))
+
 def test_checkpointer_empty():
 	checkpointer = rigor.checkpoint.Checkpointer(None)
 	filename = checkpointer.filename
@@ -31,7 +37,7 @@ def test_checkpointer_keep_after_error():
 			assert os.path.exists(filename)
 			raise StandardError
 	assert os.path.exists(filename)
-	os.unlink(filename)
+	_remove_checkpoint(filename)
 	assert not os.path.exists(filename)
 
 def test_checkpointer_keep():
@@ -40,7 +46,7 @@ def test_checkpointer_keep():
 	with checkpointer:
 		assert os.path.exists(filename)
 	assert os.path.exists(filename)
-	os.unlink(filename)
+	_remove_checkpoint(filename)
 	assert not os.path.exists(filename)
 
 @pytest.mark.parametrize('flush', [(True, ), (False, )])
@@ -55,7 +61,7 @@ def test_checkpointer_store(flush):
 		checkpointer, checkpoint = rigor.checkpoint.Checkpointer.resume(old_file)
 		assert test_id in checkpoint.seen
 		assert test_entry == checkpoint.results[0]
-	os.unlink(filename)
+	_remove_checkpoint(filename)
 
 def test_checkpointer_parameters():
 	start = time.time()
@@ -68,4 +74,231 @@ def test_checkpointer_parameters():
 	assert timestamp > start
 	assert timestamp < time.time()
 	assert read_parameters == parameters
-	os.unlink(filename)
+	_remove_checkpoint(filename)
+
+def test_checkpointer_resume_in_place():
+	checkpointer = rigor.checkpoint.Checkpointer(('a', 1), delete_on_success=False)
+	filename = checkpointer.filename
+	with checkpointer:
+		checkpointer.log(1, 'one')
+		checkpointer.log(2, 'two')
+	size = os.path.getsize(filename)
+	checkpointer, checkpoint = rigor.checkpoint.Checkpointer.resume_in_place(filename, delete_on_success=False)
+	assert checkpoint.parameters == ('a', 1)
+	assert checkpoint.seen == set((1, 2))
+	assert len(checkpoint.results) == 2
+	assert list(checkpoint.results) == ['one', 'two']
+	assert checkpointer.filename == filename
+	assert os.path.getsize(filename) == size
+	with checkpointer:
+		checkpointer.log(3, 'three')
+	with open(filename, 'rb') as checkpoint_file:
+		checkpointer, checkpoint = rigor.checkpoint.Checkpointer.resume(checkpoint_file)
+		checkpointer.close(True)
+	assert checkpoint.seen == set((1, 2, 3))
+	assert checkpoint.results == ['one', 'two', 'three']
+	_remove_checkpoint(filename)
+
+def test_checkpointer_resume_in_place_truncated():
+	checkpointer = rigor.checkpoint.Checkpointer(None, delete_on_success=False)
+	filename = checkpointer.filename
+	with checkpointer:
+		checkpointer.log(1, 'one', flush=True)
+		size = os.path.getsize(filename)
+		checkpointer.log(2, 'two' * 100)
+	with open(filename, 'r+b') as checkpoint_file:
+		checkpoint_file.truncate(size + 20)
+	checkpointer, checkpoint = rigor.checkpoint.Checkpointer.resume_in_place(filename, delete_on_success=False)
+	assert checkpoint.seen == set((1, ))
+	assert os.path.getsize(filename) == size
+	with checkpointer:
+		checkpointer.log(3, 'three')
+	checkpointer, checkpoint = rigor.checkpoint.Checkpointer.resume_in_place(filename)
+	assert checkpoint.seen == set((1, 3))
+	assert list(checkpoint.results) == ['one', 'three']
+	checkpointer.close(True)
+	assert not os.path.exists(filename)
+
+def test_checkpointer_resume_in_place_old_format():
+	with tempfile.NamedTemporaryFile(prefix='rigor-test-', delete=False) as checkpoint_file:
+		with open(constants.kExampleCheckpointFile, 'rb') as example_file:
+			checkpoint_file.write(example_file.read())
+	checkpointer, checkpoint = rigor.checkpoint.Checkpointer.resume_in_place(checkpoint_file.name, delete_on_success=False)
+	assert checkpoint.seen == set((113714, ))
+	assert len(list(checkpoint.results)[0]) == 4
+	with checkpointer:
+		checkpointer.log(1, 'one')
+	checkpointer, checkpoint = rigor.checkpoint.Checkpointer.resume_in_place(checkpoint_file.name)
+	assert checkpoint.seen == set((113714, 1))
+	checkpointer.close(True)
+
+def test_checkpointer_flush_entries():
+	checkpointer = rigor.checkpoint.Checkpointer(None, flush_entries=3, flush_interval=3600)
+	filename = checkpointer.filename
+	with checkpointer:
+		checkpointer.log(1, 'one')
+		size = os.path.getsize(filename)
+		checkpointer.log(2, 'two')
+		assert os.path.getsize(filename) == size
+		checkpointer.log(3, 'three')
+		assert os.path.getsize(filename) > size
+		size = os.path.getsize(filename)
+		checkpointer.log(4, 'four', flush=True)
+		assert os.path.getsize(filename) > size
+		size = os.path.getsize(filename)
+		checkpointer.log(5, 'five')
+		checkpointer.flush()
+		assert os.path.getsize(filename) > size
+
+def test_checkpointer_flush_interval():
+	checkpointer = rigor.checkpoint.Checkpointer(None, flush_entries=1000, flush_interval=0.05, fsync_interval=0)
+	filename = checkpointer.filename
+	with checkpointer:
+		checkpointer.log(1, 'one')
+		size = os.path.getsize(filename)
+		time.sleep(0.1)
+		checkpointer.log(2, 'two')
+		assert os.path.getsize(filename) > size
+
+def test_checkpointer_background():
+	checkpointer = rigor.checkpoint.Checkpointer(None, delete_on_success=False, flush_entries=1000, flush_interval=0.05, background=True)
+	filename = checkpointer.filename
+	with checkpointer:
+		checkpointer.log(1, 'one')
+		size = os.path.getsize(filename)
+		deadline = time.time() + 5
+		while os.path.getsize(filename) == size and time.time() < deadline:
+			time.sleep(0.01)
+		assert os.path.getsize(filename) > size
+		for id in range(2, 100):
+			checkpointer.log(id, str(id))
+		checkpointer.log(100, '100', flush=True)
+		checkpointer, checkpoint = rigor.checkpoint.Checkpointer.resume_in_place(filename)
+		checkpointer.close(False)
+		assert checkpoint.seen == set(range(1, 101))
+	checkpointer, checkpoint = rigor.checkpoint.Checkpointer.resume_in_place(filename)
+	assert list(checkpoint.results) == ['one'] + [str(id) for id in range(2, 101)]
+	checkpointer.close(True)
+	assert not os.path.exists(filename)
+
+def _write_checkpoint(count):
+	checkpointer = rigor.checkpoint.Checkpointer(('a', 1), delete_on_success=False)
+	with checkpointer:
+		for id in range(count):
+			checkpointer.log(id * 10, {'id': id})
+	return checkpointer.filename
+
+def test_checkpoint_file():
+	filename = _write_checkpoint(20)
+	assert os.path.exists(rigor.checkpoint.index_filename(filename))
+	with rigor.checkpoint.CheckpointFile(filename) as saved:
+		assert saved.parameters == ('a', 1)
+		assert saved.indexed == 20
+		assert len(saved) == 20
+		assert saved.ids == [id * 10 for id in range(20)]
+		assert 50 in saved
+		assert 55 not in saved
+		assert saved[50] == {'id': 5}
+		assert saved.get(55) is None
+		with pytest.raises(KeyError):
+			saved[55]
+		assert list(saved) == [{'id': id} for id in range(20)]
+		assert list(saved.iteritems())[3] == (30, {'id': 3})
+	_remove_checkpoint(filename)
+
+def test_checkpoint_file_old_format():
+	with rigor.checkpoint.CheckpointFile(constants.kExampleCheckpointFile) as saved:
+		assert not saved.is_records
+		assert saved.seen == set((113714, ))
+		assert len(saved[113714]) == 4
+
+def test_checkpoint_file_without_index():
+	filename = _write_checkpoint(20)
+	os.unlink(rigor.checkpoint.index_filename(filename))
+	with rigor.checkpoint.CheckpointFile(filename) as saved:
+		assert saved.indexed == 0
+		assert saved.ids == [id * 10 for id in range(20)]
+		assert saved[190] == {'id': 19}
+	_remove_checkpoint(filename)
+
+def test_checkpoint_file_stale_index():
+	filename = _write_checkpoint(20)
+	other_filename = _write_checkpoint(5)
+	os.rename(rigor.checkpoint.index_filename(other_filename), rigor.checkpoint.index_filename(filename))
+	with open(rigor.checkpoint.index_filename(filename), 'r+b') as index_file:
+		index_file.seek(4 * rigor.checkpoint.kIndexEntry.size)
+		index_file.write(rigor.checkpoint.kIndexEntry.pack(12345, index_file.tell()))
+	with rigor.checkpoint.CheckpointFile(filename) as saved:
+		assert saved.indexed == 0
+		assert saved.ids == [id * 10 for id in range(20)]
+	_remove_checkpoint(filename)
+	_remove_checkpoint(other_filename)
+
+def test_checkpointer_resume_in_place_updates_index():
+	filename = _write_checkpoint(20)
+	index_filename = rigor.checkpoint.index_filename(filename)
+	with open(index_filename, 'r+b') as index_file:
+		index_file.truncate(12 * rigor.checkpoint.kIndexEntry.size + 3)
+	checkpointer, checkpoint = rigor.checkpoint.Checkpointer.resume_in_place(filename)
+	assert checkpoint.results.indexed == 12
+	assert os.path.getsize(index_filename) == 20 * rigor.checkpoint.kIndexEntry.size
+	with checkpointer:
+		checkpointer.log(1000, {'id': 100})
+	assert not os.path.exists(filename)
+	assert not os.path.exists(index_filename)
+
+def test_checkpointer_unindexable_id():
+	checkpointer = rigor.checkpoint.Checkpointer(None, delete_on_success=False)
+	filename = checkpointer.filename
+	with checkpointer:
+		checkpointer.log(1, 'one')
+		checkpointer.log('two', 'two')
+		checkpointer.log(3, 'three')
+	assert not os.path.exists(rigor.checkpoint.index_filename(filename))
+	with rigor.checkpoint.CheckpointFile(filename) as saved:
+		assert saved.ids == [1, 'two', 3]
+		assert saved['two'] == 'two'
+	_remove_checkpoint(filename)
+
+def test_find_shards():
+	directory = tempfile.mkdtemp(prefix='rigor-test-')
+	filename = os.path.join(directory, 'run.dat')
+	assert rigor.checkpoint.find_shards(filename) == list()
+	for shard in ('b', 'a'):
+		with rigor.checkpoint.Checkpointer(None, open(rigor.checkpoint.shard_filename(filename, shard), 'wb'), delete_on_success=False) as checkpointer:
+			checkpointer.log(1, shard)
+	assert rigor.checkpoint.find_shards(filename) == [rigor.checkpoint.shard_filename(filename, 'a'), rigor.checkpoint.shard_filename(filename, 'b')]
+	shutil.rmtree(directory)
+
+def test_merge():
+	first = rigor.checkpoint.Checkpointer(('a', 1), delete_on_success=False)
+	with first:
+		first.log(1, 'first-1')
+		first.log(2, 'first-2')
+	second = rigor.checkpoint.Checkpointer(('a', 1), delete_on_success=False)
+	with second:
+		second.log(2, 'second-2')
+		second.log(3, 'second-3')
+		second.log(3, 'second-3-again')
+	with open(first.filename, 'rb') as first_file:
+		first_timestamp, _ = rigor.checkpoint.Checkpointer.read_header(first_file)
+	assert rigor.checkpoint.merge([first.filename, second.filename], second.filename) == 3
+	with rigor.checkpoint.CheckpointFile(second.filename) as merged:
+		assert merged.timestamp == first_timestamp
+		assert merged.parameters == ('a', 1)
+		assert merged.indexed == 3
+		assert merged.ids == [1, 2, 3]
+		assert list(merged) == ['first-1', 'first-2', 'second-3']
+	_remove_checkpoint(first.filename)
+	_remove_checkpoint(second.filename)
+
+def test_merge_different_parameters():
+	first = rigor.checkpoint.Checkpointer(('a', 1), delete_on_success=False)
+	first.close(True)
+	second = rigor.checkpoint.Checkpointer(('b', 2), delete_on_success=False)
+	second.close(True)
+	with tempfile.NamedTemporaryFile(prefix='rigor-test-') as output_file:
+		with pytest.raises(ValueError):
+			rigor.checkpoint.merge([first.filename, second.filename], output_file.name)
+	_remove_checkpoint(first.filename)
+	_remove_checkpoint(second.filename)
@@ -96,6 +96,88 @@ def test_build_matrices():
 	assert np.allclose(gt_matrix, kMatchMatrixGroundTruth)
 	assert np.allclose(det_matrix, kMatchMatrixDetections)
 
+def test_rectangle_bounds():
+	gt_poly, det_poly = ObjectAreaEvaluator.prune_and_polygon(kGroundTruth, kDetected)
+	bounds = ObjectAreaEvaluator.rectangle_bounds(gt_poly)
+	assert bounds.tolist() == [list(polygon.bounds) for polygon in gt_poly]
+
+def test_rectangle_bounds_not_rectangles():
+	assert ObjectAreaEvaluator.rectangle_bounds([Polygon(((1, 1), (5, 1), (3, 4)))]) is None
+	assert ObjectAreaEvaluator.rectangle_bounds([Polygon(((1, 1), (5, 2), (5, 6), (1, 5)))]) is None
+	assert ObjectAreaEvaluator.rectangle_bounds([kNonZeroAreaPolygon, kZeroAreaPolygon]) is None
+
+def test_build_matrices_rectangles_match_polygons():
+	gt_poly, det_poly = ObjectAreaEvaluator.prune_and_polygon(kGroundTruth2, kDetected2)
+	precision_matrix, recall_matrix = ObjectAreaEvaluator.build_matrices(gt_poly, det_poly)
+	for gt_index, ground_truth in enumerate(gt_poly):
+		for det_index, detection in enumerate(det_poly):
+			overlap = ground_truth.intersection(detection).area
+			assert np.isclose(precision_matrix[gt_index, det_index], overlap / detection.area)
+			assert np.isclose(recall_matrix[gt_index, det_index], overlap / ground_truth.area)
+
+def test_build_matrices_mixed_polygons():
+	triangle = ((2, 2), (9, 2), (5, 4))
+	gt_poly, det_poly = ObjectAreaEvaluator.prune_and_polygon(kGroundTruth + (triangle, ), kDetected)
+	precision_matrix, recall_matrix = ObjectAreaEvaluator.build_matrices(gt_poly, det_poly)
+	assert np.allclose(precision_matrix[:-1], kMatchMatrixGroundTruth)
+	assert np.allclose(recall_matrix[:-1], kMatchMatrixDetections)
+	assert np.allclose(recall_matrix[-1], [0., 0., 0., 0., 0., 0., 0.])
+
+def test_overlapping_bounds():
+	ground_truth_bounds = np.array([[0., 0., 2., 2.], [10., 10., 12., 12.]])
+	detection_bounds = np.array([[1., 1., 3., 3.], [2., 2., 4., 4.], [5., 5., 6., 6.]])
+	gt_indices, det_indices = ObjectAreaEvaluator.overlapping_bounds(ground_truth_bounds, detection_bounds)
+	assert zip(gt_indices.tolist(), det_indices.tolist()) == [(0, 0), (0, 1)]
+
+def test_overlapping_bounds_matches_dense():
+	random = np.random.RandomState(7)
+	corners = random.uniform(0., 100., (2, 60, 2))
+	sizes = random.uniform(0., 15., (2, 60, 2))
+	ground_truth_bounds, detection_bounds = (np.hstack((corners[index], corners[index] + sizes[index])) for index in range(2))
+	ground_truths = ground_truth_bounds[:, np.newaxis, :]
+	detections = detection_bounds[np.newaxis, :, :]
+	dense = ((ground_truths[..., 0] <= detections[..., 2]) & (detections[..., 0] <= ground_truths[..., 2]) &
+			(ground_truths[..., 1] <= detections[..., 3]) & (detections[..., 1] <= ground_truths[..., 3]))
+	gt_indices, det_indices = ObjectAreaEvaluator.overlapping_bounds(ground_truth_bounds, detection_bounds)
+	assert np.array_equal(gt_indices, np.nonzero(dense)[0])
+	assert np.array_equal(det_indices, np.nonzero(dense)[1])
+	gt_indices, det_indices = ObjectAreaEvaluator.overlapping_bounds(ground_truth_bounds, detection_bounds[:0])
+	assert len(gt_indices) == 0 and len(det_indices) == 0
+
+def test_overlapping_bounds_stacked():
+	# Every box spans the same columns, but only boxes in the same row overlap
+	rows = np.arange(200, dtype=float)[:, np.newaxis] * 10.
+	ground_truth_bounds = np.hstack((np.zeros_like(rows), rows, np.full_like(rows, 100.), rows + 5.))
+	detection_bounds = np.hstack((np.full_like(rows, 50.), rows + 1., np.full_like(rows, 150.), rows + 4.))
+	gt_indices, det_indices = ObjectAreaEvaluator.overlapping_bounds(ground_truth_bounds, detection_bounds)
+	assert gt_indices.tolist() == range(200)
+	assert det_indices.tolist() == range(200)
+
+def test_overlapping_bounds_many_apart():
+	# A dense mask for this many boxes would need 400 million entries
+	columns = np.arange(20000, dtype=float)[:, np.newaxis] * 10.
+	ground_truth_bounds = np.hstack((columns, np.zeros_like(columns), columns + 5., np.full_like(columns, 5.)))
+	detection_bounds = ground_truth_bounds + [4., 4., 4., 4.]
+	gt_indices, det_indices = ObjectAreaEvaluator.overlapping_bounds(ground_truth_bounds, detection_bounds)
+	assert gt_indices.tolist() == range(20000)
+	assert det_indices.tolist() == range(20000)
+
+def test_build_matrices_polygons():
+	ground_truths = (((0, 0), (4, 0), (0, 4)), ((20, 20), (24, 20), (20, 24)))
+	detections = (((0, 0), (2, 0), (0, 2)), ((30, 30), (32, 30), (30, 32)), ((22, 22), (24, 22), (22, 24)))
+	gt_poly, det_poly = ObjectAreaEvaluator.prune_and_polygon(ground_truths, detections)
+	precision_matrix, recall_matrix = ObjectAreaEvaluator.build_matrices(gt_poly, det_poly)
+	assert np.allclose(precision_matrix, [[1., 0., 0.], [0., 0., 0.]])
+	assert np.allclose(recall_matrix, [[.25, 0., 0.], [0., 0., 0.]])
+
+def test_build_matrices_zero_area_warns_once(capfd):
+	ground_truths = (((0, 0), (4, 0), (0, 4)), )
+	detections = (((0, 0), (2, 0), (0, 2)), ((1, 1), (3, 1), (3, 1), (1, 1)), ((5, 5), (6, 5), (5, 6)))
+	gt_poly, det_poly = ObjectAreaEvaluator.prune_and_polygon(ground_truths * 3, detections)
+	ObjectAreaEvaluator.build_matrices(gt_poly, det_poly)
+	out, err = capfd.readouterr()
+	assert err.count('Warning') == 1
+
 def test_evaluate():
 	evaluator = ObjectAreaEvaluator()
 	result = evaluator.evaluate(kGroundTruth, kDetected)
@@ -106,6 +188,71 @@ def test_evaluate_no_detections():
 	result = evaluator.evaluate(kGroundTruth, list())
 	assert result == (0., 0., (0., 0.), (0., 5.))
 
+def test_classify_matches():
+	evaluator = ObjectAreaEvaluator()
+	gt_poly, det_poly = ObjectAreaEvaluator.prune_and_polygon(kGroundTruth, kDetected)
+	precision_matrix, recall_matrix = ObjectAreaEvaluator.build_matrices(gt_poly, det_poly)
+	one_to_one_precision, one_to_one_recall, one_to_many, many_to_one = evaluator.classify_matches(precision_matrix, recall_matrix)
+	assert np.argwhere(one_to_one_precision).tolist() == [[4, 4]]
+	assert np.argwhere(one_to_one_recall).tolist() == [[4, 4]]
+	assert one_to_many == [(1, set([1, 2]))]
+	assert many_to_one == [(3, set([2, 3]))]
+
+def test_evaluate_scatter_punishment():
+	evaluator = ObjectAreaEvaluator(scatter_punishment=lambda k: 1.0 / len(k))
+	result = evaluator.evaluate(kGroundTruth, kDetected)
+	assert result == (2.5 / 7.0, 0.5, (2.5, 7.0), (2.5, 5.0))
+
+def test_sweep():
+	thresholds = [(tp, tr) for tp in (0.1, 0.4, 0.9) for tr in (0.2, 0.8)]
+	results = ObjectAreaEvaluator().sweep(kGroundTruth, kDetected, thresholds)
+	assert len(results) == len(thresholds)
+	for (tp, tr), result in zip(thresholds, results):
+		evaluator = ObjectAreaEvaluator(precision_threshold=tp, recall_threshold=tr)
+		assert result == evaluator.evaluate(kGroundTruth, kDetected)
+	assert results[thresholds.index((0.4, 0.8))] == (0.5714285714285714, 0.8, (4.0, 7.0), (4.0, 5.0))
+
+def test_sweep_no_detections():
+	results = ObjectAreaEvaluator().sweep(kGroundTruth, list(), [(0.4, 0.8), (0.5, 0.5)])
+	assert results == [(0., 0., (0., 0.), (0., 5.)), (0., 0., (0., 0.), (0., 5.))]
+
+def test_evaluate_matrices_thresholds():
+	evaluator = ObjectAreaEvaluator()
+	default = evaluator.evaluate_matrices(kPrecisionMatrix, kRecallMatrix)
+	assert evaluator.evaluate_matrices(kPrecisionMatrix, kRecallMatrix, 0.4, 0.8) == default
+	assert evaluator.evaluate_matrices(kPrecisionMatrix, kRecallMatrix, 0.2, 0.8) != default
+
+def test_evaluate_corpus():
+	images = [(kGroundTruth, kDetected), (kGroundTruth2, kDetected2), (kGroundTruth, list())]
+	evaluator = ObjectAreaEvaluator()
+	corpus, per_image = evaluator.evaluate_corpus(iter(images))
+	assert per_image.shape == (3, 6)
+	for row, (ground_truths, detections) in zip(per_image.tolist(), images):
+		precision, recall, (match_detection, detection_count), (match_ground_truth, ground_truth_count) = evaluator.evaluate(ground_truths, detections)
+		assert row == [precision, recall, match_detection, detection_count, match_ground_truth, ground_truth_count]
+	match_detection, detection_count = per_image[:, 2].sum(), per_image[:, 3].sum()
+	match_ground_truth, ground_truth_count = per_image[:, 4].sum(), per_image[:, 5].sum()
+	assert corpus == (match_detection / detection_count, match_ground_truth / ground_truth_count, (match_detection, detection_count), (match_ground_truth, ground_truth_count))
+
+def test_evaluate_corpus_parallel():
+	images = [(kGroundTruth, kDetected), (kGroundTruth2, kDetected2)] * 10
+	evaluator = ObjectAreaEvaluator()
+	expected = evaluator.evaluate_corpus(images)
+	corpus, per_image = evaluator.evaluate_corpus(iter(images), processes=2, chunksize=3)
+	assert corpus == expected[0]
+	assert np.array_equal(per_image, expected[1])
+
+def test_evaluate_corpus_extract():
+	results = [(None, kDetected, kGroundTruth, 0.1)]
+	evaluator = ObjectAreaEvaluator()
+	corpus, per_image = evaluator.evaluate_corpus(results, extract=lambda result: (result[2], result[1]))
+	assert corpus == evaluator.evaluate(kGroundTruth, kDetected)
+
+def test_evaluate_corpus_empty():
+	corpus, per_image = ObjectAreaEvaluator().evaluate_corpus(list())
+	assert corpus == (0., 0., (0., 0.), (0., 0.))
+	assert per_image.shape == (0, 6)
+
 def test_match_detections():
 	evaluator = ObjectAreaEvaluator()
 	result = evaluator.match_detections(kGroundTruth, kDetected)
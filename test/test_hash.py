@@ -14,3 +14,29 @@ def test_hash_path():
 	expected = '6ecd86bbe85e03ee2a03eb61ad080fcefe399df1c802fecc79d20949c8986115'
 	hashed = rigor.hash.sha256_hash(data)
 	assert hashed == expected
+
+def test_hashing_reader():
+	data = io.BytesIO('a test string to hash')
+	reader = rigor.hash.HashingReader(data)
+	assert reader.read(6) == 'a test'
+	assert reader.read() == ' string to hash'
+	assert reader.hexdigest() == '1f9ea24f2e0b6707fdeb7ea29613b080d8657d5d2dfefbe8130e9c40cf6d9e2d'
+	assert reader.byte_count == 21
+
+def test_hashing_reader_reread():
+	data = io.BytesIO('a test string to hash')
+	reader = rigor.hash.HashingReader(data)
+	reader.read(10)
+	reader.seek(0)
+	assert reader.read() == 'a test string to hash'
+	assert reader.hexdigest() == '1f9ea24f2e0b6707fdeb7ea29613b080d8657d5d2dfefbe8130e9c40cf6d9e2d'
+
+def test_hashing_reader_skip():
+	data = io.BytesIO('a test string to hash')
+	reader = rigor.hash.HashingReader(data)
+	reader.seek(7)
+	assert reader.read(6) == 'string'
+	assert reader.tell() == 13
+	assert reader.hexdigest() == '1f9ea24f2e0b6707fdeb7ea29613b080d8657d5d2dfefbe8130e9c40cf6d9e2d'
+	assert reader.tell() == 13
+	assert reader.byte_count == 21
@@ -9,7 +9,9 @@ from urlparse import urlsplit
 from rigor.config import RigorDefaultConfiguration
 from rigor.database import Database
 from rigor.utils import RigorJSONEncoder
-from rigor.interop import Importer, Exporter
+from rigor.interop import Importer, Exporter, DuplicatePerceptError, kDedupLink, kDedupReject, iterate_metadata, ImportJournal
+import rigor.interop
+import rigor.s3
 from rigor.types import Percept
 from rigor.perceptops import PerceptOps
 import pytest
@@ -58,10 +60,11 @@ def setup_function(function):
 def teardown_function(function):
 	shutil.rmtree(constants.kRepoDirectory, True)
 	shutil.rmtree(constants.kImportDirectory, True)
-	try:
-		os.unlink(constants.kImportFile)
-	except OSError:
-		pass
+	for path in (constants.kImportFile, constants.kImportJournalFile):
+		try:
+			os.unlink(path)
+		except OSError:
+			pass
 	try:
 		os.unlink(constants.kImportDatabase)
 	except OSError:
@@ -135,6 +138,24 @@ def test_import_all_with_data_to_s3(importdb):
 			assert ops.read(percept.locator) is not None
 			locator = urlsplit(percept.locator)
 			assert len(percept.annotations) == 1
+		assert percepts[0].hash == '6b86b273ff34fce19d6b804eff5a3f5747ada4eaa22f1d49c01e52ddb7875b4b'
+		assert percepts[0].byte_count == 1
+
+def test_import_dedup_to_s3(importdb):
+	metadata = _duplicate_metadata('') + _duplicate_metadata('-copy')
+	for index, percept in enumerate(metadata):
+		percept['locator'] = 's3://' + os.path.join(constants.kExampleBucket, 'dedup-{0}.txt'.format(index))
+	Importer(kConfig, constants.kImportDatabase, metadata, dedup=kDedupLink).run()
+	ops = PerceptOps(kConfig)
+	with importdb.get_session() as session:
+		percepts = session.query(Percept).order_by(Percept.id).all()
+		assert len(percepts) == 6
+		for index, percept in enumerate(percepts):
+			assert percept.hash == percepts[index % 3].hash
+			with ops.read(percept.locator) as data:
+				assert len(data.read()) == percept.byte_count
+	client = rigor.s3.get_client(kConfig, constants.kExampleBucket)
+	assert [key for key in client.list() if rigor.interop.kStagingSuffix in key] == []
 
 def test_import_all_with_data_to_remote(importdb):
 	with open(constants.kImportFile, 'rb') as import_file:
@@ -170,3 +191,239 @@ def test_export_tag(exportdb):
 	with open(constants.kImportFile, 'rb') as import_file:
 		metadata = json.load(import_file)
 		assert len(metadata) == 3
+
+def test_export_json_lines(exportdb):
+	exporter = Exporter(kConfig, constants.kTestFile, constants.kImportFile, json_lines=True)
+	exporter.run()
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = [json.loads(line) for line in import_file]
+	assert len(metadata) == 12
+	assert metadata[0]['device_id'] == 'device_1938401'
+	assert metadata[0]['annotations'][0]['model'] == 'b'
+
+def test_export_batches(exportdb):
+	exporter = Exporter(kConfig, constants.kTestFile, constants.kImportFile, batch_size=5)
+	exporter.run()
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	ids = [percept['id'] for percept in metadata]
+	assert len(ids) == 12
+	assert ids == sorted(ids)
+	with exportdb.get_session(False) as session:
+		for percept in metadata:
+			expected = session.query(Percept).get(percept['id'])
+			assert json.loads(json.dumps(expected.serialize(True), cls=RigorJSONEncoder)) == percept
+
+def test_export_tag_batches(exportdb):
+	exporter = Exporter(kConfig, constants.kTestFile, constants.kImportFile, batch_size=2)
+	exporter.run('simple')
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+		assert len(metadata) == 3
+
+def test_import_batched(importdb):
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile, import_data=True, batch_size=2, threads=2)
+	assert importer.run() == []
+	with importdb.get_session() as session:
+		percepts = session.query(Percept).order_by(Percept.id).all()
+		assert len(percepts) == 3
+		for percept in percepts:
+			locator = urlsplit(percept.locator)
+			assert os.path.exists(locator.path)
+			assert len(percept.annotations) == 1
+		assert percepts[0].hash == '6b86b273ff34fce19d6b804eff5a3f5747ada4eaa22f1d49c01e52ddb7875b4b'
+		assert percepts[2].byte_count == 1
+
+def test_import_batched_commit_failure(importdb, monkeypatch):
+	def failing_update(percept, metadata, data_fields):
+		raise RuntimeError('Interrupted')
+	monkeypatch.setattr(Importer, '_update_data_fields', staticmethod(failing_update))
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile, import_data=True, batch_size=10, threads=2)
+	with pytest.raises(RuntimeError):
+		importer.run()
+	with importdb.get_session() as session:
+		assert session.query(Percept).count() == 0
+	assert os.listdir(constants.kRepoDirectory) == []
+
+def test_import_batched_failures(importdb):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	metadata.append(dict(metadata[0])) # Duplicate locator
+	metadata[1]['source'] = 'file://' + os.path.abspath(os.path.join(constants.kImportDirectory, 'missing.txt'))
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, import_data=True, batch_size=10, threads=2)
+	failed = importer.run()
+	assert failed == [metadata[3], metadata[1]]
+	with importdb.get_session() as session:
+		percepts = session.query(Percept).order_by(Percept.id).all()
+		assert [percept.locator for percept in percepts] == [metadata[0]['locator'], metadata[2]['locator']]
+		for percept in percepts:
+			assert len(percept.annotations) == 1
+			assert percept.hash is not None
+
+def _duplicate_metadata(suffix):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	for percept in metadata:
+		percept['locator'] = percept['locator'].replace('.txt', suffix + '.txt')
+	return metadata
+
+def test_import_dedup_link(importdb):
+	Importer(kConfig, constants.kImportDatabase, constants.kImportFile, dedup=kDedupLink).run()
+	metadata = _duplicate_metadata('-copy')
+	Importer(kConfig, constants.kImportDatabase, metadata, dedup=kDedupLink).run()
+	with importdb.get_session() as session:
+		percepts = session.query(Percept).order_by(Percept.id).all()
+		assert len(percepts) == 6
+		for original, duplicate in zip(percepts[:3], percepts[3:]):
+			assert original.hash == duplicate.hash
+			assert duplicate.byte_count == 1
+			assert os.path.samefile(urlsplit(original.locator).path, urlsplit(duplicate.locator).path)
+
+def test_import_dedup_reject(importdb):
+	Importer(kConfig, constants.kImportDatabase, constants.kImportFile).run()
+	metadata = _duplicate_metadata('-copy')
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, dedup=kDedupReject)
+	with pytest.raises(DuplicatePerceptError):
+		importer.run()
+	with importdb.get_session() as session:
+		assert session.query(Percept).count() == 3
+	assert not os.path.exists(urlsplit(metadata[0]['locator']).path)
+
+def test_import_dedup_batched(importdb):
+	Importer(kConfig, constants.kImportDatabase, constants.kImportFile).run()
+	metadata = _duplicate_metadata('-copy') + _duplicate_metadata('-again')
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, batch_size=10, threads=2, dedup=kDedupLink)
+	assert importer.run() == []
+	with importdb.get_session() as session:
+		percepts = session.query(Percept).order_by(Percept.id).all()
+		assert len(percepts) == 9
+		for index, percept in enumerate(percepts):
+			original = urlsplit(percepts[index % 3].locator).path
+			assert os.path.samefile(original, urlsplit(percept.locator).path)
+
+def test_import_dedup_batched_reject(importdb):
+	metadata = _duplicate_metadata('') + _duplicate_metadata('-copy')
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, batch_size=10, threads=2, dedup=kDedupReject)
+	assert importer.run() == metadata[3:]
+	with importdb.get_session() as session:
+		assert session.query(Percept).count() == 3
+
+def _count_source_reads(monkeypatch):
+	reads = list()
+	original_open = open
+	def counting_open(name, mode='r', *args):
+		if name.startswith(os.path.abspath(constants.kImportDirectory)) and 'r' in mode:
+			reads.append(name)
+		return original_open(name, mode, *args)
+	monkeypatch.setattr(rigor.interop, 'open', counting_open, raising=False)
+	return reads
+
+def _staged_files():
+	staged = list()
+	for _, _, filenames in os.walk(constants.kRepoDirectory):
+		staged.extend(filename for filename in filenames if rigor.interop.kStagingSuffix in filename)
+	return staged
+
+def test_import_dedup_reads_once(importdb, monkeypatch):
+	reads = _count_source_reads(monkeypatch)
+	Importer(kConfig, constants.kImportDatabase, constants.kImportFile, dedup=kDedupLink).run()
+	Importer(kConfig, constants.kImportDatabase, _duplicate_metadata('-copy'), dedup=kDedupLink).run()
+	assert len(reads) == 6
+	assert len(set(reads)) == 3
+	assert _staged_files() == []
+	with pytest.raises(DuplicatePerceptError):
+		Importer(kConfig, constants.kImportDatabase, _duplicate_metadata('-again'), dedup=kDedupReject).run()
+	assert _staged_files() == []
+
+def test_import_dedup_batched_reads_once(importdb, monkeypatch):
+	reads = _count_source_reads(monkeypatch)
+	metadata = _duplicate_metadata('') + _duplicate_metadata('-copy')
+	assert Importer(kConfig, constants.kImportDatabase, metadata, batch_size=10, threads=2, dedup=kDedupLink).run() == []
+	assert len(reads) == 6
+	assert _staged_files() == []
+	with importdb.get_session() as session:
+		percepts = session.query(Percept).order_by(Percept.id).all()
+		for index, percept in enumerate(percepts):
+			assert percept.hash is not None
+			assert os.path.samefile(urlsplit(percepts[index % 3].locator).path, urlsplit(percept.locator).path)
+
+def test_iterate_metadata_array(monkeypatch):
+	with open(constants.kImportFile, 'rb') as import_file:
+		expected = json.load(import_file)
+	monkeypatch.setattr(rigor.interop, 'kMetadataReadSize', 7)
+	assert list(iterate_metadata(constants.kImportFile)) == expected
+
+def test_iterate_metadata_json_lines():
+	with open(constants.kImportFile, 'rb') as import_file:
+		expected = json.load(import_file)
+	with open(constants.kImportFile, 'wb') as import_file:
+		for entry in expected:
+			json.dump(entry, import_file)
+			import_file.write('\n\n')
+	assert list(iterate_metadata(constants.kImportFile)) == expected
+
+def test_iterate_metadata_directory():
+	with open(constants.kImportFile, 'rb') as import_file:
+		expected = json.load(import_file)
+	metadata_directory = os.path.join(constants.kImportDirectory, 'metadata')
+	os.mkdir(metadata_directory)
+	for index, entry in enumerate(expected):
+		with open(os.path.join(metadata_directory, '{:02}.json'.format(index)), 'wb') as metadata_file:
+			json.dump(entry, metadata_file)
+	assert list(iterate_metadata(metadata_directory)) == expected
+
+def test_iterate_metadata_truncated():
+	with open(constants.kImportFile, 'rb') as import_file:
+		contents = import_file.read()
+	with open(constants.kImportFile, 'wb') as import_file:
+		import_file.write(contents[:-20])
+	with pytest.raises(ValueError):
+		list(iterate_metadata(constants.kImportFile))
+
+def test_import_generator(importdb):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	importer = Importer(kConfig, constants.kImportDatabase, (entry for entry in metadata), import_data=False)
+	importer.run()
+	with importdb.get_session() as session:
+		assert session.query(Percept).count() == 3
+
+def test_import_journal_skips_imported(importdb):
+	Importer(kConfig, constants.kImportDatabase, constants.kImportFile, journal=constants.kImportJournalFile).run()
+	# Without the journal, this would fail on the unique locator constraint
+	Importer(kConfig, constants.kImportDatabase, constants.kImportFile, journal=constants.kImportJournalFile).run()
+	with importdb.get_session() as session:
+		assert session.query(Percept).count() == 3
+	with ImportJournal(constants.kImportJournalFile) as journal:
+		assert len(journal) == 3
+		assert not journal.uncertain
+
+def test_import_journal_batched(importdb):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	metadata[1]['source'] = 'file://' + os.path.abspath(os.path.join(constants.kImportDirectory, 'missing.txt'))
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, batch_size=2, journal=constants.kImportJournalFile)
+	assert importer.run() == [metadata[1]]
+	with ImportJournal(constants.kImportJournalFile) as journal:
+		assert metadata[0]['locator'] in journal
+		assert metadata[1]['locator'] not in journal
+		assert metadata[2]['locator'] in journal
+		assert journal.uncertain == set((metadata[1]['locator'], ))
+
+def test_import_journal_interrupted(importdb):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	importer = Importer(kConfig, constants.kImportDatabase, metadata[:2], import_data=False)
+	importer.run()
+	with open(constants.kImportJournalFile, 'wb') as journal_file:
+		# First percept finished, second committed but not recorded, third partially recorded
+		journal_file.write('? {0}\n+ {0}\n? {1}\n+ {1}'.format(metadata[0]['locator'], metadata[1]['locator']))
+	with ImportJournal(constants.kImportJournalFile) as journal:
+		assert len(journal) == 1
+		assert journal.uncertain == set((metadata[1]['locator'], ))
+	Importer(kConfig, constants.kImportDatabase, metadata, import_data=False, journal=constants.kImportJournalFile).run()
+	with importdb.get_session() as session:
+		assert session.query(Percept).count() == 3
+	with ImportJournal(constants.kImportJournalFile) as journal:
+		assert len(journal) == 3
+		assert not journal.uncertain
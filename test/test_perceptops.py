@@ -1,8 +1,12 @@
 from rigor.perceptops import PerceptOps, ImageOps
 from rigor.types import Percept
 from s3 import setup_module, teardown_module, kKeys
+from io import BytesIO
 import rigor.config
+import rigor.s3
+import boto.s3.key
 import shutil
+import tempfile
 import os.path
 import constants
 import db
@@ -41,12 +45,54 @@ def test_read_s3():
 	with result as text_file:
 		assert text_file.read() == '0'
 
+def test_read_s3_large_streams(monkeypatch):
+	# The S3 mock is not thread-safe, so parts are transferred by a single worker thread
+	config_file = tempfile.NamedTemporaryFile('w', prefix='rigor-test-', suffix='.ini', delete=False)
+	with config_file:
+		config_file.write('[s3]\nmultipart_threshold = 6291456\npart_size = 5242880\ntransfer_threads = 1\n')
+	try:
+		config = rigor.config.RigorDefaultConfiguration(constants.kConfigFile, config_file.name)
+		expected = os.urandom(12 * 1024 * 1024 + 17)
+		key = 'new-s3-key-16'
+		rigor.s3.get_client(config, constants.kExampleBucket).put(key, BytesIO(expected))
+		ranges = list()
+		open_read = boto.s3.key.Key.open_read
+		def recording_open_read(key, headers=None, *args, **kwargs):
+			if headers and 'Range' in headers:
+				ranges.append(headers['Range'])
+			return open_read(key, headers, *args, **kwargs)
+		monkeypatch.setattr(boto.s3.key.Key, 'open_read', recording_open_read)
+		with PerceptOps(config).read('s3://' + os.path.join(constants.kExampleBucket, key)) as data:
+			assert data.read() == expected
+		assert ranges == []
+	finally:
+		os.unlink(config_file.name)
+
 def test_read_http():
 	ops = PerceptOps(kConfig)
 	result = ops.read('http://' + os.path.join(constants.kExampleBucket + '.' + constants.kS3HostName, kKeys[1]), None)
 	with result as text_file:
 		assert text_file.read() == '1'
 
+def test_fetch_s3_cached():
+	cache_path = tempfile.mkdtemp(prefix='rigor-test-cache-')
+	config_file = tempfile.NamedTemporaryFile('w', prefix='rigor-test-', suffix='.ini', delete=False)
+	with config_file:
+		config_file.write('[cache]\npath = {0}\n'.format(cache_path))
+	try:
+		config = rigor.config.RigorDefaultConfiguration(constants.kConfigFile, config_file.name)
+		ops = PerceptOps(config)
+		percept = Percept()
+		percept.locator = 's3://' + os.path.join(constants.kExampleBucket, kKeys[2])
+		with ops.fetch(percept) as percept_data:
+			assert percept_data.read() == '2'
+		ops.read = None # Must not be needed now
+		with ops.fetch(percept) as percept_data:
+			assert percept_data.read() == '2'
+	finally:
+		os.unlink(config_file.name)
+		shutil.rmtree(cache_path)
+
 def test_remove_local():
 	shutil.copy(constants.kExampleImageFile, constants.kExampleTemporaryImageFile)
 	assert os.path.exists(constants.kExampleTemporaryImageFile)
@@ -87,6 +133,49 @@ def test_delete_local_by_id():
 		ops.destroy(percept.id, session)
 	assert not os.path.exists(constants.kExampleTemporaryImageFile)
 
+def test_destroy_all():
+	database = db.get_database()
+	ops = PerceptOps(kConfig)
+	paths = list()
+	with database.get_session() as session:
+		tagged = session.query(rigor.types.PerceptTag.percept_id).filter(rigor.types.PerceptTag.name == 'simple')
+		percepts = session.query(rigor.types.Percept).filter(rigor.types.Percept.id.in_(tagged.subquery())).all()
+		assert len(percepts) == 3
+		for index, percept in enumerate(percepts):
+			path = '{0}-{1}'.format(constants.kExampleTemporaryImageFile, index)
+			shutil.copy(constants.kExampleImageFile, path)
+			percept.locator = 'file://' + path
+			paths.append(path)
+		os.unlink(paths[-1]) # Missing data is ignored
+		assert ops.destroy_all(tagged, session) == 3
+	for path in paths:
+		assert not os.path.exists(path)
+	with database.get_session() as session:
+		assert session.query(rigor.types.Percept).count() == 9
+		assert session.query(rigor.types.PerceptTag).filter(rigor.types.PerceptTag.name == 'simple').count() == 0
+		annotations = session.query(rigor.types.Annotation.id)
+		assert session.query(rigor.types.Annotation).filter(~rigor.types.Annotation.percept_id.in_(session.query(rigor.types.Percept.id))).count() == 0
+		assert session.query(rigor.types.AnnotationTag).filter(~rigor.types.AnnotationTag.annotation_id.in_(annotations)).count() == 0
+		assert session.query(rigor.types.AnnotationProperty).filter(~rigor.types.AnnotationProperty.annotation_id.in_(annotations)).count() == 0
+
+def test_destroy_all_keep_data():
+	shutil.copy(constants.kExampleImageFile, constants.kExampleTemporaryImageFile)
+	database = db.get_database()
+	ops = PerceptOps(kConfig)
+	with database.get_session() as session:
+		percept = session.query(rigor.types.Percept).get(642924)
+		percept.locator = 'file://' + constants.kExampleTemporaryImageFile
+		assert ops.destroy_all([642924, 642924], session, remove_data=False) == 1
+	assert os.path.exists(constants.kExampleTemporaryImageFile)
+	os.unlink(constants.kExampleTemporaryImageFile)
+	with database.get_session() as session:
+		assert session.query(rigor.types.Percept).get(642924) is None
+
+def test_remove_all_http():
+	ops = PerceptOps(kConfig)
+	with pytest.raises(NotImplementedError):
+		ops.remove_all([('http://' + os.path.join(constants.kExampleBucket + '.' + constants.kS3HostName, kKeys[1]), None)])
+
 try:
 	import cv2
 
@@ -0,0 +1,72 @@
+from rigor.readahead import ReadAhead
+from io import BytesIO
+import threading
+import pytest
+
+kData = dict((index, str(index) * (index + 1)) for index in range(20))
+
+def fetch_data(percept):
+	return BytesIO(kData[percept])
+
+def test_order():
+	read_ahead = ReadAhead(fetch_data, 4)
+	fetched = [(percept, data.read()) for percept, data in read_ahead.iterate(range(20))]
+	assert fetched == sorted(kData.items())
+
+def test_empty():
+	read_ahead = ReadAhead(fetch_data, 4)
+	assert list(read_ahead.iterate(list())) == list()
+
+def test_depth_limit():
+	started = list()
+	lock = threading.Lock()
+	def counting_fetch(percept):
+		with lock:
+			started.append(percept)
+		return fetch_data(percept)
+	read_ahead = ReadAhead(counting_fetch, 3)
+	iterator = read_ahead.iterate(range(20))
+	percept, data = next(iterator)
+	assert percept == 0
+	assert len(started) <= 4
+	list(iterator)
+	assert len(started) == 20
+
+def test_byte_limit():
+	read_ahead = ReadAhead(fetch_data, 10, max_bytes=1)
+	fetched = [data.read() for percept, data in read_ahead.iterate(range(20))]
+	assert fetched == [kData[index] for index in range(20)]
+
+def test_fetch_error():
+	def failing_fetch(percept):
+		if percept == 5:
+			raise IOError(percept)
+		return fetch_data(percept)
+	read_ahead = ReadAhead(failing_fetch, 4)
+	with pytest.raises(IOError):
+		list(read_ahead.iterate(range(20)))
+
+def test_byte_limit_reserves_before_fetching():
+	started = list()
+	lock = threading.Lock()
+	def counting_fetch(percept):
+		with lock:
+			started.append(percept)
+		return fetch_data(percept)
+	read_ahead = ReadAhead(counting_fetch, 10, max_bytes=25)
+	iterator = read_ahead.iterate(range(20))
+	percept, data = next(iterator)
+	assert percept == 0
+	assert started == [0]
+	fetched = [data.read() for percept, data in iterator]
+	assert fetched == [kData[index] for index in range(1, 20)]
+
+def test_postfetch():
+	threads = set()
+	def postfetch(percept, percept_data):
+		threads.add(threading.current_thread())
+		return percept_data.read().upper()
+	read_ahead = ReadAhead(fetch_data, 4, postfetch=postfetch)
+	fetched = list(read_ahead.iterate(range(20)))
+	assert fetched == sorted(kData.items())
+	assert threading.current_thread() not in threads
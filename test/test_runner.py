@@ -2,10 +2,19 @@ import rigor.algorithm
 import rigor.runner
 import rigor.types
 import rigor.config
+import rigor.checkpoint
+import rigor.sinks
+import tempfile
+import pytest
+import shutil
 import db
 import os
 import constants
 
+def _without_elapsed(results):
+	""" Results with the elapsed time left out, so that results of different runs can be compared """
+	return [result[:3] for result in results]
+
 class PassthroughAlgorithm(rigor.algorithm.Algorithm):
 	def run(self, percept_data):
 		rigor.algorithm.Algorithm.run(self, percept_data) # cheat for coverage
@@ -16,8 +25,8 @@ class ImageShapeAlgorithm(rigor.algorithm.ImageAlgorithm):
 		return percept_data.shape
 
 class AllPerceptRunner(rigor.runner.DatabaseRunner):
-	def __init__(self, algorithm, config, database, parameters=None, checkpoint=None):
-		super(AllPerceptRunner, self).__init__(algorithm, config, database_name=database, parameters=parameters, checkpoint=checkpoint)
+	def __init__(self, algorithm, config, database, parameters=None, checkpoint=None, processes=1, read_ahead=0, checkpoint_shard=None):
+		super(AllPerceptRunner, self).__init__(algorithm, config, database_name=database, parameters=parameters, checkpoint=checkpoint, processes=processes, read_ahead=read_ahead, checkpoint_shard=checkpoint_shard)
 		self._session = self._database.get_session()
 
 	def get_percepts(self):
@@ -31,6 +40,15 @@ class AllPerceptRunner(rigor.runner.DatabaseRunner):
 		p = DummyPercept(constants.kExampleTextFile, None)
 		return super(AllPerceptRunner, self).fetch_data(p)
 
+class StreamingPerceptRunner(AllPerceptRunner):
+	def get_percepts(self):
+		return self._session.query(rigor.types.Percept).order_by(rigor.types.Percept.id).yield_per(5)
+
+class GeneratorPerceptRunner(AllPerceptRunner):
+	def get_percepts(self):
+		for percept in self._session.query(rigor.types.Percept).order_by(rigor.types.Percept.id):
+			yield percept
+
 class DummyCommandLineRunner(rigor.runner.CommandLineMixIn, AllPerceptRunner):
 	def __init__(self, algorithm, config, database, arguments):
 		parsed_args = self.parse_arguments(arguments)
@@ -93,6 +111,28 @@ def test_run_all():
 	assert len(evaluated) == 12
 	assert len(evaluated[0]) > 0
 
+def test_run_all_parallel():
+	algorithm = PassthroughAlgorithm()
+	apr = AllPerceptRunner(algorithm, kConfig, constants.kTestFile)
+	expected = apr.run()
+	apr = AllPerceptRunner(algorithm, kConfig, constants.kTestFile, processes=3)
+	evaluated = apr.run()
+	assert len(evaluated) == 12
+	assert any(result[2] for result in expected)
+	assert _without_elapsed(evaluated) == _without_elapsed(expected)
+
+def test_run_all_read_ahead():
+	algorithm = PassthroughAlgorithm()
+	apr = AllPerceptRunner(algorithm, kConfig, constants.kTestFile)
+	expected = apr.run()
+	apr = AllPerceptRunner(algorithm, kConfig, constants.kTestFile, read_ahead=4)
+	evaluated = apr.run()
+	assert _without_elapsed(evaluated) == _without_elapsed(expected)
+
+def test_read_ahead_parallel():
+	with pytest.raises(ValueError):
+		AllPerceptRunner(PassthroughAlgorithm(), kConfig, constants.kTestFile, processes=2, read_ahead=4)
+
 def test_create_checkpoint():
 	algorithm = PassthroughAlgorithm()
 	parameters = ('xxx', 'yyy', 2)
@@ -103,9 +143,109 @@ def test_create_checkpoint():
 def test_resume_checkpoint():
 	algorithm = PassthroughAlgorithm()
 	parameters = ('xxx', 'yyy', 2)
-	apr = AllPerceptRunner(algorithm, kConfig, constants.kTestFile, parameters=parameters, checkpoint=constants.kExampleCheckpointFile)
+	with tempfile.NamedTemporaryFile(prefix='rigor-test-', delete=False) as checkpoint_file:
+		with open(constants.kExampleCheckpointFile, 'rb') as example_file:
+			shutil.copyfileobj(example_file, checkpoint_file)
+	apr = AllPerceptRunner(algorithm, kConfig, constants.kTestFile, parameters=parameters, checkpoint=checkpoint_file.name)
 	evaluated = apr.run()
 	assert len(evaluated) == 12
+	assert not os.path.exists(checkpoint_file.name)
+
+class FailingAlgorithm(PassthroughAlgorithm):
+	def __init__(self, fail_after):
+		super(FailingAlgorithm, self).__init__()
+		self._remaining = fail_after
+
+	def run(self, percept_data):
+		if self._remaining == 0:
+			raise RuntimeError('Interrupted')
+		self._remaining -= 1
+		return super(FailingAlgorithm, self).run(percept_data)
+
+def test_resume_compact_checkpoint():
+	expected = AllPerceptRunner(PassthroughAlgorithm(), kConfig, constants.kTestFile).run()
+	with tempfile.NamedTemporaryFile(prefix='rigor-test-', delete=False) as checkpoint_file:
+		pass
+	os.unlink(checkpoint_file.name)
+	apr = AllPerceptRunner(FailingAlgorithm(5), kConfig, constants.kTestFile, checkpoint=checkpoint_file.name)
+	with pytest.raises(RuntimeError):
+		apr.run()
+	with open(checkpoint_file.name, 'rb') as old_file:
+		checkpointer, checkpoint = rigor.checkpoint.Checkpointer.resume(old_file)
+		checkpointer.close(True)
+	assert len(checkpoint.results) == 5
+	for entry in checkpoint.results:
+		assert isinstance(entry, rigor.checkpoint.CompactResult)
+	apr = AllPerceptRunner(PassthroughAlgorithm(), kConfig, constants.kTestFile, checkpoint=checkpoint_file.name)
+	evaluated = apr.run()
+	assert not os.path.exists(checkpoint_file.name)
+	assert [result[0] for result in evaluated] == [result[0] for result in expected]
+	assert [result[1] for result in evaluated] == [result[1] for result in expected]
+	assert [result[2] for result in evaluated] == [result[2] for result in expected]
+
+def test_sharded_checkpoint():
+	expected = AllPerceptRunner(PassthroughAlgorithm(), kConfig, constants.kTestFile).run()
+	directory = tempfile.mkdtemp(prefix='rigor-test-')
+	filename = os.path.join(directory, 'checkpoint.dat')
+	first = AllPerceptRunner(FailingAlgorithm(3), kConfig, constants.kTestFile, checkpoint=filename, checkpoint_shard='first')
+	with pytest.raises(RuntimeError):
+		first.run()
+	second = AllPerceptRunner(FailingAlgorithm(4), kConfig, constants.kTestFile, checkpoint=filename, checkpoint_shard='second')
+	with pytest.raises(RuntimeError):
+		second.run()
+	shards = rigor.checkpoint.find_shards(filename)
+	assert len(shards) == 2
+	assert rigor.checkpoint.merge(shards, filename) == 7
+	resumed = AllPerceptRunner(PassthroughAlgorithm(), kConfig, constants.kTestFile, checkpoint=filename)
+	evaluated = resumed.run()
+	assert sorted(result[0]['id'] for result in evaluated) == sorted(result[0]['id'] for result in expected)
+	shutil.rmtree(directory)
+
+def test_run_sink():
+	expected = AllPerceptRunner(PassthroughAlgorithm(), kConfig, constants.kTestFile).run()
+	with tempfile.NamedTemporaryFile(prefix='rigor-test-', delete=False) as checkpoint_file:
+		with open(constants.kExampleCheckpointFile, 'rb') as example_file:
+			shutil.copyfileobj(example_file, checkpoint_file)
+	apr = AllPerceptRunner(PassthroughAlgorithm(), kConfig, constants.kTestFile, checkpoint=checkpoint_file.name)
+	count = apr.run(rigor.sinks.AggregateSink(lambda count, result: count + 1, 0))
+	assert count == len(expected)
+
+def test_run_sink_failure():
+	with tempfile.NamedTemporaryFile(prefix='rigor-test-') as result_file:
+		sink = rigor.sinks.FileSink(result_file.name)
+		with pytest.raises(RuntimeError):
+			AllPerceptRunner(FailingAlgorithm(5), kConfig, constants.kTestFile).run(sink)
+		assert sink._file.closed
+		assert len(list(rigor.sinks.FileSink.read(result_file.name))) == 5
+
+@pytest.mark.parametrize('runner_class', [StreamingPerceptRunner, GeneratorPerceptRunner])
+@pytest.mark.parametrize('processes', [1, 2])
+def test_run_lazy_percepts(runner_class, processes):
+	expected = AllPerceptRunner(PassthroughAlgorithm(), kConfig, constants.kTestFile).run()
+	evaluated = runner_class(PassthroughAlgorithm(), kConfig, constants.kTestFile, processes=processes).run()
+	assert _without_elapsed(evaluated) == _without_elapsed(expected)
+
+def test_resume_lazy_percepts():
+	expected = AllPerceptRunner(PassthroughAlgorithm(), kConfig, constants.kTestFile).run()
+	with tempfile.NamedTemporaryFile(prefix='rigor-test-', delete=False) as checkpoint_file:
+		pass
+	os.unlink(checkpoint_file.name)
+	with pytest.raises(RuntimeError):
+		StreamingPerceptRunner(FailingAlgorithm(5), kConfig, constants.kTestFile, checkpoint=checkpoint_file.name).run()
+	evaluated = StreamingPerceptRunner(PassthroughAlgorithm(), kConfig, constants.kTestFile, checkpoint=checkpoint_file.name).run()
+	assert not os.path.exists(checkpoint_file.name)
+	assert [result[0]['id'] for result in evaluated] == [result[0]['id'] for result in expected]
+
+def test_resume_logs_remaining(caplog):
+	with tempfile.NamedTemporaryFile(prefix='rigor-test-', delete=False) as checkpoint_file:
+		pass
+	os.unlink(checkpoint_file.name)
+	with pytest.raises(RuntimeError):
+		AllPerceptRunner(FailingAlgorithm(5), kConfig, constants.kTestFile, checkpoint=checkpoint_file.name).run()
+	AllPerceptRunner(PassthroughAlgorithm(), kConfig, constants.kTestFile, checkpoint=checkpoint_file.name).run()
+	messages = [record.getMessage() for record in caplog.records]
+	assert 'Processing 7 percepts (skipping 5 checkpointed)' in messages
+	assert 'Finished processing 7 percepts' in messages
 
 def test_command_line():
 	algorithm = PassthroughAlgorithm()
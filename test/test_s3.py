@@ -1,8 +1,9 @@
-from rigor.s3 import RigorS3Client, BotoS3Client
+from rigor.s3 import RigorS3Client, BotoS3Client, BotoKeyReader, BufferReader, S3ClientCache, get_client
 from rigor.config import RigorDefaultConfiguration
 from s3 import setup_module, teardown_module, kKeys
 import pytest
 import constants
+import tempfile
 import os
 
 kConfig = RigorDefaultConfiguration(constants.kConfigFile)
@@ -22,12 +23,32 @@ class DummyS3Client(RigorS3Client):
 def client():
 	return BotoS3Client(kConfig, constants.kExampleBucket)
 
+@pytest.fixture
+def multipart_client(request):
+	# The S3 mock is not thread-safe, so parts are transferred by a single worker thread
+	config_file = tempfile.NamedTemporaryFile('w', prefix='rigor-test-', suffix='.ini', delete=False)
+	with config_file:
+		config_file.write('[s3]\nmultipart_threshold = 6291456\npart_size = 5242880\ntransfer_threads = 1\n')
+	request.addfinalizer(lambda: os.unlink(config_file.name))
+	config = RigorDefaultConfiguration(constants.kConfigFile, config_file.name)
+	return BotoS3Client(config, constants.kExampleBucket)
+
+@pytest.fixture
+def large_file(request):
+	data_file = tempfile.NamedTemporaryFile('wb', prefix='rigor-test-', delete=False)
+	with data_file:
+		data_file.write(os.urandom(12 * 1024 * 1024 + 17))
+	request.addfinalizer(lambda: os.unlink(data_file.name))
+	return data_file.name
+
 def test_dummy():
 	dummy = DummyS3Client(kConfig, constants.kExampleBucket)
 	dummy.get(kKeys[0])
 	dummy.put(kKeys[0], 'test')
 	dummy.delete(kKeys[0])
 	dummy.list()
+	assert dummy.copy('new-s3-key-7', kKeys[0]) is False
+	dummy.close()
 
 def test_init_client(client):
 	assert client is not None
@@ -45,6 +66,48 @@ def test_get_missing(client):
 	contents = client.get('xthanteohntahoeaoedhaod')
 	assert contents is None
 
+def test_open(client):
+	for index, key in enumerate(kKeys):
+		with client.open(key) as contents:
+			assert contents.size == 1
+			assert contents.read() == str(index)
+			assert contents.read() == ''
+
+def test_open_partial(client):
+	key = 'new-s3-key-10'
+	client.put(key, constants.kExampleTextFile)
+	with open(constants.kExampleTextFile, 'rb') as text_file:
+		text = text_file.read()
+	with client.open(key) as contents:
+		assert contents.read(5) == text[:5]
+		assert contents.read(5) == text[5:10]
+	assert client.get(key).read() == text
+
+def test_open_missing(client):
+	assert client.open('xthanteohntahoeaoedhaod') is None
+
+def test_readinto(client):
+	key = 'new-s3-key-11'
+	client.put(key, constants.kExampleTextFile)
+	with open(constants.kExampleTextFile, 'rb') as text_file:
+		text = text_file.read()
+	buf = bytearray(len(text) + 10)
+	assert client.readinto(key, buf) == len(text)
+	assert buf[:len(text)] == text
+	buf = bytearray(4)
+	assert client.readinto(key, buf) == 4
+	assert buf == text[:4]
+	assert client.readinto('xthanteohntahoeaoedhaod', buf) is None
+
+def test_readinto_default(client):
+	class BufferedS3Client(DummyS3Client):
+		def get(self, key, local_file=None):
+			return client.get(key, local_file)
+	buffered = BufferedS3Client(kConfig, constants.kExampleBucket)
+	buf = bytearray(2)
+	assert buffered.readinto(kKeys[2], buf) == 1
+	assert buf[:1] == '2'
+
 def test_get_local_file(client):
 	client.get(kKeys[0], constants.kExampleDownloadedFile)
 	with open(constants.kExampleDownloadedFile, 'rb') as data:
@@ -74,6 +137,27 @@ def test_delete(client):
 	client.delete(key)
 	assert client.get(key) is None
 
+def test_copy(client):
+	key = 'new-s3-key-8'
+	assert client.copy(key, kKeys[1])
+	with client.get(key) as contents:
+		assert contents.read() == '1'
+
+def test_delete_many(client):
+	keys = ['new-s3-key-16', 'new-s3-key-17']
+	for key in keys:
+		client.put(key, constants.kExampleTextFile)
+	client.delete_many(keys)
+	for key in keys:
+		assert client.get(key) is None
+
+def test_delete_many_default(client):
+	deleted = list()
+	dummy = DummyS3Client(kConfig, constants.kExampleBucket)
+	dummy.delete = deleted.append
+	dummy.delete_many(iter(kKeys))
+	assert deleted == list(kKeys)
+
 def test_list(client):
 	count = 0
 	for item in client.list():
@@ -86,3 +170,120 @@ def test_list_prefix(client):
 		count += 1
 		assert item.key in kKeys
 	assert count == 3
+
+def test_client_cache_reuse():
+	cache = S3ClientCache()
+	client = cache.get(kConfig, constants.kExampleBucket)
+	assert cache.get(kConfig, constants.kExampleBucket) is client
+	assert cache.get(kConfig, constants.kExampleBucket, constants.kExampleCredentials) is not client
+
+def test_client_cache_idle_eviction():
+	cache = S3ClientCache(idle_timeout=-1)
+	client = cache.get(kConfig, constants.kExampleBucket)
+	assert cache.get(kConfig, constants.kExampleBucket) is not client
+
+def test_client_cache_config(request):
+	cache = S3ClientCache()
+	client = cache.get(kConfig, constants.kExampleBucket)
+	assert cache.get(RigorDefaultConfiguration(constants.kConfigFile), constants.kExampleBucket) is client
+	config_file = tempfile.NamedTemporaryFile('w', prefix='rigor-test-', suffix='.ini', delete=False)
+	with config_file:
+		config_file.write('[s3]\npart_size = 5242880\n')
+	request.addfinalizer(lambda: os.unlink(config_file.name))
+	other_config = RigorDefaultConfiguration(constants.kConfigFile, config_file.name)
+	assert cache.get(other_config, constants.kExampleBucket) is not client
+	assert cache.get(kConfig, constants.kExampleBucket) is client
+
+def test_client_cache_busy():
+	cache = S3ClientCache(idle_timeout=-1)
+	client = cache.get(kConfig, constants.kExampleBucket)
+	contents = client.open(kKeys[0])
+	assert client.busy
+	assert cache.get(kConfig, constants.kExampleBucket) is client
+	assert contents.read() == '0'
+	contents.close()
+	assert not client.busy
+	assert cache.get(kConfig, constants.kExampleBucket) is not client
+
+def test_client_cache_clear():
+	cache = S3ClientCache()
+	client = cache.get(kConfig, constants.kExampleBucket)
+	cache.clear()
+	assert cache.get(kConfig, constants.kExampleBucket) is not client
+
+def test_get_client():
+	client = get_client(kConfig, constants.kExampleBucket)
+	assert get_client(kConfig, constants.kExampleBucket) is client
+	with client.get(kKeys[1]) as contents:
+		assert contents.read() == str(1)
+
+def test_multipart_put_filename(multipart_client, large_file):
+	key = 'new-s3-key-12'
+	multipart_client.put(key, large_file)
+	with open(large_file, 'rb') as data_file:
+		expected = data_file.read()
+	assert multipart_client.get(key).read() == expected
+	with multipart_client.open(key) as contents:
+		assert contents.read() == expected
+
+def test_multipart_put_open_file(multipart_client, large_file):
+	key = 'new-s3-key-13'
+	with open(large_file, 'rb') as data_file:
+		multipart_client.put(key, data_file)
+		data_file.seek(0)
+		expected = data_file.read()
+	with multipart_client.open(key) as contents:
+		assert contents.read() == expected
+
+def test_ranged_get(multipart_client, large_file):
+	key = 'new-s3-key-14'
+	with open(large_file, 'rb') as data_file:
+		expected = data_file.read()
+	multipart_client.put(key, large_file)
+	assert multipart_client.get(key).read() == expected
+	multipart_client.get(key, constants.kExampleDownloadedFile)
+	with open(constants.kExampleDownloadedFile, 'rb') as downloaded:
+		assert downloaded.read() == expected
+	buf = bytearray(len(expected) + 10)
+	assert multipart_client.readinto(key, buf) == len(expected)
+	assert buf[:len(expected)] == expected
+	buf = bytearray(7 * 1024 * 1024)
+	assert multipart_client.readinto(key, buf) == len(buf)
+	assert buf == expected[:len(buf)]
+
+def test_large_open_streams(multipart_client, large_file):
+	key = 'new-s3-key-17'
+	with open(large_file, 'rb') as data_file:
+		expected = data_file.read()
+	multipart_client.put(key, large_file)
+	with multipart_client.open(key) as contents:
+		assert isinstance(contents, BotoKeyReader)
+		assert multipart_client.busy
+		assert contents.read(10) == expected[:10]
+		assert contents.read() == expected[10:]
+	assert not multipart_client.busy
+	contents = multipart_client.get(key)
+	assert isinstance(contents, BufferReader)
+	assert contents.size == len(expected)
+	contents.seek(-7, os.SEEK_END)
+	assert contents.read() == expected[-7:]
+
+def test_buffer_reader():
+	contents = bytearray('0123456789')
+	with BufferReader(contents, 'digits') as data:
+		assert data.name == 'digits'
+		assert data.read(3) == '012'
+		buf = bytearray(4)
+		assert data.readinto(buf) == 4
+		assert buf == '3456'
+		assert data.tell() == 7
+		assert data.read() == '789'
+		assert data.read() == ''
+		data.seek(1)
+		assert data.read(2) == '12'
+
+def test_multipart_small_object(multipart_client):
+	key = 'new-s3-key-15'
+	multipart_client.put(key, constants.kExampleTextFile)
+	with open(constants.kExampleTextFile, 'rb') as text_file:
+		assert multipart_client.get(key).read() == text_file.read()
@@ -0,0 +1,57 @@
+from rigor.sinks import ListSink, FileSink, AggregateSink, EvaluatorSink
+from rigor.evaluator import ObjectAreaEvaluator
+from shapely.geometry import box
+import numpy as np
+import tempfile
+import os
+
+kResults = [
+	(dict(id=1), [box(0, 0, 10, 10)], [box(0, 0, 10, 10)], 0.5),
+	(dict(id=2), [box(0, 0, 10, 10), box(50, 50, 60, 60)], [box(1, 1, 11, 11)], 0.25),
+	(dict(id=3), list(), [box(20, 20, 30, 30)], 0.125),
+]
+
+def _extract(result):
+	return (result[2], result[1])
+
+def test_list_sink():
+	sink = ListSink()
+	for result in kResults:
+		sink.add(result)
+	assert sink.close() == kResults
+
+def test_file_sink():
+	with tempfile.NamedTemporaryFile(prefix='rigor-test-') as result_file:
+		sink = FileSink(result_file.name)
+		for result in kResults:
+			sink.add((result[0], result[3]))
+		assert sink.close() == (result_file.name, 3)
+		assert list(FileSink.read(result_file.name)) == [(result[0], result[3]) for result in kResults]
+
+def test_file_sink_abort():
+	with tempfile.NamedTemporaryFile(prefix='rigor-test-') as result_file:
+		sink = FileSink(result_file.name)
+		sink.add((kResults[0][0], kResults[0][3]))
+		sink.abort()
+		assert list(FileSink.read(result_file.name)) == [(kResults[0][0], kResults[0][3])]
+
+def test_aggregate_sink():
+	sink = AggregateSink(lambda total, result: total + result[3], 0.)
+	for result in kResults:
+		sink.add(result)
+	assert sink.close() == 0.875
+
+def test_evaluator_sink():
+	evaluator = ObjectAreaEvaluator()
+	sink = EvaluatorSink(evaluator, _extract)
+	for result in kResults:
+		sink.add(result)
+	corpus, per_image = sink.close()
+	expected = evaluator.evaluate_corpus(kResults, extract=_extract)
+	assert corpus == expected[0]
+	assert np.array_equal(per_image, expected[1])
+
+def test_evaluator_sink_empty():
+	corpus, per_image = EvaluatorSink(ObjectAreaEvaluator(), _extract).close()
+	assert corpus == (0., 0., (0., 0.), (0., 0.))
+	assert per_image.shape == (0, 6)
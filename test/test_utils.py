@@ -1,10 +1,11 @@
-from rigor.utils import RigorJSONEncoder, parse_timestamp, ensure_path_exists
+from rigor.utils import RigorJSONEncoder, parse_timestamp, ensure_path_exists, read_into
 from datetime import datetime
 import json
 import pytest
 import constants
 import os.path
 import shutil
+import io
 
 def test_json_encoder_date():
 	result = json.dumps({'a': 1, 'b': 2, 'c': '3', 'd': datetime(2015, 3, 17, 22, 37, 33, 29292), 'e': (1, 2), 'f': [3,3], 'g': {'h': 'i'}}, cls=RigorJSONEncoder)
@@ -47,3 +48,11 @@ def test_ensure_path_exists_exists():
 	assert os.path.exists(constants.kTestDirectory)
 	ensure_path_exists(constants.kTestDirectory)
 	shutil.rmtree(constants.kTestDirectory)
+
+def test_read_into():
+	buf = bytearray(10)
+	assert read_into(io.BytesIO('abc'), buf) == 3
+	assert buf[:3] == 'abc'
+	buf = bytearray(2)
+	assert read_into(io.BytesIO('abc'), buf) == 2
+	assert buf == 'ab'
@@ -7,7 +7,7 @@ import argparse
 from rigor.database import Database
 from rigor.config import RigorDefaultConfiguration
 from rigor.perceptops import PerceptOps
-from rigor.types import Percept, PerceptTag
+from rigor.types import PerceptTag
 
 def main():
 	parser = argparse.ArgumentParser(description='Deletes percepts from the database by tag and deletes the percept data files.')
@@ -26,19 +26,14 @@ def main():
 		print('DRY RUN')
 
 	with db.get_session() as session:
-		percepts = session.query(Percept).join(PerceptTag).filter(PerceptTag.name == args.tag).all()
-		if len(percepts) == 0:
+		percept_ids = [percept_id for percept_id, in session.query(PerceptTag.percept_id).filter(PerceptTag.name == args.tag)]
+		if len(percept_ids) == 0:
 			print('No percepts have the tag "{}"'.format(args.tag))
-		for ii, percept in enumerate(percepts):
-			print('{} of {}: deleting percept with id {}'.format(ii, len(percepts), percept.id))
-			if args.dryrun:
-				continue
-			if args.keep_percept_data:
-				# only delete database entry, not percept file
-				session.delete(percept)
-			else:
-				# delete percept data file as well as database entries
-				ops.destroy(percept, session)
+		else:
+			print('Deleting {} percepts'.format(len(percept_ids)))
+			if not args.dryrun:
+				# only delete percept data files if they are not being kept
+				ops.destroy_all(percept_ids, session, remove_data=not args.keep_percept_data)
 
 	if args.dryrun:
 		print('DRY RUN')
@@ -0,0 +1,38 @@
+"""
+Merges the shards of a sharded checkpoint, or any other checkpoint files, into
+a single checkpoint that can be resumed from. Duplicate entries for the same
+percept are removed.
+"""
+
+import argparse
+import os
+from rigor.checkpoint import merge, find_shards, index_filename
+
+def main():
+	parser = argparse.ArgumentParser(description='Merges checkpoint files, keeping the first entry saved for each percept.')
+	parser.add_argument('checkpoint', help='Path to the merged checkpoint. If no other files are given, the shards of this checkpoint are merged into it, along with the file itself if it exists.')
+	parser.add_argument('inputs', nargs='*', help='Checkpoint files to merge, in order of preference')
+	parser.add_argument('-r', '--remove-shards', action='store_true', default=False, help='Remove the shard files once they have been merged')
+	args = parser.parse_args()
+
+	shards = list()
+	inputs = args.inputs
+	if not inputs:
+		shards = find_shards(args.checkpoint)
+		inputs = list(shards)
+		if os.path.exists(args.checkpoint):
+			inputs.insert(0, args.checkpoint)
+	if not inputs:
+		parser.error('No checkpoint files to merge')
+
+	count = merge(inputs, args.checkpoint)
+	print('Merged {0} entries from {1} files into {2}'.format(count, len(inputs), args.checkpoint))
+
+	if args.remove_shards:
+		for shard in shards:
+			os.remove(shard)
+			if os.path.exists(index_filename(shard)):
+				os.remove(index_filename(shard))
+
+if __name__ == '__main__':
+	main()